@@ -6,32 +6,494 @@ CRM + Админ-панель для Telegram-бота "Виртуальный 
 import sqlite3
 import logging
 import asyncio
+import atexit
+import glob
+import html
 import json
+import os
 import csv
+import gzip
 import io
+import queue
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from pathlib import Path
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-import pandas as pd
 from collections import defaultdict, Counter
+from config import Config
+import request_timing
 
 logger = logging.getLogger(__name__)
 
+def compress_text(value):
+    """Сжимает длинный текст zlib в BLOB (короткий текст и уже сжатое не трогает)"""
+    if not isinstance(value, str) or len(value) < Config.RETENTION_COMPRESS_MIN_LENGTH:
+        return value
+    packed = zlib.compress(value.encode('utf-8'), 6)
+    return packed if len(packed) < len(value.encode('utf-8')) else value
+
+def decompress_text(value):
+    """Обратная к compress_text: BLOB -> текст, остальное без изменений"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
 class AdminPanel:
     """CRM + Админ-панель для управления ботом через Telegram"""
     
     # Список администраторов (user_id)
     ADMIN_IDS = {1914567632, 892033994}
     
+    # Миграции схемы: (версия, описание, шаги). Шаг - SQL-оператор или функция от курсора.
+    # Текущая версия хранится в PRAGMA user_version, каждая миграция применяется один раз
+    MIGRATIONS = [
+        (1, "Индексы для аналитики и админ-панели", [
+            # Покрывающий индекс для выборок за период (активные пользователи, типы, дни)
+            "CREATE INDEX IF NOT EXISTS idx_user_requests_timestamp "
+            "ON user_requests(timestamp, user_id, request_type)",
+            # Запросы конкретного пользователя и JOIN с users
+            "CREATE INDEX IF NOT EXISTS idx_user_requests_user_time ON user_requests(user_id, timestamp)",
+            # Группировка по типу запроса
+            "CREATE INDEX IF NOT EXISTS idx_user_requests_type_time ON user_requests(request_type, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_activity)",
+            # Статистика для планировщика: выбор между индексами по времени и по типу
+            "ANALYZE",
+        ]),
+        (2, "Суточные агрегаты для аналитики", [
+            # Запросы за сутки по типам
+            """CREATE TABLE IF NOT EXISTS rollup_daily_requests (
+                day TEXT NOT NULL,
+                request_type TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, request_type)
+            ) WITHOUT ROWID""",
+            # Уникальные активные пользователи за сутки
+            """CREATE TABLE IF NOT EXISTS rollup_daily_users (
+                day TEXT PRIMARY KEY,
+                active_users INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID""",
+            # Запросы пользователя за сутки
+            """CREATE TABLE IF NOT EXISTS rollup_user_daily (
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id)
+            ) WITHOUT ROWID""",
+            # Последние сутки активности пользователя: активные за N дней без COUNT(DISTINCT)
+            """CREATE TABLE IF NOT EXISTS rollup_user_last_day (
+                user_id INTEGER PRIMARY KEY,
+                day TEXT NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_rollup_user_last_day ON rollup_user_last_day(day)",
+            lambda cursor: AdminPanel.rebuild_rollups(cursor),
+        ]),
+        (3, "Постраничный вывод пользователей и счетчики", [
+            # Порядок «по запросам»; user_id (rowid) входит в индекс и разрешает равенства
+            "CREATE INDEX IF NOT EXISTS idx_users_total_requests ON users(total_requests)",
+            # Счетчики, которые поток записи поддерживает в той же транзакции
+            """CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID""",
+            "INSERT OR REPLACE INTO counters (name, value) SELECT 'users', COUNT(*) FROM users",
+        ]),
+        (4, "Время обработки запросов по этапам", [
+            # Одна строка на запрос: unix-время, тип и длительности в мс (NULL - этапа не было)
+            """CREATE TABLE IF NOT EXISTS request_timings (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                request_type TEXT NOT NULL,
+                total_ms INTEGER NOT NULL,
+                download_ms INTEGER,
+                extract_ms INTEGER,
+                whisper_ms INTEGER,
+                perplexity_ms INTEGER,
+                gpt_ms INTEGER,
+                tts_ms INTEGER,
+                send_ms INTEGER
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_request_timings_ts ON request_timings(ts)",
+        ]),
+        (5, "Полнотекстовый поиск по запросам", [
+            # Тексты старых запросов сжаты - FTS5 читает их (для snippet) через представление с unz()
+            """CREATE VIEW IF NOT EXISTS requests_fts_content AS
+                SELECT id, unz(request_text) AS request_text FROM user_requests""",
+            # Индекс без своей копии текстов; синхронизирует поток записи (log_user_request, архивы).
+            # prefix='5': поиск по основе из 5 букв (см. fts_query) без слияния списков всех форм слова
+            """CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+                request_text,
+                content='requests_fts_content',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='5'
+            )""",
+            "INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')",
+        ]),
+        (6, "Суточные агрегаты по пользователям и типам запросов", [
+            # Источник когортной аналитики (analytics.py): ключ начинается с типа - выборка по типу без сортировки
+            """CREATE TABLE IF NOT EXISTS rollup_user_type_daily (
+                request_type TEXT NOT NULL,
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (request_type, day, user_id)
+            ) WITHOUT ROWID""",
+            lambda cursor: AdminPanel.rebuild_type_rollup(cursor),
+        ]),
+    ]
+    
+    # Сколько архивов месяцев можно подключить к одному соединению (лимит SQLite - 10)
+    ARCHIVE_ATTACH_LIMIT = 8
+    
+    # Порядки списка пользователей: код в callback_data -> колонка
+    USER_ORDERS = {'a': 'last_activity', 'r': 'total_requests'}
+    
+    # Границы совпадения в snippet() (заменяются на <b></b> после экранирования HTML)
+    SEARCH_MARK_OPEN, SEARCH_MARK_CLOSE = "\x02", "\x03"
+    # Не больше слов в поисковом запросе
+    SEARCH_MAX_TERMS = 8
+    # Длина основы слова для поиска (совпадает с prefix='5' индекса requests_fts)
+    SEARCH_STEM_LENGTH = 5
+    
     def __init__(self, db_path: str = "bot_database.db"):
         self.db_path = db_path
+        
+        # Долгоживущее соединение для записи: после инициализации им владеет только поток записи
+        self._conn = self._connect()
+        # Соединение для чтений админ-панели; после первого снимка - со снимком (refresh_snapshot)
+        self._reader = self._connect()
+        self._read_lock = threading.Lock()
+        
         self.init_database()
+        
+        # Кэш страниц списка пользователей: ключ -> (время, страница)
+        self._page_cache: Dict[tuple, Tuple[float, Dict]] = {}
+        
+        # Снимок базы для чтений админ-панели (до первого снимка читаем рабочую базу).
+        # Каждый снимок - новый файл <база>_snapshot_<версия>.db: открытый файл нельзя
+        # заменить в Windows, поэтому старые снимки удаляются, когда их никто не читает
+        self._snapshot_prefix = f"{os.path.splitext(db_path)[0]}_snapshot"
+        self.snapshot_path: Optional[str] = None
+        self._snapshot_version = 0
+        self._snapshot_users: Dict[str, int] = {}       # Путь снимка -> открытых соединений
+        self._snapshot_connections: Dict[int, str] = {}  # id(соединения) -> путь снимка
+        self._snapshot_files_lock = threading.Lock()
+        self._remove_stale_snapshots()
+        self.snapshot_time: Optional[datetime] = None
+        self.snapshot_stats = {'refreshes': 0, 'failed': 0, 'last_duration': 0.0, 'bytes': 0}
+        self._snapshot_stop = threading.Event()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        
+        # Очередь записи: обработчики только ставят операции в очередь и не ждут диск
+        self._queue: "queue.Queue" = queue.Queue(maxsize=Config.ADMIN_DB_QUEUE_SIZE)
+        self.write_stats = {
+            'queued': 0,
+            'written': 0,
+            'failed': 0,
+            'dropped': 0,   # Очередь переполнена
+            'batches': 0,
+            'max_batch': 0
+        }
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="admin-db-writer", daemon=True)
+        self._writer.start()
+        
+        # Активность пользователей копится в памяти и пишется пачкой раз в ADMIN_USERS_FLUSH_INTERVAL:
+        # user_id -> {имя, last_activity, requests - сколько обращений еще не записано, first_seen}
+        self._active_users: Dict[int, Dict] = {}
+        self._active_users_lock = threading.Lock()
+        self.users_stats = {'flushes': 0, 'flushed_users': 0, 'activity_calls': 0}
+        self._users_stop = threading.Event()
+        self._users_thread = threading.Thread(target=self._users_flush_loop, name="admin-users-flush", daemon=True)
+        self._users_thread.start()
+        atexit.register(self.close)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение с настройками для частой записи"""
+        conn = sqlite3.connect(self.db_path, timeout=10.0, check_same_thread=False, uri=True)
+        self._register_functions(conn)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")   # В режиме WAL безопасно и намного быстрее FULL
+        conn.execute("PRAGMA busy_timeout=10000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")    # ~16 МБ страничного кэша
+        return conn
+    
+    @staticmethod
+    def _register_functions(conn: sqlite3.Connection):
+        # Тексты старых запросов хранятся сжатыми (см. retention.py): unz(колонка) в SQL
+        conn.create_function("unz", 1, decompress_text, deterministic=True)
+        conn.create_function("zip_text", 1, compress_text, deterministic=True)
+    
+    # ---------- Снимок для чтения ----------
+    
+    def _open_snapshot(self, path: str) -> sqlite3.Connection:
+        """Соединение только для чтения со снимком базы (закрывать через _close_read_connection)"""
+        uri = f"{Path(os.path.abspath(path)).as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        self._register_functions(conn)
+        with self._snapshot_files_lock:
+            self._snapshot_users[path] = self._snapshot_users.get(path, 0) + 1
+            self._snapshot_connections[id(conn)] = path
+        return conn
+    
+    def _open_read_connection(self) -> sqlite3.Connection:
+        """Отдельное соединение для долгих чтений: снимок, если он уже есть"""
+        with self._read_lock:
+            path = self.snapshot_path
+            if path is not None:
+                return self._open_snapshot(path)
+        return self._connect()
+    
+    def _close_read_connection(self, conn: sqlite3.Connection):
+        """Закрывает соединение чтения; снимок, который больше никто не читает, удаляется"""
+        conn.close()
+        with self._snapshot_files_lock:
+            path = self._snapshot_connections.pop(id(conn), None)
+            if path is None:
+                return
+            self._snapshot_users[path] -= 1
+            if self._snapshot_users[path] == 0:
+                del self._snapshot_users[path]
+        self._remove_stale_snapshots()
+    
+    def _remove_stale_snapshots(self):
+        """Удаляет файлы снимков, кроме текущего и открытых (в т.ч. оставшиеся от прошлого запуска)"""
+        with self._snapshot_files_lock:
+            for path in glob.glob(f"{glob.escape(self._snapshot_prefix)}*.db*"):
+                base = path[:path.rindex(".db") + 3]
+                if base == self.snapshot_path or base in self._snapshot_users:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass    # Файл еще открыт (Windows) - удалим при следующем обновлении
+    
+    def refresh_snapshot(self) -> bool:
+        """Обновляет снимок базы через online backup API и переключает на него чтения админки
+        
+        Копия делается в новый файл, и чтения переключаются на него; прежний
+        снимок удаляется, когда закрыты все его соединения (экспорт может
+        еще читать его). В режиме WAL копирование не блокирует запись
+        аналитики, а чтения админ-панели и экспорт больше не обращаются
+        к рабочей базе.
+        """
+        with self._snapshot_lock:
+            return self._refresh_snapshot()
+    
+    def _refresh_snapshot(self) -> bool:
+        started = time.monotonic()
+        self._snapshot_version = max(self._snapshot_version + 1, int(time.time() * 1000))
+        path = f"{self._snapshot_prefix}_{self._snapshot_version}.db"
+        temp_path = f"{path}.tmp"
+        try:
+            # Снимок включает накопленную в памяти активность пользователей
+            self.flush_users()
+            self.run_maintenance(lambda conn: None).result()
+            
+            source = self._connect()
+            target = sqlite3.connect(temp_path)
+            try:
+                source.backup(target)
+                # Снимок открывается только для чтения - без WAL и файлов -wal/-shm
+                target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+                source.close()
+            # Новый файл, который еще никто не открывал, - переименование безопасно и в Windows
+            os.replace(temp_path, path)
+            reader = self._open_snapshot(path)
+        except Exception as e:
+            self.snapshot_stats['failed'] += 1
+            logger.error(f"❌ Ошибка обновления снимка базы: {e}")
+            for leftover in (temp_path, path):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            return False
+        
+        with self._read_lock:
+            previous, self._reader = self._reader, reader
+            self.snapshot_path = path
+            self.snapshot_time = datetime.now()
+            self._page_cache.clear()
+        self._close_read_connection(previous)
+        
+        self.snapshot_stats['refreshes'] += 1
+        self.snapshot_stats['last_duration'] = time.monotonic() - started
+        self.snapshot_stats['bytes'] = os.path.getsize(path)
+        return True
+    
+    def start_snapshots(self):
+        """Запускает периодическое обновление снимка (раз в ADMIN_SNAPSHOT_INTERVAL)"""
+        if self._snapshot_thread is not None:
+            return
+        
+        def snapshot_loop():
+            while not self._snapshot_stop.is_set():
+                self.refresh_snapshot()
+                self._snapshot_stop.wait(Config.ADMIN_SNAPSHOT_INTERVAL)
+        
+        self._snapshot_thread = threading.Thread(target=snapshot_loop, name="admin-db-snapshot", daemon=True)
+        self._snapshot_thread.start()
+    
+    def data_as_of(self) -> str:
+        """Момент, на который актуальны данные админ-панели"""
+        if self.snapshot_time is None:
+            return "сейчас"
+        return self.snapshot_time.strftime('%d.%m.%Y %H:%M:%S')
+    
+    def get_snapshot_stats(self) -> Dict:
+        return {**self.snapshot_stats, 'data_as_of': self.data_as_of()}
+    
+    # ---------- Фоновая запись ----------
+    
+    def submit(self, operation: Callable[[sqlite3.Cursor], None], block: bool = False):
+        """Ставит операцию записи в очередь; выполняется в потоке записи в общей транзакции
+        
+        block=True - ждать места в очереди вместо пропуска записи (для фоновых потоков).
+        """
+        if self._closed:
+            logger.warning("⚠️ База данных CRM закрыта, запись пропущена")
+            return
+        try:
+            self._queue.put(operation, block=block)
+            self.write_stats['queued'] += 1
+        except queue.Full:
+            self.write_stats['dropped'] += 1
+            logger.warning("⚠️ Очередь записи CRM переполнена, запись пропущена")
+    
+    def run_maintenance(self, operation: Callable[[sqlite3.Connection], object]) -> Future:
+        """Выполняет операцию обслуживания в потоке записи, вне пакетной транзакции
+        
+        Операция получает соединение целиком (ATTACH, VACUUM, свои транзакции)
+        и выполняется между пачками, поэтому не конкурирует с записью аналитики.
+        Возвращает Future с результатом операции.
+        """
+        future: Future = Future()
+        
+        def maintenance(conn: sqlite3.Connection):
+            try:
+                future.set_result(operation(conn))
+            except Exception as e:
+                future.set_exception(e)
+        
+        maintenance.exclusive = True
+        if self._closed:
+            future.set_exception(RuntimeError("База данных CRM закрыта"))
+        else:
+            # Обслуживание не пропускаем при переполнении очереди - ждем места
+            self._queue.put(maintenance)
+        return future
+    
+    def _writer_loop(self):
+        """Поток записи: собирает операции в пачки и пишет одной транзакцией"""
+        while True:
+            operation = self._queue.get()
+            batch = [operation]
+            
+            # Добираем пачку: все, что накопилось, но не дольше интервала сброса
+            deadline = time.monotonic() + Config.ADMIN_DB_FLUSH_INTERVAL
+            # (операцию обслуживания выполняем сразу: ее ждет вызывающий поток)
+            while (operation is not None and not getattr(operation, 'exclusive', False)
+                   and len(batch) < Config.ADMIN_DB_BATCH_SIZE):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    operation = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(operation)
+            
+            operations = [op for op in batch if op is not None]
+            if operations:
+                self._run_operations(operations)
+            for _ in batch:
+                self._queue.task_done()
+            
+            # None - сигнал остановки
+            if len(operations) != len(batch):
+                return
+    
+    def _run_operations(self, operations: List[Callable]):
+        """Пишет пачками, а операции обслуживания выполняет отдельно между ними"""
+        pending = []
+        for operation in operations:
+            if getattr(operation, 'exclusive', False):
+                if pending:
+                    self._write_batch(pending)
+                    pending = []
+                operation(self._conn)
+            else:
+                pending.append(operation)
+        if pending:
+            self._write_batch(pending)
+    
+    def _write_batch(self, operations: List[Callable]):
+        try:
+            with self._conn:
+                cursor = self._conn.cursor()
+                for operation in operations:
+                    operation(cursor)
+            self.write_stats['written'] += len(operations)
+        except Exception as e:
+            # Пачка откатилась - повторяем по одной, чтобы не потерять остальные записи
+            logger.error(f"❌ Ошибка пакетной записи в CRM ({len(operations)} операций): {e}")
+            for operation in operations:
+                try:
+                    with self._conn:
+                        operation(self._conn.cursor())
+                    self.write_stats['written'] += 1
+                except Exception as e:
+                    self.write_stats['failed'] += 1
+                    logger.error(f"❌ Ошибка записи в CRM: {e}")
+        self.write_stats['batches'] += 1
+        self.write_stats['max_batch'] = max(self.write_stats['max_batch'], len(operations))
+    
+    def flush(self):
+        """Ждет, пока все поставленные в очередь записи попадут в базу"""
+        self._queue.join()
+    
+    def close(self):
+        """Дописывает очередь и закрывает соединения (при остановке бота)"""
+        if self._closed:
+            return
+        self._snapshot_stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        # Последняя пачка активности пользователей - до сигнала остановки потока записи
+        self._users_stop.set()
+        self._users_thread.join()
+        self.flush_users()
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._conn.close()
+        with self._read_lock:
+            reader = self._reader
+        self._close_read_connection(reader)
+        logger.info(f"💾 База данных CRM закрыта, записано операций: {self.write_stats['written']}")
+    
+    def get_write_stats(self) -> Dict:
+        return {**self.write_stats, **self.users_stats, 'queue_depth': self._queue.qsize(),
+                'pending_users': len(self._active_users)}
     
     def init_database(self):
         """Инициализация базы данных SQLite"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn
             cursor = conn.cursor()
             
             # Таблица пользователей
@@ -87,75 +549,239 @@ class AdminPanel:
             """)
             
             conn.commit()
-            conn.close()
+            self.apply_migrations(conn)
             logger.info("✅ База данных CRM инициализирована")
             
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации базы данных: {e}")
     
+    @classmethod
+    def apply_migrations(cls, conn: sqlite3.Connection):
+        """Применяет недостающие миграции, каждую в своей транзакции"""
+        # Шаги миграций могут использовать unz()/zip_text()
+        cls._register_functions(conn)
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, description, steps in cls.MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"🛠 Миграция базы данных #{version}: {description}")
+            started = time.monotonic()
+            conn.execute("BEGIN")
+            try:
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f"✅ Миграция #{version} применена за {time.monotonic() - started:.1f} с")
+    
+    @staticmethod
+    def rebuild_rollups(cursor: sqlite3.Cursor):
+        """Пересчитывает суточные агрегаты по всей истории user_requests"""
+        cursor.execute("DELETE FROM rollup_daily_requests")
+        cursor.execute("DELETE FROM rollup_user_daily")
+        cursor.execute("DELETE FROM rollup_daily_users")
+        cursor.execute("DELETE FROM rollup_user_last_day")
+        cursor.execute("""
+            INSERT INTO rollup_daily_requests (day, request_type, requests)
+            SELECT substr(timestamp, 1, 10), COALESCE(NULLIF(request_type, ''), 'unknown'), COUNT(*)
+            FROM user_requests
+            WHERE timestamp IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        cursor.execute("""
+            INSERT INTO rollup_user_daily (day, user_id, requests)
+            SELECT substr(timestamp, 1, 10), user_id, COUNT(*)
+            FROM user_requests
+            WHERE timestamp IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        cursor.execute("""
+            INSERT INTO rollup_daily_users (day, active_users)
+            SELECT day, COUNT(*) FROM rollup_user_daily GROUP BY day
+        """)
+        cursor.execute("""
+            INSERT INTO rollup_user_last_day (user_id, day)
+            SELECT user_id, MAX(day) FROM rollup_user_daily GROUP BY user_id
+        """)
+    
+    @staticmethod
+    def rebuild_type_rollup(cursor: sqlite3.Cursor):
+        """Пересчитывает rollup_user_type_daily по истории user_requests (архивы не учитываются)"""
+        cursor.execute("DELETE FROM rollup_user_type_daily")
+        cursor.execute("""
+            INSERT INTO rollup_user_type_daily (request_type, day, user_id, requests)
+            SELECT COALESCE(NULLIF(request_type, ''), 'unknown'), substr(timestamp, 1, 10), user_id, COUNT(*)
+            FROM user_requests
+            WHERE timestamp IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY 1, 2, 3
+        """)
+    
+    @staticmethod
+    def _update_rollups(cursor: sqlite3.Cursor, day: str, user_id: int, request_type: str):
+        """Добавляет один запрос в суточные агрегаты (в транзакции записи пачки)"""
+        cursor.execute("""
+            INSERT INTO rollup_daily_requests (day, request_type, requests) VALUES (?, ?, 1)
+            ON CONFLICT (day, request_type) DO UPDATE SET requests = requests + 1
+        """, (day, request_type or 'unknown'))
+        if user_id is None:
+            return
+        cursor.execute("""
+            INSERT INTO rollup_user_type_daily (request_type, day, user_id, requests) VALUES (?, ?, ?, 1)
+            ON CONFLICT (request_type, day, user_id) DO UPDATE SET requests = requests + 1
+        """, (request_type or 'unknown', day, user_id))
+        cursor.execute("INSERT OR IGNORE INTO rollup_user_daily (day, user_id, requests) VALUES (?, ?, 0)",
+                       (day, user_id))
+        if cursor.rowcount:
+            # Первый запрос пользователя за сутки
+            cursor.execute("""
+                INSERT INTO rollup_daily_users (day, active_users) VALUES (?, 1)
+                ON CONFLICT (day) DO UPDATE SET active_users = active_users + 1
+            """, (day,))
+            cursor.execute("""
+                INSERT INTO rollup_user_last_day (user_id, day) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET day = MAX(day, excluded.day)
+            """, (user_id, day))
+        cursor.execute("UPDATE rollup_user_daily SET requests = requests + 1 WHERE day = ? AND user_id = ?",
+                       (day, user_id))
+    
+    @staticmethod
+    def _utc_day(days_ago: int = 0) -> str:
+        """Сутки в формате YYYY-MM-DD по UTC, как во временных метках user_requests"""
+        return (datetime.utcnow() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+    
     def is_admin(self, user_id: int) -> bool:
         """Проверяет, является ли пользователь администратором"""
         return user_id in self.ADMIN_IDS
     
     def log_user_activity(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
-        """Логирует активность пользователя"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+        """Логирует активность пользователя (в памяти; в базу - пачкой, см. flush_users)"""
+        # Время фиксируем в момент события, а не в момент записи пачки
+        now = datetime.now()
+        
+        with self._active_users_lock:
+            self.users_stats['activity_calls'] += 1
+            user = self._active_users.get(user_id)
+            if user is None:
+                user = self._active_users[user_id] = {'requests': 0, 'first_seen': now}
+            user['username'] = username
+            user['first_name'] = first_name
+            user['last_name'] = last_name
+            user['last_activity'] = now
+            user['requests'] += 1
+    
+    def flush_users(self):
+        """Записывает накопленную активность пользователей одной операцией (UPSERT)"""
+        with self._active_users_lock:
+            if not self._active_users:
+                return
+            users, self._active_users = self._active_users, {}
+        
+        rows = [
+            (user_id, user['username'], user['first_name'], user['last_name'],
+             user['last_activity'], user['requests'], user['first_seen'])
+            for user_id, user in users.items()
+        ]
+        
+        def write(cursor: sqlite3.Cursor):
+            # Новые пользователи - для счетчика 'users'
+            user_ids = list(users)
+            existing = 0
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                cursor.execute(f"SELECT COUNT(*) FROM users WHERE user_id IN ({','.join('?' * len(chunk))})",
+                               chunk)
+                existing += cursor.fetchone()[0]
             
-            # Обновляем или создаем запись пользователя
-            cursor.execute("""
-                INSERT OR REPLACE INTO users 
+            cursor.executemany("""
+                INSERT INTO users 
                 (user_id, username, first_name, last_name, last_activity, total_requests,
                  registration_date, is_active)
-                VALUES (?, ?, ?, ?, ?, 
-                        COALESCE((SELECT total_requests FROM users WHERE user_id = ?), 0) + 1,
-                        COALESCE((SELECT registration_date FROM users WHERE user_id = ?), ?),
-                        1)
-            """, (user_id, username, first_name, last_name, datetime.now(), 
-                  user_id, user_id, datetime.now()))
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка логирования активности пользователя: {e}")
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    last_activity = excluded.last_activity,
+                    total_requests = users.total_requests + excluded.total_requests,
+                    is_active = 1
+            """, rows)
+            if len(user_ids) > existing:
+                cursor.execute("UPDATE counters SET value = value + ? WHERE name = 'users'",
+                               (len(user_ids) - existing,))
+        
+        self.submit(write, block=True)
+        self.users_stats['flushes'] += 1
+        self.users_stats['flushed_users'] += len(rows)
+    
+    def _users_flush_loop(self):
+        while not self._users_stop.wait(Config.ADMIN_USERS_FLUSH_INTERVAL):
+            try:
+                self.flush_users()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи активности пользователей: {e}")
     
     def log_user_request(self, user_id: int, request_type: str, request_text: str, 
                         response_text: str = "", processing_time: float = 0.0):
-        """Логирует запрос пользователя"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
+        """Логирует запрос пользователя (запись в фоне)"""
+        # Тот же формат и часовой пояс (UTC), что у CURRENT_TIMESTAMP по умолчанию
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        
+        def write(cursor: sqlite3.Cursor, processing_time: float = processing_time):
             cursor.execute("""
                 INSERT INTO user_requests 
-                (user_id, request_type, request_text, response_text, processing_time)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, request_type, request_text, response_text, processing_time))
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка логирования запроса: {e}")
+                (user_id, request_type, request_text, response_text, processing_time, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, request_type, request_text, response_text, processing_time, timestamp))
+            cursor.execute("INSERT INTO requests_fts (rowid, request_text) VALUES (?, ?)",
+                           (cursor.lastrowid, request_text))
+            self._update_rollups(cursor, timestamp[:10], user_id, request_type)
+        
+        timer = request_timing.current_timer()
+        if timer is not None and not processing_time:
+            # Внутри обработчика: запишем после его завершения с реальным временем обработки
+            if timer.request_type is None:
+                timer.request_type = request_type
+            timer.on_finish(lambda finished: self.submit(
+                lambda cursor: write(cursor, round(finished.total, 3))
+            ))
+            return
+        
+        self.submit(write)
+    
+    def log_request_timing(self, timer: "request_timing.RequestTimer"):
+        """Записывает время этапов обработанного запроса (запись в фоне)"""
+        ts = int(time.time())
+        row = [ts, timer.request_type, round(timer.total * 1000)]
+        row += [round(timer.stages[name] * 1000) if name in timer.stages else None
+                for name in request_timing.STAGES]
+        columns = ", ".join(f"{name}_ms" for name in request_timing.STAGES)
+        
+        def write(cursor: sqlite3.Cursor):
+            cursor.execute(f"""
+                INSERT INTO request_timings (ts, request_type, total_ms, {columns})
+                VALUES ({", ".join("?" * len(row))})
+            """, row)
+        
+        self.submit(write)
     
     def log_system_event(self, event_type: str, event_data: str, user_id: int = None):
-        """Логирует системное событие"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
+        """Логирует системное событие (запись в фоне)"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        
+        def write(cursor: sqlite3.Cursor):
             cursor.execute("""
-                INSERT INTO system_events (event_type, event_data, user_id)
-                VALUES (?, ?, ?)
-            """, (event_type, event_data, user_id))
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка логирования события: {e}")
+                INSERT INTO system_events (event_type, event_data, user_id, timestamp)
+                VALUES (?, ?, ?, ?)
+            """, (event_type, event_data, user_id, timestamp))
+        
+        self.submit(write)
     
     def get_admin_keyboard(self) -> InlineKeyboardMarkup:
         """Возвращает клавиатуру админ-панели"""
@@ -169,62 +795,69 @@ class AdminPanel:
         return keyboard
     
     def get_analytics_data(self, days: int = 7) -> Dict:
-        """Получает аналитические данные за период"""
+        """Получает аналитические данные за период (по суточным агрегатам)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._read_lock:
+                conn = self._reader
+                cursor = conn.cursor()
             
-            start_date = datetime.now() - timedelta(days=days)
+                # Период - целые сутки, включая сегодняшние
+                start_day = self._utc_day(days - 1)
             
-            # Активные пользователи
-            cursor.execute("""
-                SELECT COUNT(DISTINCT user_id) as active_users
-                FROM user_requests 
-                WHERE timestamp >= ?
-            """, (start_date,))
-            active_users = cursor.fetchone()[0]
+                # Активные пользователи
+                cursor.execute("""
+                    SELECT COUNT(*) as active_users
+                    FROM rollup_user_last_day 
+                    WHERE day >= ?
+                """, (start_day,))
+                active_users = cursor.fetchone()[0]
             
-            # Общее количество запросов
-            cursor.execute("""
-                SELECT COUNT(*) as total_requests
-                FROM user_requests 
-                WHERE timestamp >= ?
-            """, (start_date,))
-            total_requests = cursor.fetchone()[0]
+                # Общее количество запросов
+                cursor.execute("""
+                    SELECT COALESCE(SUM(requests), 0) as total_requests
+                    FROM rollup_daily_requests 
+                    WHERE day >= ?
+                """, (start_day,))
+                total_requests = cursor.fetchone()[0]
             
-            # Топ пользователь по запросам
-            cursor.execute("""
-                SELECT u.user_id, u.first_name, u.username, COUNT(r.id) as request_count
-                FROM users u
-                JOIN user_requests r ON u.user_id = r.user_id
-                WHERE r.timestamp >= ?
-                GROUP BY u.user_id
-                ORDER BY request_count DESC
-                LIMIT 1
-            """, (start_date,))
-            top_user = cursor.fetchone()
-            
-            # Статистика по типам запросов
-            cursor.execute("""
-                SELECT request_type, COUNT(*) as count
-                FROM user_requests 
-                WHERE timestamp >= ?
-                GROUP BY request_type
-                ORDER BY count DESC
-            """, (start_date,))
-            request_types = cursor.fetchall()
-            
-            # Активность по дням
-            cursor.execute("""
-                SELECT DATE(timestamp) as date, COUNT(*) as requests
-                FROM user_requests 
-                WHERE timestamp >= ?
-                GROUP BY DATE(timestamp)
-                ORDER BY date
-            """, (start_date,))
-            daily_activity = cursor.fetchall()
+                # Топ пользователь по запросам
+                cursor.execute("""
+                    SELECT u.user_id, u.first_name, u.username, r.request_count
+                    FROM (
+                        SELECT user_id, SUM(requests) as request_count
+                        FROM rollup_user_daily
+                        WHERE day >= ?
+                        GROUP BY user_id
+                    ) r
+                    JOIN users u ON u.user_id = r.user_id
+                    ORDER BY r.request_count DESC
+                    LIMIT 1
+                """, (start_day,))
+                top_user = cursor.fetchone()
+            
+                # Статистика по типам запросов
+                cursor.execute("""
+                    SELECT request_type, SUM(requests) as count
+                    FROM rollup_daily_requests 
+                    WHERE day >= ?
+                    GROUP BY request_type
+                    ORDER BY count DESC
+                """, (start_day,))
+                request_types = cursor.fetchall()
             
-            conn.close()
+                # Активность по дням: запросы и уникальные активные пользователи за сутки
+                cursor.execute("""
+                    SELECT r.day as date, r.requests, COALESCE(u.active_users, 0) as active_users
+                    FROM (
+                        SELECT day, SUM(requests) as requests
+                        FROM rollup_daily_requests 
+                        WHERE day >= ?
+                        GROUP BY day
+                    ) r
+                    LEFT JOIN rollup_daily_users u ON u.day = r.day
+                    ORDER BY r.day
+                """, (start_day,))
+                daily_activity = cursor.fetchall()
             
             return {
                 'active_users': active_users,
@@ -264,30 +897,278 @@ class AdminPanel:
         
         if analytics['daily_activity']:
             message += "\n\n📅 <b>Активность по дням:</b>"
-            for date, requests in analytics['daily_activity'][-7:]:
-                message += f"\n• {date}: {requests} запросов"
+            for date, requests, active_users in analytics['daily_activity'][-7:]:
+                message += f"\n• {date}: {requests} запросов, {active_users} пользователей"
         
         return message
     
-    def get_users_list(self, page: int = 1, limit: int = 10) -> Tuple[List[Dict], int]:
-        """Получает список пользователей с пагинацией"""
+    def get_dashboard_stats(self) -> Dict:
+        """Сводка для главного экрана админ-панели"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            now = datetime.now()
+            
+            with self._read_lock:
+                cursor = self._reader.cursor()
+                
+                total_users = self._users_count(cursor)
+                
+                # Активные за сутки (тот же формат даты, что и при записи last_activity)
+                cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > ?",
+                               (str(now - timedelta(days=1)),))
+                active_today = cursor.fetchone()[0] or 0
+                
+                cursor.execute("SELECT SUM(requests) FROM rollup_daily_requests WHERE day = ?",
+                               (self._utc_day(),))
+                requests_today = cursor.fetchone()[0] or 0
+                
+                cursor.execute("""
+                    SELECT first_name, username, total_requests 
+                    FROM users 
+                    WHERE total_requests IS NOT NULL AND total_requests > 0
+                    ORDER BY total_requests DESC 
+                    LIMIT 1
+                """)
+                top_user_data = cursor.fetchone()
             
-            offset = (page - 1) * limit
+            if top_user_data:
+                name = top_user_data[0] or top_user_data[1] or "Неизвестный"
+                top_user = f"{name} ({top_user_data[2] or 0} запросов)"
+            else:
+                top_user = "Нет данных"
+            
+            return {
+                'total_users': total_users,
+                'active_today': active_today,
+                'requests_today': requests_today,
+                'top_user': top_user
+            }
+            
+        except sqlite3.OperationalError as e:
+            logger.error(f"❌ Ошибка базы данных: {e}")
+            return {'total_users': 0, 'active_today': 0, 'requests_today': 0, 'top_user': "БД недоступна"}
+        except Exception as e:
+            logger.error(f"❌ Общая ошибка получения статистики: {e}")
+            return {'total_users': 0, 'active_today': 0, 'requests_today': 0, 'top_user': "Ошибка загрузки"}
+    
+    def get_weekly_summary(self) -> Tuple[int, List[Tuple[str, int]]]:
+        """Запросы за 7 дней и самые популярные типы запросов (по суточным агрегатам)"""
+        with self._read_lock:
+            cursor = self._reader.cursor()
+            
+            cursor.execute("SELECT SUM(requests) FROM rollup_daily_requests WHERE day >= ?",
+                           (self._utc_day(6),))
+            requests_week = cursor.fetchone()[0] or 0
             
-            # Получаем пользователей
             cursor.execute("""
+                SELECT request_type, SUM(requests) as count 
+                FROM rollup_daily_requests 
+                GROUP BY request_type 
+                ORDER BY count DESC 
+                LIMIT 5
+            """)
+            popular_types = cursor.fetchall()
+        
+        return requests_week, popular_types
+    
+    def get_recent_requests(self, limit: int = 10) -> List[Tuple]:
+        """Последние запросы: (timestamp, first_name, username, request_type, request_text)"""
+        with self._read_lock:
+            cursor = self._reader.cursor()
+            cursor.execute("""
+                SELECT ur.timestamp, u.first_name, u.username, ur.request_type, unz(ur.request_text)
+                FROM user_requests ur
+                JOIN users u ON ur.user_id = u.user_id
+                ORDER BY ur.timestamp DESC
+                LIMIT ?
+            """, (limit,))
+            return cursor.fetchall()
+    
+    def get_timing_percentiles(self, days: int = None) -> Dict[str, Dict]:
+        """Перцентили времени обработки по этапам и типам запросов за последние days суток"""
+        days = days or Config.TIMING_WINDOW_DAYS
+        since = int(time.time()) - days * 86400
+        columns = ", ".join(f"{name}_ms" for name in ("total",) + request_timing.STAGES)
+        with self._read_lock:
+            rows = self._reader.execute(f"""
+                SELECT request_type, {columns}
+                FROM request_timings
+                WHERE ts >= ?
+            """, (since,)).fetchall()
+        
+        if not rows:
+            return {}
+        # NULL -> NaN: этапа не было, перцентили его не учитывают
+        values = np.array([row[1:] for row in rows], dtype=float)
+        return request_timing.percentiles_by_type([row[0] for row in rows], values)
+    
+    @classmethod
+    def fts_query(cls, text: str) -> Optional[str]:
+        """
+        Поисковая строка администратора -> безопасное выражение FTS5 MATCH.
+        
+        Слова берутся в кавычки (синтаксис FTS5 в тексте не действует). Длинные слова
+        ищутся по первым SEARCH_STEM_LENGTH буквам - грубая замена стемминга для русского
+        («зарплату» находит «зарплата», «зарплаты»), такие префиксы есть в индексе.
+        Короткие слова и числа ищутся точно.
+        """
+        terms = []
+        for word in re.findall(r"\w+", text.lower())[:cls.SEARCH_MAX_TERMS]:
+            if word.isalpha() and len(word) >= cls.SEARCH_STEM_LENGTH:
+                terms.append(f'"{word[:cls.SEARCH_STEM_LENGTH]}"*')
+            else:
+                terms.append(f'"{word}"')
+        return " ".join(terms) or None
+    
+    def search_requests(self, text: str, page: int = 1) -> Dict:
+        """
+        Полнотекстовый поиск по текстам запросов (FTS5, ранжирование bm25).
+        
+        Ранжируются последние ADMIN_SEARCH_RANK_WINDOW совпадений: для частых слов
+        время ответа не растет вместе с историей.
+        
+        Returns:
+            {'results': [{id, timestamp, request_type, name, snippet}], 'matches': совпадений
+             (не больше окна), 'window_full': окно заполнено, 'has_next': есть следующая страница}
+        """
+        empty = {'results': [], 'matches': 0, 'window_full': False, 'has_next': False}
+        match = self.fts_query(text)
+        if match is None:
+            return empty
+        size = Config.ADMIN_SEARCH_PAGE_SIZE
+        window = Config.ADMIN_SEARCH_RANK_WINDOW
+        
+        with self._read_lock:
+            cursor = self._reader.cursor()
+            # Совпадения обходятся от новых к старым по doclist, без сортировки
+            cursor.execute("""
+                SELECT COUNT(*), MIN(rowid), MAX(rowid) FROM (
+                    SELECT rowid FROM requests_fts WHERE requests_fts MATCH ?
+                    ORDER BY rowid DESC LIMIT ?
+                )
+            """, (match, window))
+            matches, first_id, last_id = cursor.fetchone()
+            if not matches:
+                return empty
+            
+            cursor.execute("""
+                SELECT h.id, r.timestamp, r.request_type, u.first_name, u.username, h.snippet
+                FROM (
+                    SELECT rowid AS id, rank, snippet(requests_fts, 0, ?, ?, '…', ?) AS snippet
+                    FROM requests_fts
+                    WHERE requests_fts MATCH ? AND rowid BETWEEN ? AND ?
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                ) h
+                JOIN user_requests r ON r.id = h.id
+                LEFT JOIN users u ON u.user_id = r.user_id
+                ORDER BY h.rank
+            """, (self.SEARCH_MARK_OPEN, self.SEARCH_MARK_CLOSE, Config.ADMIN_SEARCH_SNIPPET_TOKENS,
+                  match, first_id, last_id, size + 1, (page - 1) * size))
+            rows = cursor.fetchall()
+        
+        results = []
+        for row_id, timestamp, request_type, first_name, username, snippet in rows[:size]:
+            snippet = html.escape(snippet or "")
+            snippet = snippet.replace(self.SEARCH_MARK_OPEN, "<b>").replace(self.SEARCH_MARK_CLOSE, "</b>")
+            results.append({
+                'id': row_id,
+                'timestamp': str(timestamp or ""),
+                'request_type': request_type,
+                'name': first_name or username or "Неизвестный",
+                'snippet': snippet
+            })
+        return {
+            'results': results,
+            'matches': matches,
+            'window_full': matches >= window,
+            'has_next': len(rows) > size
+        }
+    
+    def iter_activity_chunks(self, size: int = None) -> Iterator[Tuple[str, List[Tuple[int, int, int]]]]:
+        """
+        Суточные агрегаты по пользователям для аналитики: (тип, [(день, user_id, запросов)]).
+        
+        День - номер суток от 1970-01-01 (UTC). Читается из снимка (или рабочей базы
+        до первого снимка) отдельным соединением, пачками по size строк.
+        """
+        size = size or Config.ANALYTICS_FETCH_SIZE
+        conn = self._open_read_connection()
+        try:
+            types = [row[0] for row in conn.execute(
+                "SELECT DISTINCT request_type FROM rollup_daily_requests ORDER BY request_type"
+            )]
+            for request_type in types:
+                cursor = conn.execute("""
+                    SELECT CAST(julianday(day) - 2440587.5 AS INTEGER), user_id, requests
+                    FROM rollup_user_type_daily
+                    WHERE request_type = ?
+                """, (request_type,))
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    yield request_type, rows
+        finally:
+            self._close_read_connection(conn)
+    
+    @staticmethod
+    def _users_count(cursor: sqlite3.Cursor) -> int:
+        """Количество пользователей из счетчика (без COUNT(*) по таблице)"""
+        cursor.execute("SELECT value FROM counters WHERE name = 'users'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def get_users_list(self, order: str = 'r', cursor: Optional[Tuple] = None,
+                       backward: bool = False, limit: int = 10) -> Dict:
+        """Страница списка пользователей (keyset-пагинация)
+        
+        cursor - (значение колонки сортировки, user_id) последней строки
+        предыдущей страницы, или первой строки при backward=True. Глубокие
+        страницы стоят столько же, сколько первая: OFFSET не используется.
+        """
+        key = (order, cursor, backward, limit)
+        cached = self._page_cache.get(key)
+        if cached and time.monotonic() - cached[0] < Config.ADMIN_PAGE_CACHE_TTL:
+            return cached[1]
+        
+        try:
+            column = self.USER_ORDERS[order]
+            direction = "ASC" if backward else "DESC"
+            compare = ">" if backward else "<"
+            select = f"""
                 SELECT user_id, username, first_name, last_name, 
                        registration_date, last_activity, total_requests
                 FROM users 
-                ORDER BY last_activity DESC
-                LIMIT ? OFFSET ?
-            """, (limit, offset))
+            """
+            
+            with self._read_lock:
+                db_cursor = self._reader.cursor()
+                if cursor is None:
+                    db_cursor.execute(f"{select} ORDER BY {column} {direction}, user_id {direction} LIMIT ?",
+                                      (limit + 1,))
+                    rows = db_cursor.fetchall()
+                else:
+                    value, user_id = cursor
+                    # Два поиска по индексу (колонка, rowid): остаток строк с тем же значением,
+                    # затем следующие значения. Условие (колонка, user_id) < (?, ?) SQLite
+                    # превращает в диапазон по колонке и перебирает все равные значения
+                    db_cursor.execute(f"{select} WHERE {column} = ? AND user_id {compare} ? "
+                                      f"ORDER BY user_id {direction} LIMIT ?", (value, user_id, limit + 1))
+                    rows = db_cursor.fetchall()
+                    if len(rows) <= limit:
+                        db_cursor.execute(f"{select} WHERE {column} {compare} ? "
+                                          f"ORDER BY {column} {direction}, user_id {direction} LIMIT ?",
+                                          (value, limit + 1 - len(rows)))
+                        rows += db_cursor.fetchall()
+                total_users = self._users_count(db_cursor)
+            
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if backward:
+                rows.reverse()
             
             users = []
-            for row in cursor.fetchall():
+            for row in rows:
                 users.append({
                     'user_id': row[0],
                     'username': row[1],
@@ -298,92 +1179,148 @@ class AdminPanel:
                     'total_requests': row[6]
                 })
             
-            # Получаем общее количество пользователей
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            conn.close()
+            page = {
+                'users': users,
+                'total': total_users,
+                'has_prev': has_more if backward else cursor is not None,
+                'has_next': True if backward else has_more
+            }
             
-            return users, total_users
+            if len(self._page_cache) >= 256:
+                self._page_cache.clear()
+            self._page_cache[key] = (time.monotonic(), page)
+            return page
             
         except Exception as e:
             logger.error(f"❌ Ошибка получения списка пользователей: {e}")
-            return [], 0
+            return {'users': [], 'total': 0, 'has_prev': False, 'has_next': False}
     
-    def export_users_csv(self) -> io.StringIO:
-        """Экспортирует пользователей в CSV"""
+    def attach_archives(self, conn: sqlite3.Connection, since: str) -> List[str]:
+        """Подключает к соединению архивы месяцев начиная с since (только чтение)
+        
+        Архивы создает retention.py. Возвращает имена схем от нового месяца
+        к старому; подключается не больше ARCHIVE_ATTACH_LIMIT архивов.
+        """
+        schemas = []
+        paths = sorted(glob.glob(os.path.join(Config.RETENTION_ARCHIVE_DIR, "requests_*.db")), reverse=True)
+        for path in paths:
+            month = os.path.basename(path)[len("requests_"):-len(".db")]   # YYYY_MM
+            if month.replace('_', '-') < since[:7]:
+                break
+            if len(schemas) >= self.ARCHIVE_ATTACH_LIMIT:
+                logger.warning(f"⚠️ Подключено {len(schemas)} архивов, более старые месяцы пропущены")
+                break
+            schema = f"archive_{month}"
+            uri = f"{Path(os.path.abspath(path)).as_uri()}?mode=ro"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (uri,))
+            if not self.archive_has_rows(conn, schema):
+                # Пустой архив (месяц без запросов) не занимает место в лимите
+                conn.execute(f"DETACH DATABASE {schema}")
+                continue
+            schemas.append(schema)
+        return schemas
+    
+    @staticmethod
+    def archive_has_rows(conn: sqlite3.Connection, schema: str) -> bool:
+        """Есть ли в архиве (подключенной схеме) хотя бы один запрос"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # Запрос с подробной информацией
-            query = """
-                SELECT 
-                    u.user_id,
-                    u.username,
-                    u.first_name,
-                    u.last_name,
-                    u.registration_date,
-                    u.last_activity,
-                    u.total_requests,
-                    COUNT(r.id) as actual_requests,
-                    AVG(r.processing_time) as avg_processing_time
-                FROM users u
-                LEFT JOIN user_requests r ON u.user_id = r.user_id
-                GROUP BY u.user_id
-                ORDER BY u.last_activity DESC
-            """
-            
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            
-            # Создаем CSV в памяти
-            output = io.StringIO()
-            df.to_csv(output, index=False, encoding='utf-8')
-            output.seek(0)
-            
-            return output
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка экспорта пользователей: {e}")
-            return None
+            return bool(conn.execute(f"SELECT EXISTS (SELECT 1 FROM {schema}.user_requests)").fetchone()[0])
+        except sqlite3.OperationalError:
+            # Файл без таблицы user_requests
+            return False
     
-    def export_requests_csv(self, days: int = 30) -> io.StringIO:
-        """Экспортирует запросы в CSV"""
+    def _iter_csv_parts(self, query: str, params: tuple, header: List[str],
+                        part_size: int = None, archives_since: str = None) -> Iterator[Tuple[bytes, int]]:
+        """Потоковый экспорт: CSV, сжатый gzip, частями не больше part_size
+        
+        Строки читаются из курсора порциями и сразу сжимаются, поэтому в памяти
+        держится только текущая часть. Каждая часть - самостоятельный файл
+        .csv.gz с заголовком. Возвращает пары (данные, количество строк).
+        
+        С archives_since запрос - шаблон со {schema}: он выполняется по очереди
+        для основной базы и для каждого подключенного архива.
+        """
+        part_size = part_size or Config.EXPORT_PART_SIZE
+        # Отдельное соединение со снимком: долгий экспорт не мешает ни записи, ни остальным чтениям
+        conn = self._open_read_connection()
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            start_date = datetime.now() - timedelta(days=days)
-            
-            query = """
-                SELECT 
-                    r.id,
-                    r.user_id,
-                    u.username,
-                    u.first_name,
-                    r.request_type,
-                    r.request_text,
-                    r.timestamp,
-                    r.processing_time,
-                    r.status
-                FROM user_requests r
-                LEFT JOIN users u ON r.user_id = u.user_id
-                WHERE r.timestamp >= ?
-                ORDER BY r.timestamp DESC
-            """
+            if archives_since is None:
+                cursors = iter([conn.execute(query, params)])
+            else:
+                schemas = ["main"] + self.attach_archives(conn, archives_since)
+                cursors = (conn.execute(query.format(schema=schema), params) for schema in schemas)
+            text = io.StringIO()
+            writer = csv.writer(text)
             
-            df = pd.read_sql_query(query, conn, params=(start_date,))
-            conn.close()
+            def new_part():
+                buffer = io.BytesIO()
+                archive = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6)
+                # BOM - чтобы Excel открыл кириллицу без настройки кодировки
+                archive.write('\ufeff'.encode('utf-8'))
+                writer.writerow(header)
+                return buffer, archive
             
-            # Создаем CSV в памяти
-            output = io.StringIO()
-            df.to_csv(output, index=False, encoding='utf-8')
-            output.seek(0)
+            def flush_text(archive):
+                archive.write(text.getvalue().encode('utf-8'))
+                text.seek(0)
+                text.truncate()
             
-            return output
+            buffer, archive = new_part()
+            rows = 0
+            sent = 0
+            cursor = next(cursors)
+            while cursor is not None:
+                batch = cursor.fetchmany(Config.EXPORT_FETCH_SIZE)
+                if not batch:
+                    cursor = next(cursors, None)
+                    continue
+                writer.writerows(batch)
+                rows += len(batch)
+                flush_text(archive)
+                
+                if buffer.tell() >= part_size:
+                    archive.close()
+                    yield buffer.getvalue(), rows
+                    sent += 1
+                    buffer, archive = new_part()
+                    rows = 0
             
-        except Exception as e:
-            logger.error(f"❌ Ошибка экспорта запросов: {e}")
-            return None
+            if rows or not sent:
+                # Последняя часть (или пустой экспорт - только заголовок)
+                flush_text(archive)
+                archive.close()
+                yield buffer.getvalue(), rows
+        finally:
+            self._close_read_connection(conn)
+    
+    def export_users_csv(self, part_size: int = None) -> Iterator[Tuple[bytes, int]]:
+        """Экспортирует пользователей в CSV (gzip, частями)"""
+        query = """
+            SELECT user_id, username, first_name, last_name, 
+                   registration_date, last_activity, total_requests
+            FROM users 
+            ORDER BY total_requests DESC
+        """
+        header = ['ID пользователя', 'Username', 'Имя', 'Фамилия', 
+                  'Дата регистрации', 'Последняя активность', 'Всего запросов']
+        return self._iter_csv_parts(query, (), header, part_size)
+    
+    def export_requests_csv(self, days: int = None, part_size: int = None) -> Iterator[Tuple[bytes, int]]:
+        """Экспортирует запросы за период в CSV (gzip, частями)"""
+        days = days or Config.EXPORT_REQUESTS_DAYS
+        start_date = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        # Выполняется для основной базы и архивов старых месяцев (см. retention.py)
+        query = """
+            SELECT r.timestamp, u.first_name, u.username, r.request_type, 
+                   unz(r.request_text), r.processing_time, r.status
+            FROM {schema}.user_requests r
+            LEFT JOIN main.users u ON r.user_id = u.user_id
+            WHERE r.timestamp >= ?
+            ORDER BY r.timestamp DESC
+        """
+        header = ['Дата и время', 'Имя пользователя', 'Username', 
+                  'Тип запроса', 'Текст запроса', 'Время обработки', 'Статус']
+        return self._iter_csv_parts(query, (start_date,), header, part_size, archives_since=start_date)
 
 # Глобальный экземпляр админ-панели
 admin_panel = AdminPanel() 
\ No newline at end of file
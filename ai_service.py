@@ -1,4 +1,3 @@
-from openai import OpenAI
 import logging
 import json
 import os
@@ -6,6 +5,11 @@ from typing import Optional, List, Tuple
 from legal_knowledge import LegalKnowledge
 from perplexity_service import PerplexityService
 from config import Config
+from openai_gateway import get_openai_gateway
+from answer_cache import normalize_query
+from single_flight import SingleFlight
+from provider_router import provider_router
+from request_timing import stage
 import io
 import asyncio
 
@@ -13,15 +17,18 @@ logger = logging.getLogger(__name__)
 
 class AIService:
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        self.openai = get_openai_gateway(api_key)
         self.perplexity = PerplexityService()
         
+        # Одинаковые одновременные вопросы обслуживаются одним запросом к Perplexity
+        self.search_flight = SingleFlight("perplexity")
+        
         logger.info("🌐 Используется Perplexity API для точного поиска актуальной информации в интернете")
     
 
 
     
-    async def _get_relevant_legal_articles(self, query: str, top_k: int = 10) -> str:
+    async def _get_relevant_legal_articles(self, query: str, top_k: int = 10, on_partial=None) -> str:
         """Находит релевантные статьи через Perplexity API"""
         # Проверяем валидность запроса
         if not query or not isinstance(query, str) or not query.strip():
@@ -47,9 +54,26 @@ class AIService:
             elif any(word in query_lower for word in ["договор", "недвижимость", "покупка", "продажа", "услуги", "ущерб"]):
                 context_type = "civil"
             
-            # Выполняем поиск через Perplexity API
+            # Выполняем поиск через Perplexity API (одинаковые запросы объединяются).
+            # Присоединившиеся к чужому поиску получают его потоковые обновления,
+            # а ожидание записывается им в этап «perplexity»
             logger.info(f"🌐 Выполняется поиск через Perplexity API: {query}")
-            perplexity_result = await self.perplexity.search_legal_info(query.strip(), context_type)
+            flight_key = f"{context_type}:{normalize_query(query)}"
+            with stage("perplexity"):
+                perplexity_result = await self.search_flight.do(
+                    flight_key,
+                    lambda publish: self.perplexity.search_legal_info(
+                        query.strip(), context_type,
+                        on_partial=publish if on_partial is not None else None, fallback=False
+                    ),
+                    on_partial=on_partial
+                )
+            
+            if perplexity_result is None:
+                # Perplexity недоступен - ответ соберет GPT без интернет-контекста
+                logger.warning("🔀 Perplexity недоступен, переключаюсь на ответ только через GPT")
+                provider_router.record_failover("perplexity")
+                return ""
             
             if perplexity_result:
                 logger.info("✅ Получен ответ от Perplexity API")
@@ -66,8 +90,14 @@ class AIService:
     
 
     
-    async def find_legal_practice(self, case_description: str) -> str:
-        """Поиск судебной практики по описанию ситуации"""
+    async def find_legal_practice(self, case_description: str, on_partial=None) -> str:
+        """
+        Поиск судебной практики по описанию ситуации
+        
+        Args:
+            case_description: Описание ситуации
+            on_partial: Необязательный колбэк для потокового показа ответа Perplexity
+        """
         # Первичная проверка входных данных
         if case_description is None:
             logger.error("❌ case_description равен None в начале find_legal_practice")
@@ -79,7 +109,7 @@ class AIService:
         
         try:
             # Получаем актуальную информацию через Perplexity API
-            perplexity_response = await self._get_relevant_legal_articles(case_description, top_k=8)
+            perplexity_response = await self._get_relevant_legal_articles(case_description, top_k=8, on_partial=on_partial)
             
             # Если получен полный ответ от Perplexity, используем его напрямую
             if perplexity_response and "🔍 АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА:" in perplexity_response:
@@ -157,7 +187,7 @@ class AIService:
 5. СРОКИ (когда что делать)
 6. РЕЗУЛЬТАТ (что получите)"""
 
-            ai_response = self.client.chat.completions.create(
+            ai_response = await self.openai.chat_completion(
                 model=Config.GPT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -603,7 +633,7 @@ class AIService:
 
 ДАЙТЕ ГОТОВЫЙ ТЕКСТ ЖАЛОБЫ!"""
 
-            response = self.client.chat.completions.create(
+            response = await self.openai.chat_completion(
                 model=Config.GPT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -678,7 +708,7 @@ class AIService:
 
 ДАЙТЕ КОНКРЕТНЫЕ РЕКОМЕНДАЦИИ!"""
 
-            response = self.client.chat.completions.create(
+            response = await self.openai.chat_completion(
                 model=Config.GPT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -716,7 +746,7 @@ class AIService:
             # Формируем полный запрос с контекстом
             full_query = f"ВОПРОС: {query}\n\n{context}\n\nДайте развернутый анализ вопроса на основе актуальной информации из интернета."
             
-            response = self.client.chat.completions.create(
+            response = await self.openai.chat_completion(
                 model=Config.GPT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -950,7 +980,7 @@ class AIService:
             
             # Отправляем запрос к Whisper-1
             logger.info("📡 Отправляю запрос к Whisper-1 API...")
-            response = self.client.audio.transcriptions.create(
+            response = await self.openai.transcription(
                 model="whisper-1",
                 file=audio_file,
                 language="ru"  # Указываем русский язык для лучшего распознавания
@@ -0,0 +1,332 @@
+"""
+Когортная аналитика админ-панели на массивах NumPy
+
+Источник - суточные агрегаты rollup_user_type_daily (тип, сутки, пользователь, запросов)
+из снимка базы. Они загружаются один раз на снимок в компактные массивы
+(~13 байт на строку вместо кортежей Python), дальше все считается векторно:
+- недельные когорты по первой активности и их удержание по неделям;
+- DAU / WAU / MAU (WAU и MAU - уникальные пользователи за скользящие 7 и 30 суток);
+- распределение пользователей по числу запросов;
+- воронки по типам запросов: попробовали -> повторили в другой день -> вернулись через неделю.
+
+Вместо JOIN users и user_requests по всей истории - один проход по агрегатам.
+"""
+
+import csv
+import io
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from admin_panel import AdminPanel, admin_panel
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Сутки хранятся номером от 1970-01-01 (четверг); неделя начинается с понедельника
+EPOCH = date(1970, 1, 1)
+WEEK_SHIFT = 3
+
+# Нижние границы групп пользователей по числу запросов: 1, 2-3, 4-7, ...
+FREQUENCY_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def day_to_date(day: int) -> date:
+    return EPOCH + timedelta(days=int(day))
+
+
+def week_start(week: int) -> date:
+    """Понедельник недели с номером week"""
+    return day_to_date(week * 7 - WEEK_SHIFT)
+
+
+class ActivityArrays:
+    """Суточная активность пользователей по типам запросов в компактных массивах"""
+
+    __slots__ = ('day', 'user', 'type', 'requests', 'user_ids', 'types')
+
+    def __init__(self, day: np.ndarray, user: np.ndarray, type_codes: np.ndarray, requests: np.ndarray,
+                 user_ids: np.ndarray, types: List[str]):
+        self.day = day              # int32: сутки от 1970-01-01
+        self.user = user            # int32: индекс в user_ids
+        self.type = type_codes      # uint16: индекс в types
+        self.requests = requests    # int32: запросов за сутки
+        self.user_ids = user_ids    # int64: Telegram user_id
+        self.types = types
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        return self.day.nbytes + self.user.nbytes + self.type.nbytes + self.requests.nbytes + self.user_ids.nbytes
+
+
+class CohortAnalytics:
+    """Когорты, активная аудитория и воронки по суточным агрегатам"""
+
+    def __init__(self, panel: AdminPanel):
+        self.panel = panel
+        self._arrays: Optional[ActivityArrays] = None
+        self._loaded_for: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'rows': 0, 'bytes': 0, 'load_time': 0.0, 'compute_time': 0.0}
+
+    # ---------- Загрузка ----------
+
+    def load_arrays(self) -> ActivityArrays:
+        """Массивы активности; перечитываются только после обновления снимка"""
+        with self._lock:
+            snapshot_time = self.panel.snapshot_time
+            if self._arrays is not None and snapshot_time is not None and snapshot_time == self._loaded_for:
+                return self._arrays
+
+            started = time.monotonic()
+            types: List[str] = []
+            chunks: List[np.ndarray] = []
+            codes: List[np.ndarray] = []
+            for request_type, rows in self.panel.iter_activity_chunks():
+                if not types or types[-1] != request_type:
+                    types.append(request_type)
+                chunk = np.array(rows, dtype=np.int64).reshape(-1, 3)
+                chunks.append(chunk)
+                codes.append(np.full(len(chunk), len(types) - 1, dtype=np.uint16))
+
+            data = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+            user_ids, user = np.unique(data[:, 1], return_inverse=True)
+            arrays = ActivityArrays(
+                day=data[:, 0].astype(np.int32),
+                user=user.astype(np.int32),
+                type_codes=np.concatenate(codes) if codes else np.empty(0, dtype=np.uint16),
+                requests=data[:, 2].astype(np.int32),
+                user_ids=user_ids,
+                types=types
+            )
+
+            self._arrays, self._loaded_for = arrays, snapshot_time
+            self.stats['loads'] += 1
+            self.stats['rows'] = len(arrays)
+            self.stats['bytes'] = arrays.nbytes
+            self.stats['load_time'] = time.monotonic() - started
+            logger.info(f"📈 Агрегаты для когортной аналитики загружены: {len(arrays)} строк, "
+                        f"{arrays.nbytes / 1024 / 1024:.1f} МБ за {self.stats['load_time']:.1f} с")
+            return arrays
+
+    # ---------- Расчеты ----------
+
+    @staticmethod
+    def _user_days(arrays: ActivityArrays) -> Tuple[np.ndarray, np.ndarray]:
+        """Уникальные пары (пользователь, сутки), отсортированные по пользователю и суткам"""
+        if not len(arrays):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        first_day = int(arrays.day.min())
+        span = int(arrays.day.max()) - first_day + 1
+        keys = np.unique(arrays.user.astype(np.int64) * span + (arrays.day - first_day))
+        return keys // span, keys % span + first_day
+
+    @staticmethod
+    def _group_starts(sorted_keys: np.ndarray) -> np.ndarray:
+        """Индексы начала групп одинаковых значений в отсортированном массиве"""
+        return np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+    def cohorts(self, users: np.ndarray, days: np.ndarray, today: int, weeks: int) -> Dict:
+        """Недельные когорты по первой активности: пользователи когорты, активные через k недель"""
+        current_week = (today + WEEK_SHIFT) // 7
+        first_week = current_week - weeks + 1
+        matrix = np.zeros((weeks, weeks), dtype=np.int64)
+
+        if len(users):
+            week = (days + WEEK_SHIFT) // 7
+            # Пары отсортированы по пользователю и суткам - недели внутри пользователя не убывают
+            distinct = np.r_[True, (users[1:] != users[:-1]) | (week[1:] != week[:-1])]
+            users, week = users[distinct], week[distinct]
+            starts = self._group_starts(users)
+            cohort = np.repeat(week[starts], np.diff(np.r_[starts, len(users)]))
+            offset = week - cohort
+            inside = cohort >= first_week
+            cells = (cohort[inside] - first_week) * weeks + offset[inside]
+            matrix = np.bincount(cells, minlength=weeks * weeks).reshape(weeks, weeks)
+
+        sizes = matrix[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            retention = np.where(sizes[:, None] > 0, matrix / sizes[:, None] * 100, np.nan)
+        # Недели, которые для когорты еще не наступили
+        future = np.arange(weeks)[:, None] + np.arange(weeks)[None, :] >= weeks
+        retention[future] = np.nan
+        return {
+            'weeks': [week_start(first_week + i) for i in range(weeks)],
+            'sizes': sizes,
+            'matrix': matrix,
+            'retention': retention
+        }
+
+    @staticmethod
+    def active_users(users: np.ndarray, days: np.ndarray, today: int, series_days: int) -> Dict:
+        """DAU, WAU и MAU за последние series_days суток (включая сегодня)"""
+        first = today - series_days + 1
+        result = {'days': [day_to_date(first + i) for i in range(series_days)]}
+        length = series_days + 31
+
+        result['dau'] = np.bincount(days[days >= first] - first, minlength=length)[:series_days]
+
+        # Пользователь учитывается в окне [d - W + 1, d], если был активен в нем хотя бы раз.
+        # Каждая активность покрывает сутки [day, day + W - 1], но не дальше следующей активности
+        # того же пользователя - интервалы не пересекаются, и их сумма равна числу уникальных.
+        same_user_next = np.r_[users[1:] == users[:-1], False]
+        next_day = np.r_[days[1:], 0]
+        for name, window in (('wau', 7), ('mau', 30)):
+            if not len(days):
+                result[name] = np.zeros(series_days, dtype=np.int64)
+                continue
+            end = days + window - 1
+            end = np.where(same_user_next, np.minimum(end, next_day - 1), end)
+            start = np.maximum(days, first)
+            keep = end >= start
+            start, end = start[keep] - first, end[keep] - first
+            end = np.minimum(end, series_days - 1)
+            keep = start < series_days
+            coverage = (np.bincount(start[keep], minlength=length)
+                        - np.bincount(end[keep] + 1, minlength=length))
+            result[name] = np.cumsum(coverage)[:series_days]
+        return result
+
+    @staticmethod
+    def frequency(arrays: ActivityArrays) -> List[Tuple[str, int]]:
+        """Распределение пользователей по числу запросов за всю историю"""
+        totals = np.bincount(arrays.user, weights=arrays.requests, minlength=len(arrays.user_ids)).astype(np.int64)
+        groups = np.bincount(np.digitize(totals[totals > 0], FREQUENCY_BUCKETS) - 1, minlength=len(FREQUENCY_BUCKETS))
+        labels = []
+        for i, low in enumerate(FREQUENCY_BUCKETS):
+            if i + 1 < len(FREQUENCY_BUCKETS):
+                high = FREQUENCY_BUCKETS[i + 1] - 1
+                labels.append(str(low) if high == low else f"{low}-{high}")
+            else:
+                labels.append(f"{low}+")
+        return list(zip(labels, groups.tolist()))
+
+    def funnels(self, arrays: ActivityArrays) -> List[Dict]:
+        """Воронки по типам запросов: попробовали, повторили в другой день, вернулись через 7+ дней"""
+        result = []
+        for code, request_type in enumerate(arrays.types):
+            mask = arrays.type == code
+            users, days = arrays.user[mask], arrays.day[mask]
+            if not len(users):
+                continue
+            order = np.lexsort((days, users))
+            users, days = users[order], days[order]
+            # Строки уникальны по (тип, сутки, пользователь): строк пользователя = его дней с этим типом
+            starts = self._group_starts(users)
+            ends = np.r_[starts[1:], len(users)] - 1
+            result.append({
+                'request_type': request_type,
+                'requests': int(arrays.requests[mask].sum()),
+                'tried': len(starts),
+                'repeated': int(np.count_nonzero(ends > starts)),
+                'returned': int(np.count_nonzero(days[ends] - days[starts] >= 7))
+            })
+        result.sort(key=lambda funnel: -funnel['tried'])
+        return result
+
+    def report(self) -> Dict:
+        """Все показатели по текущему снимку"""
+        arrays = self.load_arrays()
+        started = time.monotonic()
+        today = (datetime.utcnow().date() - EPOCH).days
+        users, days = self._user_days(arrays)
+        report = {
+            'users': len(arrays.user_ids),
+            'cohorts': self.cohorts(users, days, today, Config.ANALYTICS_COHORT_WEEKS),
+            'active': self.active_users(users, days, today, Config.ANALYTICS_SERIES_DAYS),
+            'frequency': self.frequency(arrays),
+            'funnels': self.funnels(arrays)
+        }
+        self.stats['compute_time'] = time.monotonic() - started
+        report['stats'] = dict(self.stats)
+        return report
+
+    # ---------- Представление ----------
+
+    @staticmethod
+    def format_message(report: Dict) -> str:
+        """Текст для админ-панели (HTML, таблицы моноширинным шрифтом)"""
+        active = report['active']
+        dau, wau, mau = int(active['dau'][-1]), int(active['wau'][-1]), int(active['mau'][-1])
+        dau_avg = float(np.mean(active['dau'][-7:]))
+        stickiness = dau_avg / mau * 100 if mau else 0.0
+
+        text = "📈 <b>КОГОРТЫ И УДЕРЖАНИЕ</b>\n"
+        text += (f"\n👥 <b>АКТИВНАЯ АУДИТОРИЯ (UTC):</b>\n"
+                 f"• DAU сегодня: {dau}, в среднем за 7 дней: {dau_avg:.0f}\n"
+                 f"• WAU: {wau}, MAU: {mau}\n"
+                 f"• Вовлеченность DAU/MAU: {stickiness:.1f}%\n")
+
+        cohorts = report['cohorts']
+        weeks = len(cohorts['weeks'])
+        header = f"{'Нед.':<5}  {'Польз':>5} " + " ".join(f"{f'+{k}':>4}" for k in range(1, weeks))
+        lines = [header]
+        for i, monday in enumerate(cohorts['weeks']):
+            cells = []
+            for k in range(1, weeks):
+                value = cohorts['retention'][i, k]
+                cells.append(f"{'':>4}" if np.isnan(value) else f"{value:>3.0f}%")
+            lines.append(f"{monday.strftime('%d.%m')}  {int(cohorts['sizes'][i]):>5} " + " ".join(cells))
+        text += f"\n📅 <b>УДЕРЖАНИЕ ПО НЕДЕЛЯМ</b> (% когорты, активных через k недель):\n<pre>{chr(10).join(lines)}</pre>\n"
+
+        lines = [f"{label:>6}  {count:>7}" for label, count in report['frequency']]
+        text += f"\n🔢 <b>ЗАПРОСОВ НА ПОЛЬЗОВАТЕЛЯ</b> (всего {report['users']}):\n<pre>{chr(10).join(lines)}</pre>\n"
+
+        text += "\n🪜 <b>ВОРОНКИ ПО ТИПАМ:</b> попробовали → повторили → вернулись через неделю\n"
+        for funnel in report['funnels'][:8]:
+            tried = funnel['tried']
+            text += (f"• {funnel['request_type']}: {tried} → {funnel['repeated']} "
+                     f"({funnel['repeated'] / tried * 100:.0f}%) → {funnel['returned']} "
+                     f"({funnel['returned'] / tried * 100:.0f}%)\n")
+
+        stats = report['stats']
+        text += (f"\n📦 Агрегатов: {stats['rows']} строк, {stats['bytes'] / 1024 / 1024:.1f} МБ, "
+                 f"загрузка {stats['load_time']:.1f} с, расчет {stats['compute_time'] * 1000:.0f} мс")
+        return text
+
+    @staticmethod
+    def csv_files(report: Dict) -> List[Tuple[str, bytes]]:
+        """Показатели отчета в CSV: (имя файла, содержимое)"""
+        def to_csv(header: List[str], rows) -> bytes:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(header)
+            writer.writerows(rows)
+            # BOM - чтобы Excel открыл кириллицу без настройки кодировки
+            return buffer.getvalue().encode('utf-8-sig')
+
+        cohorts = report['cohorts']
+        weeks = len(cohorts['weeks'])
+        cohort_rows = []
+        for i, monday in enumerate(cohorts['weeks']):
+            row = [monday.isoformat(), int(cohorts['sizes'][i])]
+            for k in range(weeks):
+                value = cohorts['retention'][i, k]
+                row.append("" if np.isnan(value) else f"{value:.1f}")
+            cohort_rows.append(row)
+
+        active = report['active']
+        return [
+            ("cohorts.csv", to_csv(["Неделя когорты", "Пользователей"] + [f"Неделя +{k}, %" for k in range(weeks)],
+                                   cohort_rows)),
+            ("active_users.csv", to_csv(["Дата", "DAU", "WAU", "MAU"], [
+                (day.isoformat(), int(dau), int(wau), int(mau))
+                for day, dau, wau, mau in zip(active['days'], active['dau'], active['wau'], active['mau'])
+            ])),
+            ("funnels.csv", to_csv(["Тип запроса", "Запросов", "Попробовали", "Повторили", "Вернулись через неделю"], [
+                (f['request_type'], f['requests'], f['tried'], f['repeated'], f['returned'])
+                for f in report['funnels']
+            ])),
+            ("requests_per_user.csv", to_csv(["Запросов", "Пользователей"], report['frequency'])),
+        ]
+
+
+# Глобальный экземпляр когортной аналитики
+cohort_analytics = CohortAnalytics(admin_panel)
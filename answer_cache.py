@@ -0,0 +1,170 @@
+"""
+Кэш ответов Perplexity API
+Два уровня: LRU в памяти процесса и SQLite на диске (переживает перезапуск).
+Для каждого типа контекста свой TTL, чтобы правовая информация не устаревала.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Приводит запрос к каноническому виду для ключа кэша"""
+    text = query.lower().replace('ё', 'е')
+    # Оставляем только буквы и цифры, знаки препинания не влияют на смысл
+    text = re.sub(r'[^\w]+', ' ', text)
+    return ' '.join(text.split())
+
+
+class AnswerCache:
+    """Двухуровневый TTL+LRU кэш ответов"""
+
+    def __init__(self, db_path: str = None, max_memory_entries: int = None):
+        self.db_path = db_path or Config.ANSWER_CACHE_DB
+        self.max_memory_entries = max_memory_entries or Config.ANSWER_CACHE_MEMORY_SIZE
+
+        # key -> (expires_at, response)
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'expired': 0
+        }
+
+        self._init_database()
+
+    def _init_database(self):
+        """Создает таблицу дискового кэша"""
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    context_type TEXT,
+                    response TEXT,
+                    created_at REAL,
+                    expires_at REAL
+                )
+            """)
+            self._conn.execute("DELETE FROM answer_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+            logger.info(f"✅ Кэш ответов инициализирован: {self.db_path}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации кэша ответов, работаем только в памяти: {e}")
+            self._conn = None
+
+    @staticmethod
+    def make_key(query: str, context_type: str) -> str:
+        """Ключ кэша по нормализованному запросу и типу контекста"""
+        normalized = normalize_query(query)
+        digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        return f"{context_type}:{digest}"
+
+    @staticmethod
+    def _ttl_for(context_type: str) -> float:
+        ttl = Config.ANSWER_CACHE_TTL
+        return ttl.get(context_type, ttl["general"])
+
+    async def get(self, query: str, context_type: str) -> Optional[str]:
+        """Ищет ответ сначала в памяти, затем на диске"""
+        key = self.make_key(query, context_type)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, response = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return response
+            del self._memory[key]
+            self.stats['expired'] += 1
+
+        row = await asyncio.to_thread(self._disk_get, key, now)
+        if row is not None:
+            expires_at, response = row
+            self._remember(key, expires_at, response)
+            self.stats['disk_hits'] += 1
+            return response
+
+        self.stats['misses'] += 1
+        return None
+
+    async def set(self, query: str, context_type: str, response: str):
+        """Сохраняет ответ в оба уровня кэша"""
+        key = self.make_key(query, context_type)
+        now = time.time()
+        expires_at = now + self._ttl_for(context_type)
+
+        self._remember(key, expires_at, response)
+        self.stats['stores'] += 1
+        await asyncio.to_thread(self._disk_set, key, context_type, response, now, expires_at)
+
+    def _remember(self, key: str, expires_at: float, response: str):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT expires_at, response FROM answer_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+            if row and row[0] > now:
+                return row
+            return None
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша ответов: {e}")
+            return None
+
+    def _disk_set(self, key: str, context_type: str, response: str, now: float, expires_at: float):
+        if self._conn is None:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO answer_cache (cache_key, context_type, response, created_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, context_type, response, now, expires_at))
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кэша ответов: {e}")
+
+    def get_stats(self) -> Dict:
+        """Счетчики попаданий/промахов для админ-панели"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hits': hits,
+            'hit_rate': (hits / total * 100) if total else 0.0,
+            'memory_entries': len(self._memory)
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.close()
+            self._conn = None
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Запросы админ-панели на большой синтетической базе: до и после миграций с индексами
+
+Скрипт создает базу через AdminPanel, снимает индексы и версию схемы,
+заполняет user_requests и users синтетическими данными (средствами SQLite,
+без Python-циклов) и строит суточные агрегаты, замеряет запросы главного
+экрана, аналитики и списков, затем применяет AdminPanel.apply_migrations
+и повторяет замеры. Аналитика читает агрегаты, поэтому ее время почти
+не зависит ни от индексов, ни от объема истории.
+
+    python benchmarks/admin_indexes.py                  # 10 млн запросов
+    python benchmarks/admin_indexes.py --rows 500000 --users 20000 --explain
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from bench_utils import percentile  # noqa: E402
+
+REQUEST_TYPES = ("legal_consultation", "voice_message", "document_analysis",
+                 "complaint_generation", "text_to_speech", "court_practice")
+
+# Запросы, которые выполняют методы AdminPanel, - для EXPLAIN QUERY PLAN
+EXPLAIN_QUERIES = {
+    "requests_today": ("SELECT COUNT(*) FROM user_requests WHERE timestamp >= ? AND timestamp < ?", 2),
+    "active_users": ("SELECT COUNT(DISTINCT user_id) FROM user_requests WHERE timestamp >= ?", 1),
+    "types_period": ("SELECT request_type, COUNT(*) FROM user_requests WHERE timestamp >= ? "
+                     "GROUP BY request_type", 1),
+    "types_all_time": ("SELECT request_type, COUNT(*) FROM user_requests GROUP BY request_type", 0),
+    "users_by_activity": ("SELECT user_id FROM users ORDER BY last_activity DESC LIMIT 10", 0),
+    "users_page_ties": ("SELECT user_id FROM users WHERE total_requests = ? AND user_id < 0 "
+                        "ORDER BY user_id DESC LIMIT 11", 1),
+    "users_page_next": ("SELECT user_id FROM users WHERE total_requests < ? "
+                        "ORDER BY total_requests DESC, user_id DESC LIMIT 11", 1),
+    "active_today": ("SELECT COUNT(*) FROM users WHERE last_activity > ?", 1),
+}
+
+
+def fill(conn: sqlite3.Connection, rows: int, users: int, days: int, text_size: int, session: int = 1):
+    """Заполняет таблицы: запросы равномерно распределены по последним days суткам,
+    подряд идущие session запросов - от одного пользователя"""
+    start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    span = days * 86400
+    types_case = " ".join(f"WHEN {i} THEN '{name}'" for i, name in enumerate(REQUEST_TYPES))
+
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    conn.execute(f"""
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)
+        INSERT INTO users (user_id, username, first_name, registration_date, last_activity, total_requests)
+        SELECT x, 'user' || x, 'Пользователь ' || x,
+               datetime(?, '+' || (abs(random()) % ?) || ' seconds'),
+               datetime(?, '+' || (abs(random()) % ?) || ' seconds'),
+               0
+        FROM seq
+    """, (users, start, span, start, span))
+    conn.execute(f"""
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)
+        INSERT INTO user_requests (user_id, request_type, request_text, timestamp, processing_time)
+        SELECT 1 + ((x - 1) / ? * 7919) % ?,
+               CASE abs(random()) % {len(REQUEST_TYPES)} {types_case} END,
+               substr(printf('%s №%d', 'Вопрос пользователя о трудовом споре и выплате зарплаты', x), 1, ?),
+               datetime(?, '+' || (x * ? / ?) || ' seconds'),
+               (abs(random()) % 30000) / 1000.0
+        FROM seq
+    """, (rows, max(1, session), users, text_size, start, span, rows))
+    conn.execute("""
+        UPDATE users SET total_requests = counts.total
+        FROM (SELECT user_id, COUNT(*) AS total FROM user_requests GROUP BY user_id) AS counts
+        WHERE counts.user_id = users.user_id
+    """)
+    # Работающий бот ведет агрегаты при записи, здесь - строим по готовой истории
+    from admin_panel import AdminPanel
+    AdminPanel.rebuild_rollups(conn.cursor())
+    conn.commit()
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def drop_indexes(conn: sqlite3.Connection):
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+    )]
+    for name in names:
+        conn.execute(f"DROP INDEX {name}")
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+
+
+def measure(panel: "AdminPanel", repeat: int) -> dict:
+    """Время вызова методов админ-панели, секунды (первый прогон - прогрев кэша)"""
+    Config.ADMIN_PAGE_CACHE_TTL = 0
+    # Курсор в середине списка - для keyset-страницы, до которой OFFSET пришлось бы пролистывать
+    deep_cursor = panel._reader.execute(
+        "SELECT total_requests, user_id FROM users ORDER BY total_requests DESC, user_id DESC "
+        "LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM users)"
+    ).fetchone()
+    calls = {
+        "get_dashboard_stats": panel.get_dashboard_stats,
+        "get_analytics_data(7)": lambda: panel.get_analytics_data(7),
+        "get_analytics_data(90)": lambda: panel.get_analytics_data(90),
+        "get_analytics_data(365)": lambda: panel.get_analytics_data(365),
+        "get_weekly_summary": panel.get_weekly_summary,
+
+        "get_recent_requests(10)": lambda: panel.get_recent_requests(10),
+        "get_users_list(первая)": lambda: panel.get_users_list('r'),
+        "get_users_list(глубокая)": lambda: panel.get_users_list('r', deep_cursor),
+    }
+    results = {}
+    for name, call in calls.items():
+        call()
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - started)
+        results[name] = samples
+    return results
+
+
+def explain(conn: sqlite3.Connection, title: str):
+    print(f"\nПланы запросов ({title}):")
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for name, (sql, params) in EXPLAIN_QUERIES.items():
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", (now,) * params).fetchall()
+        print(f"  {name:<18} " + "; ".join(row[-1] for row in plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Количество записей в user_requests")
+    parser.add_argument("--users", type=int, default=200_000, help="Количество пользователей")
+    parser.add_argument("--session", type=int, default=4, help="Запросов пользователя подряд (за одни сутки)")
+    parser.add_argument("--days", type=int, default=365, help="Период, по которому распределены запросы")
+    parser.add_argument("--text-size", type=int, default=80, help="Длина текста запроса, символов")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера")
+    parser.add_argument("--explain", action="store_true", help="Печатать EXPLAIN QUERY PLAN")
+    parser.add_argument("--db", help="Путь к базе (по умолчанию - временный каталог)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="admin_indexes_")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(workdir, "bot_database.db")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    # admin_panel при импорте создает глобальный AdminPanel() с базой в текущем каталоге -
+    # импортируем его из временного каталога, чтобы не оставлять ./bot_database.db
+    from admin_panel import AdminPanel
+
+    panel = AdminPanel(db_path)
+    raw = sqlite3.connect(db_path)
+    try:
+        drop_indexes(raw)
+        started = time.perf_counter()
+        fill(raw, args.rows, args.users, args.days, args.text_size, args.session)
+        print(f"Заполнение: {args.rows} запросов, {args.users} пользователей за {time.perf_counter() - started:.1f} с, "
+              f"размер базы {os.path.getsize(db_path) / 1024 / 1024:.0f} МБ")
+
+        if args.explain:
+            explain(raw, "без индексов")
+        before = measure(panel, args.repeat)
+
+        started = time.perf_counter()
+        AdminPanel.apply_migrations(raw)
+        print(f"Миграции (построение индексов): {time.perf_counter() - started:.1f} с, "
+              f"размер базы {os.path.getsize(db_path) / 1024 / 1024:.0f} МБ")
+
+        if args.explain:
+            explain(raw, "с индексами")
+        after = measure(panel, args.repeat)
+
+        print(f"\n{'Метод':<26} {'без индексов, мс':>18} {'с индексами, мс':>18} {'ускорение':>10}")
+        for name in before:
+            old = percentile(before[name], 50) * 1000
+            new = percentile(after[name], 50) * 1000
+            print(f"{name:<26} {old:>18.1f} {new:>18.1f} {old / max(new, 1e-6):>9.1f}x")
+    finally:
+        raw.close()
+        panel.close()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Общие утилиты бенчмарков: перцентили, измерение лага event loop, сводные таблицы
+"""
+
+import asyncio
+from typing import Dict, List
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_lag(stop: asyncio.Event, interval: float, samples: list):
+    """Тикер: фиксирует, на сколько позже ожидаемого он был разбужен"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def latency_row(name: str, latencies: List[float], extra: Dict[str, str] = None) -> str:
+    """Строка отчета: p50/p90/p99/max в секундах"""
+    row = (f"{name:<28} n={len(latencies):<6} "
+           f"p50={percentile(latencies, 50):7.2f}  p90={percentile(latencies, 90):7.2f}  "
+           f"p99={percentile(latencies, 99):7.2f}  max={max(latencies, default=0.0):7.2f}")
+    for key, value in (extra or {}).items():
+        row += f"  {key}={value}"
+    return row
+
+
+def lag_summary(samples: List[float]) -> str:
+    return (f"Лаг event loop: p50={percentile(samples, 50) * 1000:.1f} мс, "
+            f"p99={percentile(samples, 99) * 1000:.1f} мс, "
+            f"max={max(samples, default=0.0) * 1000:.1f} мс")
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Сквозной нагрузочный тест бота: настоящий dp из main.py против заглушек
+Telegram Bot API, Perplexity и OpenAI
+
+Тысячи симулированных пользователей задают вопросы текстом и голосом,
+загружают документы на проверку, администраторы открывают разделы
+админ-панели. Отчет: задержка по обработчикам (время самого обработчика
+и от постановки обновления в очередь), лаг event loop бота, пиковая память.
+
+    python benchmarks/bot_e2e.py --users 2000 --duration 60 --scale 0.1 --unlimited
+    python benchmarks/bot_e2e.py --mix admin=1 --users 20 --tracemalloc
+
+Заглушки работают в отдельных потоках, поэтому лаг event loop относится
+только к боту. Пиковая память (maxrss, tracemalloc) - на весь процесс,
+включая заглушки.
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram import BaseMiddleware  # noqa: E402
+
+from config import Config  # noqa: E402
+from bench_utils import lag_summary, latency_row, measure_lag, percentile  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+from fake_upstream import DEFAULT_PROFILES, FakeUpstream, apply_overrides  # noqa: E402
+
+SCENARIOS = ("text", "voice", "document", "admin")
+
+QUESTIONS = [
+    "Меня уволили без приказа и не выплатили зарплату",
+    "Как пройти банкротство физического лица с долгом 800 тысяч",
+    "Продавец не возвращает деньги за некачественный товар по договору",
+    "Работодатель не оплачивает больничный и отпуск",
+]
+
+DOCUMENT_TEXT = ("ДОГОВОР ОКАЗАНИЯ УСЛУГ №{n}\n\n"
+                 "1. Исполнитель обязуется оказать услуги, а Заказчик обязуется их оплатить.\n"
+                 "2. Стоимость услуг составляет 50 000 рублей.\n"
+                 "3. Споры разрешаются в суде по месту нахождения Исполнителя.\n") * 40
+
+
+def make_documents():
+    """Примеры документов во всех поддерживаемых форматах"""
+    documents = {"txt": DOCUMENT_TEXT.format(n=1).encode("utf-8")}
+    try:
+        import docx
+        document = docx.Document()
+        for paragraph in DOCUMENT_TEXT.format(n=2).split("\n"):
+            document.add_paragraph(paragraph)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        documents["docx"] = buffer.getvalue()
+    except ImportError:
+        pass
+    try:
+        import fitz
+        pdf = fitz.open()
+        lines = DOCUMENT_TEXT.format(n=3).split("\n")
+        for start in range(0, len(lines), 40):
+            page = pdf.new_page()
+            page.insert_text((50, 50), "\n".join(lines[start:start + 40]), fontsize=9, fontname="helv")
+        documents["pdf"] = pdf.tobytes()
+        pdf.close()
+    except ImportError:
+        pass
+    return documents
+
+
+class HandlerTimings(BaseMiddleware):
+    """Время каждого обработчика и сквозная задержка от постановки обновления в очередь"""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+        self.handler_time = defaultdict(list)
+        self.end_to_end = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        update = data.get("event_update")
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            finished = time.monotonic()
+            self.handler_time[name].append(finished - started)
+            enqueued = self.telegram.enqueued_at.pop(update.update_id, None) if update else None
+            if enqueued is not None:
+                self.end_to_end[name].append(finished - enqueued)
+            chat = data.get("event_chat")
+            if chat is not None:
+                self.telegram.notify_handled(chat.id, name)
+
+
+class SimulatedUsers:
+    """Сценарии пользователей; выполняются в event loop заглушки Telegram"""
+
+    def __init__(self, telegram: FakeTelegram, args, admin_id: int):
+        self.telegram = telegram
+        self.args = args
+        self.admin_id = admin_id
+        self.random = random.Random(args.seed)
+        self.documents = make_documents()
+        self.scenarios_done = defaultdict(int)
+        # Голосовое сообщение: содержимое не важно, распознавание выполняет заглушка OpenAI
+        self.voice_file = telegram.register_file(b"OggS" + os.urandom(24 * 1024), "voice/file_0.oga")
+
+    async def step(self, chat_id: int, push) -> bool:
+        push()
+        return await self.telegram.wait_handled(chat_id, self.args.step_timeout) is not None
+
+    async def text(self, chat_id: int):
+        if await self.step(chat_id, lambda: self.telegram.push_callback(chat_id, "find_practice")):
+            question = f"{self.random.choice(QUESTIONS)} (пользователь {chat_id})"
+            await self.step(chat_id, lambda: self.telegram.push_message(chat_id, text=question))
+
+    async def voice(self, chat_id: int):
+        await self.step(chat_id, lambda: self.telegram.push_message(chat_id, voice={**self.voice_file, "duration": 12}))
+
+    async def document(self, chat_id: int):
+        extension = self.random.choice(list(self.documents))
+        data = self.documents[extension]
+        file = self.telegram.register_file(data, f"documents/file_{chat_id}_{time.monotonic_ns()}.{extension}")
+        document = {**file, "file_name": f"договор.{extension}", "mime_type": "application/octet-stream"}
+        if await self.step(chat_id, lambda: self.telegram.push_callback(chat_id, "check_document")):
+            await self.step(chat_id, lambda: self.telegram.push_message(chat_id, document=document))
+
+    async def admin(self, chat_id: int):
+        await self.step(chat_id, lambda: self.telegram.push_message(chat_id, self.admin_id, text="/admin"))
+        for section in ("admin_analytics", "admin_users", "upage|a|n|1||", "admin_requests", "admin_timings",
+                        "admin_cohorts", "admin_cohortcsv", "admin_services"):
+            await self.step(chat_id, lambda: self.telegram.push_callback(chat_id, section, self.admin_id))
+        await self.step(chat_id, lambda: self.telegram.push_message(chat_id, self.admin_id, text="/search зарплата"))
+
+    async def session(self, number: int, deadline: float):
+        chat_id = 10_000_000 + number
+        await asyncio.sleep(self.args.ramp * number / max(1, self.args.users))
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        while time.monotonic() < deadline:
+            scenario = self.random.choices(names, weights)[0]
+            await getattr(self, scenario)(chat_id)
+            self.scenarios_done[scenario] += 1
+            await asyncio.sleep(self.random.expovariate(1 / self.args.think))
+
+    async def run(self):
+        deadline = time.monotonic() + self.args.duration
+        await asyncio.gather(*[self.session(number, deadline) for number in range(self.args.users)])
+
+
+async def run(args, telegram: FakeTelegram):
+    import main as bot_main
+
+    if not args.tts_convert:
+        # Без ffmpeg конвертация всегда неуспешна - меряем только запрос к TTS API
+        bot_main.tts_service._convert_mp3_to_ogg = lambda mp3_data: mp3_data
+
+    timings = HandlerTimings(telegram)
+    bot_main.dp.message.middleware(timings)
+    bot_main.dp.callback_query.middleware(timings)
+
+    lag_samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, 0.01, lag_samples))
+
+    polling = asyncio.create_task(bot_main.main())
+    users = SimulatedUsers(telegram, args, next(iter(bot_main.admin_panel.ADMIN_IDS)))
+    started = time.monotonic()
+    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(users.run(), telegram.loop))
+    elapsed = time.monotonic() - started
+
+    # Те же замеры, что видит админ-панель: время этапов внутри бота (до остановки - база еще открыта)
+    await asyncio.to_thread(bot_main.admin_panel.refresh_snapshot)
+    stages = await asyncio.to_thread(bot_main.admin_panel.get_timing_percentiles)
+
+    await bot_main.dp.stop_polling()
+    await polling
+    stop.set()
+    await ticker
+
+    print(f"\nПользователей: {args.users}, длительность: {elapsed:.1f} с")
+    print("Сценарии: " + ", ".join(f"{name}={count}" for name, count in users.scenarios_done.items()))
+    print("\nОбработчики (секунды; e2e - от постановки обновления в очередь):")
+    for name in sorted(timings.handler_time, key=lambda n: -percentile(timings.handler_time[n], 99)):
+        e2e = timings.end_to_end[name]
+        print(latency_row(name, timings.handler_time[name], {
+            "e2e_p50": f"{percentile(e2e, 50):.2f}",
+            "e2e_p99": f"{percentile(e2e, 99):.2f}",
+            "ошибок": str(timings.errors[name])
+        }))
+    if stages:
+        print("\nЭтапы обработки по request_timings (p50 / p99, секунды; в скобках - замеров):")
+        for request_type, group in sorted(stages.items()):
+            print(f"  {request_type} ({group['count']}): " + ", ".join(
+                f"{name}={p50 / 1000:.2f}/{p99 / 1000:.2f} ({measured})"
+                for name, (p50, _, p99, measured) in group['stages'].items()
+            ))
+    extraction = bot_main.extraction_cache.get_stats()
+    print(f"\nКэш текста документов: попаданий {extraction['hits']} (файл {extraction['file_hits']}, "
+          f"содержимое {extraction['content_hits']}), промахов {extraction['misses']}, "
+          f"не разбирали {extraction['bytes_saved'] / 1024:.0f} КБ")
+    print(f"\n{lag_summary(lag_samples)}")
+
+
+def parse_mix(value: str):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Число симулированных пользователей")
+    parser.add_argument("--duration", type=float, default=60.0, help="Длительность подачи нагрузки, секунды")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Время подключения всех пользователей, секунды")
+    parser.add_argument("--think", type=float, default=30.0, help="Средняя пауза пользователя между сценариями")
+    parser.add_argument("--step-timeout", type=float, default=300.0, help="Ожидание ответа бота на шаг сценария")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=5,voice=2,document=2,admin=1"),
+                        help="Доли сценариев: name=weight,...")
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель задержек заглушки внешних API")
+    parser.add_argument("--set", dest="overrides", action="append", default=[],
+                        metavar="ENDPOINT.KEY=VALUE", help="Параметр профиля заглушки (см. fake_upstream.py)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответов Bot API, секунды")
+    parser.add_argument("--unlimited", action="store_true", help="Снять ограничения частоты бота")
+    parser.add_argument("--tts-convert", choices=["auto", "on", "off"], default="auto",
+                        help="Конвертировать MP3 в OGG (auto - если найден ffmpeg)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Пиковая память по tracemalloc (медленнее)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    args.tts_convert = (args.tts_convert == "on"
+                        or (args.tts_convert == "auto" and shutil.which("ffmpeg") is not None))
+
+    # До импорта main: его basicConfig(level=INFO) тогда не перекроет уровень
+    logging.basicConfig(level=logging.ERROR, format=Config.LOG_FORMAT)
+
+    profiles = apply_overrides({name: dict(p) for name, p in DEFAULT_PROFILES.items()}, args.overrides)
+    upstream = FakeUpstream(profiles, scale=args.scale, seed=args.seed)
+    upstream.start_in_thread()
+    telegram = FakeTelegram(api_latency=args.api_latency)
+    telegram.start_in_thread()
+
+    # Бот пишет базы и временные файлы в текущий каталог - работаем во временном
+    workdir = tempfile.mkdtemp(prefix="bot_e2e_")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    # Настройки меняются до импорта main: бот и сервисы создаются при импорте
+    Config.BOT_TOKEN = "123:fake"
+    Config.TELEGRAM_API_URL = telegram.base_url
+    Config.PERPLEXITY_BASE_URL = upstream.perplexity_url
+    Config.OPENAI_BASE_URL = upstream.openai_url
+    if args.unlimited:
+        Config.RATE_LIMITS = {name: {"rate": 1000.0, "burst": 1000} for name in Config.RATE_LIMITS}
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    try:
+        asyncio.run(run(args, telegram))
+        print(f"Пиковая память процесса (maxrss): {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+        if args.tracemalloc:
+            print(f"Пиковая память Python (tracemalloc): {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} МБ")
+        print("Вызовы Bot API: " + ", ".join(f"{method}={count}" for method, count in sorted(telegram.stats.items())))
+        print(f"Загружено ботом в Telegram: {telegram.uploaded_bytes / 1024 / 1024:.1f} МБ")
+    finally:
+        telegram.stop_thread()
+        upstream.stop_thread()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
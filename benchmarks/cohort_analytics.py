@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Когортная аналитика: NumPy по суточным агрегатам (analytics.py) против SQL по user_requests
+
+Скрипт заполняет базу так же, как admin_indexes.py, строит агрегаты
+rollup_user_type_daily и сравнивает:
+- загрузку агрегатов в массивы и расчет всего отчета CohortAnalytics.report();
+- те же недельные когорты и ряд MAU запросами SQL к user_requests (с индексами).
+Матрицы когорт сверяются между собой.
+
+    python benchmarks/cohort_analytics.py               # 5 млн запросов
+    python benchmarks/cohort_analytics.py --rows 500000 --users 20000
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from admin_indexes import fill  # noqa: E402
+
+SQL_COHORTS = """
+    WITH first AS (
+        SELECT user_id, (CAST(julianday(MIN(substr(timestamp, 1, 10))) - 2440587.5 AS INTEGER) + ?) / 7 AS cohort
+        FROM user_requests
+        GROUP BY user_id
+    ), weeks AS (
+        SELECT DISTINCT user_id, (CAST(julianday(substr(timestamp, 1, 10)) - 2440587.5 AS INTEGER) + ?) / 7 AS week
+        FROM user_requests
+    )
+    SELECT f.cohort, w.week - f.cohort, COUNT(*)
+    FROM weeks w JOIN first f ON f.user_id = w.user_id
+    WHERE f.cohort >= ?
+    GROUP BY 1, 2
+"""
+
+
+def sql_report(conn: sqlite3.Connection, weeks: int, series_days: int) -> np.ndarray:
+    """Когорты и ряд MAU запросами к user_requests; возвращает матрицу когорт"""
+    from analytics import EPOCH, WEEK_SHIFT
+    today = (datetime.utcnow().date() - EPOCH).days
+    first_week = (today + WEEK_SHIFT) // 7 - weeks + 1
+    matrix = np.zeros((weeks, weeks), dtype=np.int64)
+    for cohort, offset, users in conn.execute(SQL_COHORTS, (WEEK_SHIFT, WEEK_SHIFT, first_week)):
+        matrix[cohort - first_week, offset] = users
+    for days_ago in range(series_days):
+        end = datetime.utcnow().date() - timedelta(days=days_ago)
+        conn.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM user_requests WHERE timestamp >= ? AND timestamp < ?",
+            ((end - timedelta(days=29)).isoformat(), (end + timedelta(days=1)).isoformat())
+        ).fetchone()
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Количество записей в user_requests")
+    parser.add_argument("--users", type=int, default=200_000, help="Количество пользователей")
+    parser.add_argument("--session", type=int, default=4, help="Запросов пользователя подряд (за одни сутки)")
+    parser.add_argument("--days", type=int, default=365, help="Период, по которому распределены запросы")
+    parser.add_argument("--db", help="Путь к базе (по умолчанию - временный каталог)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="cohort_analytics_")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(workdir, "bot_database.db")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    # admin_panel при импорте создает глобальный AdminPanel() с базой в текущем каталоге -
+    # импортируем его из временного каталога, чтобы не оставлять ./bot_database.db
+    from admin_panel import AdminPanel
+    from analytics import CohortAnalytics
+
+    panel = AdminPanel(db_path)
+    raw = panel._connect()
+    try:
+        started = time.perf_counter()
+        fill(raw, args.rows, args.users, args.days, 40, args.session)
+        with raw:
+            AdminPanel.rebuild_type_rollup(raw.cursor())
+        raw.execute("ANALYZE")
+        aggregates = raw.execute("SELECT COUNT(*) FROM rollup_user_type_daily").fetchone()[0]
+        print(f"Заполнение: {args.rows} запросов, {aggregates} строк агрегатов "
+              f"за {time.perf_counter() - started:.1f} с")
+
+        # Массивы кэшируются до следующего снимка, как в работающем боте
+        panel.refresh_snapshot()
+        analytics = CohortAnalytics(panel)
+        started = time.perf_counter()
+        report = analytics.report()
+        total = time.perf_counter() - started
+        stats = report['stats']
+        print(f"\nNumPy: загрузка {stats['load_time']:.2f} с ({stats['bytes'] / 1024 / 1024:.1f} МБ массивов), "
+              f"расчет {stats['compute_time'] * 1000:.0f} мс, всего {total:.2f} с")
+        started = time.perf_counter()
+        analytics.report()
+        print(f"NumPy, повторный отчет (массивы уже загружены): {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        started = time.perf_counter()
+        matrix = sql_report(raw, Config.ANALYTICS_COHORT_WEEKS, Config.ANALYTICS_SERIES_DAYS)
+        print(f"SQL по user_requests: {time.perf_counter() - started:.2f} с")
+        same = np.array_equal(matrix, report['cohorts']['matrix'])
+        print(f"Матрицы когорт совпадают: {'да' if same else 'НЕТ'}")
+
+        print()
+        print(CohortAnalytics.format_message(report).replace("<pre>", "").replace("</pre>", "")
+              .replace("<b>", "").replace("</b>", ""))
+    finally:
+        raw.close()
+        panel.close()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Извлечение текста DOCX: прежний алгоритм (python-docx) против потокового разбора (docx_extractor.py)
+
+Прежний алгоритм строит объектную модель python-docx и собирает текст через
++= по абзацам и всем ячейкам row.cells (объединенные ячейки - повторно).
+Потоковый разбор читает word/document.xml из архива через lxml.iterparse.
+
+Документ генерируется сразу в XML: абзацы договора и таблицы с объединенными
+по горизонтали и вертикали ячейками. Каждый вариант запускается в отдельном
+процессе, прирост памяти - по пиковому RSS процесса.
+
+    python benchmarks/docx_extraction.py                # ~50 МБ document.xml
+    python benchmarks/docx_extraction.py --paragraphs 20000 --tables 20
+"""
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+import docx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from document_processor import DocumentProcessor  # noqa: E402
+from docx_extractor import iter_docx_blocks  # noqa: E402
+
+NAMESPACE = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+SENTENCE = ("Арендатор обязуется своевременно вносить арендную плату по договору №{n} "
+            "и возместить ущерб, причиненный имуществу арендодателя. ")
+
+
+def paragraph(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def cell(text: str, properties: str = "") -> str:
+    return f"<w:tc><w:tcPr><w:tcW w:w=\"1000\" w:type=\"dxa\"/>{properties}</w:tcPr>{paragraph(text)}</w:tc>"
+
+
+def table(number: int, rows: int, columns: int) -> str:
+    """Таблица: первая ячейка строки объединена на 2 колонки, последняя колонка - по вертикали"""
+    parts = ["<w:tbl>"]
+    for row in range(rows):
+        cells = [cell(f"Позиция {number}.{row}", '<w:gridSpan w:val="2"/>')]
+        cells += [cell(f"{number * row + column} руб.") for column in range(2, columns - 1)]
+        merge = '<w:vMerge w:val="restart"/>' if row % 10 == 0 else "<w:vMerge/>"
+        cells.append(cell(f"Раздел {number}.{row // 10}" if row % 10 == 0 else "", merge))
+        parts.append("<w:tr>" + "".join(cells) + "</w:tr>")
+    parts.append("</w:tbl>")
+    return "".join(parts)
+
+
+def make_docx(paragraphs: int, tables: int, rows: int, columns: int) -> bytes:
+    """DOCX из шаблона python-docx с замененным word/document.xml"""
+    template = io.BytesIO()
+    docx.Document().save(template)
+
+    body = []
+    per_table = max(1, paragraphs // max(1, tables))
+    for number in range(paragraphs):
+        body.append(paragraph(SENTENCE.format(n=number) * 3))
+        if tables and number % per_table == per_table - 1 and number // per_table < tables:
+            body.append(table(number // per_table, rows, columns))
+    document = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {NAMESPACE}><w:body>' \
+               + "".join(body) + "</w:body></w:document>"
+
+    result = io.BytesIO()
+    with zipfile.ZipFile(template) as source, zipfile.ZipFile(result, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            if item.filename == "word/document.xml":
+                target.writestr(item.filename, document.encode("utf-8"))
+            else:
+                target.writestr(item, source.read(item.filename))
+    return result.getvalue()
+
+
+def legacy_extract(data: bytes) -> str:
+    """Прежний DocumentProcessor._extract_from_docx"""
+    doc = docx.Document(io.BytesIO(data))
+    text = ""
+    for paragraph_ in doc.paragraphs:
+        text += paragraph_.text + "\n"
+    for table_ in doc.tables:
+        for row in table_.rows:
+            for cell_ in row.cells:
+                text += cell_.text + " "
+            text += "\n"
+    return text.strip()
+
+
+def stream_extract(data: bytes) -> str:
+    return "".join(iter_docx_blocks(data)).strip()
+
+
+def budget_extract(data: bytes) -> str:
+    return DocumentProcessor().read_text(data, Config.DOCUMENT_MAX_CHARS, ".docx")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def measure(engine, data: bytes, connection):
+    """В отдельном процессе: время, длина текста и прирост пикового RSS"""
+    baseline = rss_mb()
+    started = time.perf_counter()
+    text = engine(data)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send((elapsed, len(text or ""), peak - baseline))
+    connection.close()
+
+
+def run(engine, data: bytes):
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=measure, args=(engine, data, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=60000, help="Абзацев в документе")
+    parser.add_argument("--tables", type=int, default=60, help="Таблиц в документе")
+    parser.add_argument("--rows", type=int, default=200, help="Строк в таблице")
+    parser.add_argument("--columns", type=int, default=6, help="Колонок в таблице")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    started = time.perf_counter()
+    data = make_docx(args.paragraphs, args.tables, args.rows, args.columns)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        xml_size = archive.getinfo("word/document.xml").file_size
+    print(f"Документ: {len(data) / 1024 / 1024:.1f} МБ (document.xml {xml_size / 1024 / 1024:.1f} МБ), "
+          f"создан за {time.perf_counter() - started:.1f} с")
+
+    print(f"\n{'Вариант':<22} {'время, с':>9} {'символов':>11} {'память, МБ':>11}")
+    for name, engine in (("python-docx (прежний)", legacy_extract),
+                         ("поток iterparse", stream_extract),
+                         (f"поток, {Config.DOCUMENT_MAX_CHARS} симв.", budget_extract)):
+        elapsed, chars, memory = run(engine, data)
+        print(f"{name:<22} {elapsed:>9.2f} {chars:>11} {memory:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Telegram Bot API для сквозных нагрузочных тестов
+
+Бот подключается к заглушке через Config.TELEGRAM_API_URL. Заглушка
+отдает синтетические обновления через getUpdates (long polling), принимает
+sendMessage, editMessageText, deleteMessage, sendVoice, sendDocument,
+answerCallbackQuery и setMyCommands, отдает файлы через getFile и /file/.
+
+Обновления создаются методами push_message / push_callback, обычно
+из сценариев симулированных пользователей (см. bot_e2e.py), которые
+выполняются в event loop заглушки - отдельно от event loop бота.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "Виртуальный юрист", "username": "fake_law_bot"}
+
+
+class FakeTelegram:
+    """HTTP-сервер, имитирующий Telegram Bot API"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, api_latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.api_latency = api_latency
+        self.base_url: Optional[str] = None
+
+        self._updates: List[Dict] = []
+        self._update_id = 0
+        self._message_id = 0
+        self._new_update: Optional[asyncio.Event] = None
+        self._handled: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.files: Dict[str, Dict] = {}
+        self._paths: Dict[str, bytes] = {}
+        # Момент постановки обновления в очередь (time.monotonic) для сквозной задержки
+        self.enqueued_at: Dict[int, float] = {}
+
+        self.stats = defaultdict(int)
+        self.uploaded_bytes = 0
+
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------- Запуск ----------
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.api_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.download_file)
+        return app
+
+    async def start(self) -> str:
+        self._new_update = asyncio.Event()
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> str:
+        """Запускает сервер в отдельном потоке со своим event loop"""
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.stop())
+            self.loop.close()
+
+        self._thread = threading.Thread(target=serve, name="fake-telegram", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop_thread(self):
+        if self.loop is not None and self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+
+    # ---------- Обновления от «пользователей» ----------
+
+    def _push(self, kind: str, payload: Dict) -> int:
+        self._update_id += 1
+        self._updates.append({"update_id": self._update_id, kind: payload})
+        self.enqueued_at[self._update_id] = time.monotonic()
+        self._new_update.set()
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+                "username": f"user{user_id}", "language_code": "ru"}
+
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def push_message(self, chat_id: int, user_id: int = None, text: str = None,
+                     voice: Dict = None, document: Dict = None) -> int:
+        """Сообщение пользователя боту (текст, голос или документ)"""
+        message = {
+            "message_id": self._next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(user_id or chat_id)
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if voice is not None:
+            message["voice"] = voice
+        if document is not None:
+            message["document"] = document
+        return self._push("message", message)
+
+    def push_callback(self, chat_id: int, data: str, user_id: int = None) -> int:
+        """Нажатие inline-кнопки под сообщением бота"""
+        callback = {
+            "id": str(self._update_id + 1),
+            "from": self._user(user_id or chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": self._next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "Меню"
+            }
+        }
+        return self._push("callback_query", callback)
+
+    def register_file(self, data: bytes, path: str) -> Dict:
+        """Кладет файл «на серверы Telegram», возвращает поля для voice/document"""
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        file_id = f"file_{len(self.files) + 1}_{digest}"
+        self.files[file_id] = {"data": data, "path": path, "unique_id": digest}
+        self._paths[path] = data
+        return {"file_id": file_id, "file_unique_id": digest, "file_size": len(data)}
+
+    def notify_handled(self, chat_id: int, handler: str):
+        """Вызывается из event loop бота: обработчик для чата завершился"""
+        self.loop.call_soon_threadsafe(self._mark_handled, chat_id, handler)
+
+    def _mark_handled(self, chat_id: int, handler: str):
+        self._handled[chat_id].put_nowait(handler)
+
+    async def wait_handled(self, chat_id: int, timeout: float) -> Optional[str]:
+        """Ждет завершения обработки очередного обновления чата"""
+        try:
+            return await asyncio.wait_for(self._handled[chat_id].get(), timeout)
+        except asyncio.TimeoutError:
+            self.stats['user_timeouts'] += 1
+            return None
+
+    # ---------- Bot API ----------
+
+    async def _params(self, request: web.Request) -> Dict:
+        params = dict(request.query)
+        if request.method == "POST" and request.can_read_body:
+            form = await request.post()
+            for key, value in form.items():
+                if isinstance(value, web.FileField):
+                    data = value.file.read()
+                    self.uploaded_bytes += len(data)
+                    params[key] = {"filename": value.filename, "size": len(data)}
+                else:
+                    params[key] = value
+        return params
+
+    def _bot_message(self, chat_id, **content) -> Dict:
+        return {
+            "message_id": self._next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+            **content
+        }
+
+    async def api_method(self, request: web.Request):
+        method = request.match_info["method"]
+        self.stats[method] += 1
+        params = await self._params(request)
+        if self.api_latency and method != "getUpdates":
+            await asyncio.sleep(self.api_latency)
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            result = self._bot_message(params["chat_id"], text=params.get("text", ""))
+        elif method == "editMessageText":
+            result = {**self._bot_message(params["chat_id"], text=params.get("text", "")),
+                      "message_id": int(params["message_id"]), "edit_date": int(time.time())}
+        elif method == "sendVoice":
+            result = self._bot_message(params["chat_id"], voice={
+                "file_id": f"voice_out_{self._message_id}", "file_unique_id": f"vo{self._message_id}", "duration": 1
+            })
+        elif method == "sendDocument":
+            document = params.get("document") or {}
+            result = self._bot_message(params["chat_id"], document={
+                "file_id": f"doc_out_{self._message_id}", "file_unique_id": f"do{self._message_id}",
+                "file_name": document.get("filename") if isinstance(document, dict) else None
+            })
+        elif method == "getFile":
+            file = self.files.get(params.get("file_id"))
+            if file is None:
+                return web.json_response({"ok": False, "error_code": 400,
+                                          "description": "Bad Request: invalid file_id"}, status=400)
+            result = {"file_id": params["file_id"], "file_unique_id": file["unique_id"],
+                      "file_size": len(file["data"]), "file_path": file["path"]}
+        else:
+            # deleteMessage, answerCallbackQuery, setMyCommands, deleteWebhook и прочие
+            result = True
+
+        return web.Response(text=json.dumps({"ok": True, "result": result}, ensure_ascii=False),
+                            content_type="application/json")
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Подтвержденные через offset обновления больше не отдаем
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def download_file(self, request: web.Request):
+        self.stats['download'] += 1
+        data = self._paths.get(request.match_info["path"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
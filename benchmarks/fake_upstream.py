@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Локальная замена внешних API для нагрузочных тестов
+
+Имитирует Perplexity (/chat/completions) и OpenAI (/v1/chat/completions,
+/v1/audio/transcriptions, /v1/audio/speech): задержка по логнормальному
+распределению с «тяжелым хвостом», доля ошибок 500, доля ответов 429
+с Retry-After, потоковая выдача (SSE) при stream=true.
+
+Отдельный сервер:
+    python benchmarks/fake_upstream.py --port 8900 --set perplexity.latency=3 --set openai_chat.error_rate=0.05
+
+Затем в боте:
+    PERPLEXITY_BASE_URL = "http://127.0.0.1:8900"
+    OPENAI_BASE_URL = "http://127.0.0.1:8900/v1"
+
+Из кода бенчмарков:
+    upstream = FakeUpstream(scale=0.1)
+    base_url = upstream.start_in_thread()
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+# Профили по умолчанию: похожи на реальное поведение провайдеров
+DEFAULT_PROFILES = {
+    "perplexity": {
+        "latency": 4.0,         # Медиана задержки, секунды
+        "sigma": 0.35,          # Разброс логнормального распределения
+        "tail_rate": 0.02,      # Доля очень медленных ответов
+        "tail_latency": 20.0,   # Задержка медленного ответа, секунды
+        "error_rate": 0.01,     # Доля ответов 500
+        "throttle_rate": 0.0,   # Доля ответов 429
+        "retry_after": 1.0,     # Значение Retry-After, секунды
+        "chunks": 40            # Частей в потоковом ответе
+    },
+    "openai_chat": {
+        "latency": 6.0, "sigma": 0.4, "tail_rate": 0.01, "tail_latency": 25.0,
+        "error_rate": 0.01, "throttle_rate": 0.0, "retry_after": 1.0, "chunks": 60
+    },
+    "openai_whisper": {
+        "latency": 1.5, "sigma": 0.3, "tail_rate": 0.0, "tail_latency": 10.0,
+        "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1.0, "chunks": 1
+    },
+    "openai_tts": {
+        "latency": 2.0, "sigma": 0.3, "tail_rate": 0.0, "tail_latency": 10.0,
+        "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1.0, "chunks": 1
+    }
+}
+
+PERPLEXITY_ANSWER = """🔍 АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА:
+
+1. **КЛЮЧЕВЫЕ СТАТЬИ ЗАКОНОВ:**
+   • **Статья 81 ТК РФ** - расторжение трудового договора по инициативе работодателя
+   • **Статья 394 ТК РФ** - восстановление на работе
+
+2. **ПОШАГОВЫЕ ДЕЙСТВИЯ:**
+   • **Шаг 1:** Запросите копию приказа об увольнении
+   • **Шаг 2:** Обратитесь в трудовую инспекцию
+   • **Шаг 3:** Подайте иск в районный суд в течение месяца
+
+3. **ИСТОЧНИКИ:**
+   • https://www.consultant.ru/document/cons_doc_LAW_34683/
+"""
+
+GPT_ANSWER = """⚖️ <b>ПРАВОВОЙ АНАЛИЗ</b>
+
+Суд первой инстанции неправильно оценил представленные доказательства и не выслушал
+доводы истца. Требую отменить решение и принять новое решение по делу.
+
+📋 <b>ДОКУМЕНТЫ:</b>
+1. Копия решения суда
+2. Квитанция об уплате госпошлины
+"""
+
+TRANSCRIPTION = "Меня уволили с работы без приказа, что мне делать"
+
+# Кадр MPEG-1 Layer III 128 кбит/с 44.1 кГц с нулевыми данными (тишина, ~26 мс)
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def apply_overrides(profiles: Dict[str, Dict], overrides: List[str]) -> Dict[str, Dict]:
+    """Применяет параметры вида endpoint.key=value (endpoint '*' - ко всем)"""
+    for item in overrides or []:
+        name, _, value = item.partition("=")
+        endpoint, _, key = name.partition(".")
+        targets = profiles.keys() if endpoint == "*" else [endpoint]
+        for target in targets:
+            if target not in profiles or key not in profiles[target]:
+                raise ValueError(f"Неизвестный параметр профиля: {item}")
+            profiles[target][key] = type(profiles[target][key])(float(value))
+    return profiles
+
+
+class FakeUpstream:
+    """HTTP-сервер, имитирующий Perplexity и OpenAI"""
+
+    def __init__(self, profiles: Dict[str, Dict] = None, scale: float = 1.0,
+                 host: str = "127.0.0.1", port: int = 0, seed: Optional[int] = None):
+        self.profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+        for name, profile in (profiles or {}).items():
+            self.profiles[name].update(profile)
+        self.scale = scale
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+
+        self.base_url: Optional[str] = None
+        self.stats = {
+            name: {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0,
+                   'streamed': 0, 'in_flight': 0, 'max_in_flight': 0}
+            for name in self.profiles
+        }
+
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------- Запуск ----------
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/chat/completions", self.perplexity_completions)
+        app.router.add_post("/v1/chat/completions", self.openai_completions)
+        app.router.add_post("/v1/audio/transcriptions", self.openai_transcriptions)
+        app.router.add_post("/v1/audio/speech", self.openai_speech)
+        app.router.add_get("/stats", self.get_stats_handler)
+        return app
+
+    async def start(self) -> str:
+        """Запускает сервер в текущем event loop, возвращает базовый URL"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> str:
+        """Запускает сервер в отдельном потоке со своим event loop"""
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name="fake-upstream", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop_thread(self):
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    @property
+    def perplexity_url(self) -> str:
+        return self.base_url
+
+    @property
+    def openai_url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    # ---------- Поведение ----------
+
+    def _latency(self, profile: Dict) -> float:
+        if self.random.random() < profile["tail_rate"]:
+            latency = profile["tail_latency"]
+        else:
+            latency = profile["latency"] * math.exp(self.random.gauss(0, profile["sigma"]))
+        return latency * self.scale
+
+    def _failure(self, endpoint: str) -> Optional[web.Response]:
+        """Случайная ошибка согласно профилю (или None)"""
+        profile = self.profiles[endpoint]
+        roll = self.random.random()
+        if roll < profile["throttle_rate"]:
+            self.stats[endpoint]['throttled'] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests",
+                           "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"Retry-After": f"{profile['retry_after']:g}"}
+            )
+        if roll < profile["throttle_rate"] + profile["error_rate"]:
+            self.stats[endpoint]['errors'] += 1
+            return web.json_response(
+                {"error": {"message": "The server had an error processing your request",
+                           "type": "server_error"}},
+                status=500
+            )
+        return None
+
+    async def _respond(self, endpoint: str, request: web.Request, content_factory):
+        stats = self.stats[endpoint]
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            latency = self._latency(self.profiles[endpoint])
+            failure = self._failure(endpoint)
+            if failure is not None:
+                # Ошибки обычно приходят быстрее успешных ответов
+                await asyncio.sleep(latency * 0.1)
+                return failure
+            response = await content_factory(request, latency)
+            stats['ok'] += 1
+            return response
+        finally:
+            stats['in_flight'] -= 1
+
+    async def _completion(self, endpoint: str, request: web.Request, answer: str, model: str):
+        payload = await request.json()
+
+        async def build(request: web.Request, latency: float):
+            if payload.get("stream"):
+                self.stats[endpoint]['streamed'] += 1
+                return await self._stream_completion(request, answer, model, latency,
+                                                     self.profiles[endpoint]["chunks"])
+            await asyncio.sleep(latency)
+            return web.json_response(self._completion_body(answer, model))
+
+        return await self._respond(endpoint, request, build)
+
+    @staticmethod
+    def _completion_body(answer: str, model: str) -> Dict:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 500, "completion_tokens": len(answer) // 4,
+                      "total_tokens": 500 + len(answer) // 4}
+        }
+
+    async def _stream_completion(self, request: web.Request, answer: str, model: str,
+                                 latency: float, chunks: int) -> web.StreamResponse:
+        """SSE в формате chat.completion.chunk: первый токен через ~30% задержки"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                               "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        chunks = max(1, chunks)
+        step = max(1, math.ceil(len(answer) / chunks))
+        parts = [answer[i:i + step] for i in range(0, len(answer), step)]
+        await asyncio.sleep(latency * 0.3)
+        interval = latency * 0.7 / len(parts)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        try:
+            for index, part in enumerate(parts):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": part},
+                                 "finish_reason": "stop" if index == len(parts) - 1 else None}]
+                }
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                await asyncio.sleep(interval)
+
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # Клиент отменил запрос (дедлайн, остановка бота)
+            pass
+        return response
+
+    # ---------- Обработчики ----------
+
+    async def perplexity_completions(self, request: web.Request):
+        return await self._completion("perplexity", request, PERPLEXITY_ANSWER, "sonar")
+
+    async def openai_completions(self, request: web.Request):
+        return await self._completion("openai_chat", request, GPT_ANSWER, "gpt-4o")
+
+    async def openai_transcriptions(self, request: web.Request):
+        async def build(request: web.Request, latency: float):
+            # Дочитываем multipart-тело, как настоящий сервер
+            await request.read()
+            await asyncio.sleep(latency)
+            return web.json_response({"text": TRANSCRIPTION})
+
+        return await self._respond("openai_whisper", request, build)
+
+    async def openai_speech(self, request: web.Request):
+        async def build(request: web.Request, latency: float):
+            payload = await request.json()
+            await asyncio.sleep(latency)
+            # Примерно 60 мс звука на символ, как у реального TTS
+            frames = min(4000, max(10, len(payload.get("input", "")) * 60 // 26))
+            return web.Response(body=MP3_FRAME * frames, content_type="audio/mpeg")
+
+        return await self._respond("openai_tts", request, build)
+
+    async def get_stats_handler(self, request: web.Request):
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель всех задержек")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--set", dest="overrides", action="append", default=[],
+                        metavar="ENDPOINT.KEY=VALUE", help="Изменить параметр профиля (endpoint '*' - все)")
+    args = parser.parse_args()
+
+    profiles = apply_overrides({name: dict(p) for name, p in DEFAULT_PROFILES.items()}, args.overrides)
+    upstream = FakeUpstream(profiles, scale=args.scale, host=args.host, port=args.port, seed=args.seed)
+    print(f"Perplexity: http://{args.host}:{args.port}")
+    print(f"OpenAI:     http://{args.host}:{args.port}/v1")
+    print(f"Статистика: http://{args.host}:{args.port}/stats")
+    web.run_app(upstream.make_app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
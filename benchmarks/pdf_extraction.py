@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Извлечение текста PDF: прежний алгоритм против PdfExtractor (pdf_extractor.py)
+
+Прежний алгоритм: text += page.get_text() по страницам, а если текста нет
+(скан) - повторный разбор всего файла PyPDF2. PdfExtractor собирает страницы
+в список, определяет сканы по ресурсам страницы и делит большие документы
+на диапазоны страниц для пула процессов. DocumentProcessor.read_text с бюджетом
+DOCUMENT_MAX_CHARS читает страницы по одной и останавливается на бюджете.
+
+Документы генерируются PyMuPDF: текстовый (судебное дело), скан (только
+изображения) и смешанный.
+
+    python benchmarks/pdf_extraction.py                 # 300 страниц
+    python benchmarks/pdf_extraction.py --pages 1000 --workers 4
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+import PyPDF2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import percentile  # noqa: E402
+from config import Config  # noqa: E402
+from document_processor import DocumentProcessor  # noqa: E402
+from pdf_extractor import PdfExtractor  # noqa: E402
+
+PARAGRAPH = (
+    "The court, having examined the case materials and heard the parties, finds that the claimant "
+    "concluded an employment contract with the defendant, the salary was paid with a delay of "
+    "{n} days, and the claim for compensation under article 236 of the Labour Code is justified. "
+)
+
+
+def make_pdf(pages: int, scanned_every: int) -> bytes:
+    """PDF из pages страниц; каждая scanned_every-я страница - изображение без текста (0 - без сканов)"""
+    doc = fitz.open()
+    image = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 400, 560), 0)
+    image.clear_with(200)
+    for number in range(pages):
+        page = doc.new_page()
+        if scanned_every and number % scanned_every == 0:
+            page.insert_image(page.rect, pixmap=image)
+        else:
+            text = "".join(PARAGRAPH.format(n=number + k) for k in range(8))
+            page.insert_textbox(fitz.Rect(40, 40, page.rect.width - 40, page.rect.height - 40), text, fontsize=9)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def legacy_extract(data: bytes):
+    """Прежний DocumentProcessor._extract_from_pdf"""
+    doc = fitz.open(stream=data, filetype="pdf")
+    text = ""
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        text += page.get_text()
+    doc.close()
+    if text.strip():
+        return text
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+    text = ""
+    for page in pdf_reader.pages:
+        text += page.extract_text()
+    return text if text.strip() else None
+
+
+def timed(call, repeat: int):
+    call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300, help="Страниц в документе")
+    parser.add_argument("--workers", type=int, default=max(2, Config.PDF_WORKERS), help="Процессов пула")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    print(f"CPU: {os.cpu_count()}, процессов пула: {args.workers}")
+
+    sequential = PdfExtractor(workers=1)
+    parallel = PdfExtractor(workers=args.workers, parallel_min_pages=1)
+    if not parallel.start():
+        print("Пул процессов не запущен (нет fork) - столбец «пул» без параллельного разбора")
+    processor = DocumentProcessor()
+    try:
+        documents = {
+            "текст": make_pdf(args.pages, 0),
+            "скан": make_pdf(args.pages, 1),
+            "смешанный": make_pdf(args.pages, 10),
+        }
+        print(f"\n{'Документ':<12} {'МБ':>6} {'прежний, мс':>12} {'список, мс':>11} {'пул, мс':>9} "
+              f"{'бюджет, мс':>11} {'сканов':>7}")
+        for name, data in documents.items():
+            legacy_time, legacy_text = timed(lambda: legacy_extract(data), args.repeat)
+            sequential_time, result = timed(lambda: sequential.extract(data), args.repeat)
+            parallel_time, parallel_result = timed(lambda: parallel.extract(data), args.repeat)
+            budget_time, _ = timed(lambda: processor.read_text(data, Config.DOCUMENT_MAX_CHARS), args.repeat)
+            assert parallel_result['text'] == result['text']
+            assert (legacy_text or "") == result['text'] or not result['text'].strip()
+            print(f"{name:<12} {len(data) / 1024 / 1024:>6.1f} {legacy_time * 1000:>12.1f} "
+                  f"{sequential_time * 1000:>11.1f} {parallel_time * 1000:>9.1f} {budget_time * 1000:>11.1f} "
+                  f"{len(result['image_pages']):>7}")
+    finally:
+        parallel.close()
+
+
+if __name__ == "__main__":
+    main()
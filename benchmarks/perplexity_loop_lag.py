@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки event loop во время параллельных запросов к Perplexity
+
+Поднимает локальный HTTP-сервер, имитирующий /chat/completions с заданной
+задержкой, запускает N одновременных search_legal_info и параллельно
+измеряет, насколько опаздывает «тикер» event loop.
+
+    python benchmarks/perplexity_loop_lag.py --concurrency 20 --delay 2
+    python benchmarks/perplexity_loop_lag.py --mode blocking   # старое поведение
+    python benchmarks/perplexity_loop_lag.py --no-unlimited    # с ограничением частоты бота
+
+По умолчанию ограничения частоты (RATE_LIMITS) сняты: иначе очередь к Perplexity
+(0.8 запроса/с) растягивает «одновременные» поиски и время показывает лимит, а не event loop.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from bench_utils import lag_summary, measure_lag  # noqa: E402
+
+
+def make_handler(delay: float):
+    class CompletionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            time.sleep(delay)
+            body = json.dumps({
+                "choices": [{"message": {"content": "🔍 АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА:\n\n**Статья 394 ТК РФ**"}}]
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return CompletionHandler
+
+
+async def run(args):
+    from perplexity_service import PerplexityService
+
+    service = PerplexityService()
+
+    if args.mode == "blocking":
+        # Воспроизводим прежнюю реализацию: синхронный HTTP внутри корутины
+        async def blocking_request(system_prompt, query):
+            payload = json.dumps({"model": service.model, "messages": []}).encode("utf-8")
+            request = urllib.request.Request(service.base_url, data=payload, headers=service.headers)
+            with urllib.request.urlopen(request, timeout=45) as response:
+                return json.loads(response.read())["choices"][0]["message"]["content"]
+        service._make_request = blocking_request
+
+    samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, args.tick, samples))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        service.search_legal_info(f"уволили без приказа #{i}", "labor")
+        for i in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    await service.close()
+
+    print(f"Режим: {args.mode}")
+    print(f"Запросов: {args.concurrency}, задержка сервера: {args.delay:.2f} с")
+    print(f"Общее время: {elapsed:.2f} с")
+    print(lag_summary(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20, help="Число одновременных поисков")
+    parser.add_argument("--delay", type=float, default=1.0, help="Задержка ответа сервера, секунды")
+    parser.add_argument("--tick", type=float, default=0.01, help="Интервал тикера, секунды")
+    parser.add_argument("--mode", choices=["async", "blocking"], default="async")
+    parser.add_argument("--unlimited", action=argparse.BooleanOptionalAction, default=True,
+                        help="Снять ограничения частоты бота")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Config.PERPLEXITY_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    # Свежий кэш ответов на каждый запуск: иначе повторный запуск (и --mode blocking
+    # после async) получает ответы из answer_cache.db и не обращается к серверу
+    workdir = tempfile.mkdtemp(prefix="perplexity_loop_lag_")
+    Config.ANSWER_CACHE_DB = os.path.join(workdir, "answer_cache.db")
+    if args.unlimited:
+        Config.RATE_LIMITS = {name: {"rate": 1000.0, "burst": 1000} for name in Config.RATE_LIMITS}
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
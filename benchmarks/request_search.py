@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Поиск по истории запросов: FTS5 (AdminPanel.search_requests) против LIKE '%...%'
+
+Скрипт создает базу через AdminPanel, заполняет user_requests синтетическими
+текстами из юридического словаря (средствами SQLite), строит индекс поиска
+так же, как миграция, и замеряет поиск частых слов, нескольких слов, редкого
+номера дела и слова в другой форме. LIKE просматривает всю таблицу и
+не находит другие формы слова.
+
+    python benchmarks/request_search.py                 # 2 млн запросов
+    python benchmarks/request_search.py --rows 200000 --repeat 5
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import percentile  # noqa: E402
+
+WORDS = (
+    "работодатель зарплата задержка увольнение отпуск больничный договор трудовой "
+    "компенсация штраф суд иск жалоба претензия развод алименты имущество раздел "
+    "наследство завещание квартира аренда залог кредит банк долг коллектор банкротство "
+    "пенсия инвалидность пособие налог вычет штрафстоянка автомобиль страховка осаго "
+    "авария ущерб соседи затопление управляющая компания тарифы капремонт прописка "
+    "регистрация паспорт гражданство миграция виза полиция заявление прокуратура "
+    "адвокат нотариус доверенность подпись печать справка выписка свидетель экспертиза"
+).split()
+
+# Поисковые строки администратора; для LIKE - подстрока, которую он бы искал
+QUERIES = {
+    "частое слово": ("зарплата", "зарплата"),
+    "два слова": ("задержка зарплаты", "задержка зарплат"),
+    "номер дела": ("№123457", "№123457"),
+    "другая форма": ("банкротства", "банкротства"),
+}
+
+
+def fill(conn: sqlite3.Connection, rows: int, days: int, words_per_request: int):
+    """Запросы из случайных слов словаря с уникальным номером дела, за последние days суток"""
+    start = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute("CREATE TEMP TABLE words (id INTEGER PRIMARY KEY, word TEXT)")
+    conn.executemany("INSERT INTO words VALUES (?, ?)", enumerate(WORDS))
+    conn.commit()
+    # Подзапросы ссылаются на x, поэтому вычисляются для каждой строки заново
+    picks = " || ' ' || ".join(
+        f"(SELECT word FROM words WHERE id = (x * {7 + k} + abs(random())) % {len(WORDS)})"
+        for k in range(words_per_request)
+    )
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    conn.execute(f"""
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)
+        INSERT INTO user_requests (user_id, request_type, request_text, timestamp, processing_time)
+        SELECT 1 + x % 1000, 'legal_practice_search',
+               {picks} || ' дело №' || x,
+               datetime(?, '+' || (x * ? / ?) || ' seconds'),
+               0
+        FROM seq
+    """, (rows, start, days * 86400, rows))
+    conn.commit()
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def timed(call, repeat: int):
+    call()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Количество записей в user_requests")
+    parser.add_argument("--days", type=int, default=180, help="Период, по которому распределены запросы")
+    parser.add_argument("--words", type=int, default=12, help="Слов в тексте запроса")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов каждого замера")
+    parser.add_argument("--db", help="Путь к базе (по умолчанию - временный каталог)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="request_search_")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(workdir, "bot_database.db")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    # admin_panel при импорте создает глобальный AdminPanel() с базой в текущем каталоге -
+    # импортируем его из временного каталога, чтобы не оставлять ./bot_database.db
+    from admin_panel import AdminPanel
+
+    panel = AdminPanel(db_path)
+    raw = panel._connect()
+    try:
+        started = time.perf_counter()
+        fill(raw, args.rows, args.days, args.words)
+        print(f"Заполнение: {args.rows} запросов за {time.perf_counter() - started:.1f} с, "
+              f"размер базы {os.path.getsize(db_path) / 1024 / 1024:.0f} МБ")
+
+        started = time.perf_counter()
+        raw.execute("INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')")
+        raw.commit()
+        print(f"Построение индекса поиска: {time.perf_counter() - started:.1f} с, "
+              f"размер базы {os.path.getsize(db_path) / 1024 / 1024:.0f} МБ")
+
+        print(f"\n{'Запрос':<16} {'LIKE, мс':>10} {'найдено':>9} {'FTS5, мс':>10} {'совпадений':>11}")
+        for name, (query, substring) in QUERIES.items():
+            like_time, like_found = timed(lambda: raw.execute(
+                "SELECT COUNT(*) FROM user_requests WHERE unz(request_text) LIKE ?", (f"%{substring}%",)
+            ).fetchone()[0], args.repeat)
+            fts_time, found = timed(lambda: panel.search_requests(query), args.repeat)
+            matches = f"{found['matches']}{'+' if found['window_full'] else ''}"
+            print(f"{name:<16} {like_time * 1000:>10.1f} {like_found:>9} {fts_time * 1000:>10.1f} {matches:>11}")
+
+        _, found = timed(lambda: panel.search_requests("задержка зарплаты"), 1)
+        print("\nПример результата:", found['results'][0]['snippet'] if found['results'] else "—")
+    finally:
+        raw.close()
+        panel.close()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
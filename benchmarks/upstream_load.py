@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест сервисов бота против локальной замены Perplexity и OpenAI
+
+Открытая модель нагрузки: запросы запускаются по расписанию с заданной
+частотой независимо от того, успели ли завершиться предыдущие. Задержка
+считается от запланированного момента запуска, поэтому очередь внутри
+бота видна в перцентилях.
+
+    python benchmarks/upstream_load.py --rps 5 --duration 60 --scale 0.25
+    python benchmarks/upstream_load.py --mix find_legal_practice=1 --set perplexity.tail_rate=0.1
+    python benchmarks/upstream_load.py --unlimited --rps 20   # без ограничений частоты бота
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from bench_utils import lag_summary, latency_row, measure_lag  # noqa: E402
+from fake_upstream import DEFAULT_PROFILES, FakeUpstream, apply_overrides  # noqa: E402
+
+SCENARIOS = ("find_legal_practice", "generate_complaint", "text_to_speech")
+
+QUESTIONS = [
+    "Меня уволили без приказа и не выплатили зарплату",
+    "Как пройти банкротство физического лица с долгом 800 тысяч",
+    "Продавец не возвращает деньги за некачественный товар по договору",
+    "Работодатель не оплачивает больничный и отпуск",
+    "Кредитор требует вернуть задолженность через коллекторов",
+]
+
+COURT_DECISION = """РЕШЕНИЕ ИМЕНЕМ РОССИЙСКОЙ ФЕДЕРАЦИИ
+Районный суд рассмотрел гражданское дело по иску о восстановлении на работе
+и взыскании среднего заработка за время вынужденного прогула. В удовлетворении
+исковых требований отказать. Решение может быть обжаловано в течение месяца."""
+
+TTS_TEXT = ("Согласно статье 394 Трудового кодекса, работник, уволенный без законного "
+            "основания, подлежит восстановлению на прежней работе. ") * 6
+
+
+def is_success(scenario: str, result) -> bool:
+    if scenario == "text_to_speech":
+        return bool(result)
+    if isinstance(result, list):
+        return bool(result)
+    return bool(result) and not result.startswith("Извините")
+
+
+class LoadDriver:
+    """Запуск сценариев по расписанию и сбор задержек"""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.partials = 0
+
+        from ai_service import AIService
+        from tts_service import TTSService
+
+        self.ai_service = AIService(Config.OPENAI_API_KEY)
+        self.tts_service = TTSService(Config.OPENAI_API_KEY)
+
+        if not self.args.tts_convert:
+            # Без ffmpeg конвертация всегда неуспешна - меряем только запрос к TTS API
+            self.tts_service._convert_mp3_to_ogg = lambda mp3_data: mp3_data
+
+    def _query(self, number: int) -> str:
+        question = self.random.choice(QUESTIONS)
+        if self.random.random() < self.args.repeat_ratio:
+            # Повторяющиеся вопросы проверяют кэш и объединение запросов
+            return question
+        return f"{question} (обращение №{number})"
+
+    async def _on_partial(self, text: str):
+        """Потоковый режим как в боте, но без правок сообщения"""
+        self.partials += 1
+
+    async def run_one(self, scenario: str, number: int, scheduled: float):
+        loop = asyncio.get_running_loop()
+        try:
+            if scenario == "find_legal_practice":
+                result = await self.ai_service.find_legal_practice(
+                    self._query(number),
+                    on_partial=self._on_partial if self.args.stream else None
+                )
+            elif scenario == "generate_complaint":
+                result = await self.ai_service.generate_complaint(f"{COURT_DECISION}\nДело №{number}")
+            else:
+                result = await self.tts_service.text_to_speech(TTS_TEXT)
+            outcome = "ok" if is_success(scenario, result) else "failed"
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ {scenario}: {e}")
+            outcome = "exception"
+
+        self.outcomes[scenario][outcome] += 1
+        if outcome == "ok":
+            self.latencies[scenario].append(loop.time() - scheduled)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+
+        lag_samples = []
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(measure_lag(stop, 0.01, lag_samples))
+
+        tasks = []
+        started = loop.time()
+        next_at = started
+        number = 0
+        while next_at < started + self.args.duration:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            scenario = self.random.choices(names, weights)[0]
+            self.outcomes[scenario]['sent'] += 1
+            tasks.append(asyncio.create_task(self.run_one(scenario, number, next_at)))
+            number += 1
+            if self.args.arrivals == "poisson":
+                next_at += self.random.expovariate(self.args.rps)
+            else:
+                next_at += 1 / self.args.rps
+        offered = loop.time() - started
+
+        done, pending = await asyncio.wait(tasks, timeout=self.args.drain) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = loop.time() - started
+
+        stop.set()
+        await ticker
+
+        print(f"\nНагрузка: {self.args.rps:g} запр/с ({self.args.arrivals}), {number} запросов за {offered:.1f} с, "
+              f"всего {elapsed:.1f} с (не дождались: {len(pending)})")
+        print("Задержки успешных запросов, секунды:")
+        for scenario in names:
+            outcomes = self.outcomes[scenario]
+            ok = outcomes['ok']
+            print(latency_row(scenario, self.latencies[scenario], {
+                "отправлено": str(outcomes['sent']),
+                "ошибок": str(outcomes['failed'] + outcomes['exception']),
+                "пропускная": f"{ok / elapsed:.2f}/с"
+            }))
+        if self.args.stream:
+            print(f"Частичных ответов Perplexity: {self.partials}")
+        print(lag_summary(lag_samples))
+
+    async def close(self):
+        from openai_gateway import close_openai_gateways
+
+        await self.ai_service.perplexity.close()
+        await close_openai_gateways()
+
+
+def print_service_stats(upstream: FakeUpstream):
+    from provider_router import provider_router
+    from rate_limiter import rate_limiter
+
+    print("\nЗаглушка внешних API:")
+    for endpoint, stats in upstream.stats.items():
+        print(f"  {endpoint:<16} запросов={stats['requests']} ok={stats['ok']} 500={stats['errors']} "
+              f"429={stats['throttled']} поток={stats['streamed']} макс.параллельно={stats['max_in_flight']}")
+    print("Ограничитель частоты бота:")
+    for provider, stats in rate_limiter.get_stats().items():
+        print(f"  {provider:<16} выдано={stats['granted']} ждали={stats['throttled']} "
+              f"({stats['throttled_seconds']:.1f} с) отклонено={stats['rejected']} "
+              f"макс.очередь={stats['max_queue_depth']}")
+    print("Маршрутизатор провайдеров:")
+    for provider, stats in provider_router.get_stats().items():
+        print(f"  {provider:<16} {stats['state']} дублей={stats['hedged']} (выиграли {stats['hedge_wins']}) "
+              f"без запроса={stats['short_circuited']} таймаутов={stats['timeouts']} через GPT={stats['failovers']}")
+
+
+def parse_mix(value: str):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=2.0, help="Целевая частота запросов (все сценарии)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность подачи нагрузки, секунды")
+    parser.add_argument("--drain", type=float, default=120.0, help="Ожидание незавершенных запросов, секунды")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("find_legal_practice=6,generate_complaint=2,text_to_speech=2"),
+                        help="Доли сценариев: name=weight,...")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Доля повторяющихся вопросов")
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель задержек заглушки")
+    parser.add_argument("--set", dest="overrides", action="append", default=[],
+                        metavar="ENDPOINT.KEY=VALUE", help="Параметр профиля заглушки (см. fake_upstream.py)")
+    parser.add_argument("--stream", action="store_true", help="Потоковые ответы Perplexity (SSE)")
+    parser.add_argument("--unlimited", action="store_true", help="Снять ограничения частоты бота")
+    parser.add_argument("--tts-convert", choices=["auto", "on", "off"], default="auto",
+                        help="Конвертировать MP3 в OGG (auto - если найден ffmpeg)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    args.tts_convert = (args.tts_convert == "on"
+                        or (args.tts_convert == "auto" and shutil.which("ffmpeg") is not None))
+
+    logging.basicConfig(level=logging.ERROR, format=Config.LOG_FORMAT)
+
+    profiles = apply_overrides({name: dict(p) for name, p in DEFAULT_PROFILES.items()}, args.overrides)
+    upstream = FakeUpstream(profiles, scale=args.scale, seed=args.seed)
+    upstream.start_in_thread()
+
+    # Настройки меняются до импорта сервисов: глобальные объекты читают их при создании
+    workdir = tempfile.mkdtemp(prefix="upstream_load_")
+    Config.PERPLEXITY_BASE_URL = upstream.perplexity_url
+    Config.OPENAI_BASE_URL = upstream.openai_url
+    Config.ANSWER_CACHE_DB = os.path.join(workdir, "answer_cache.db")
+    if args.unlimited:
+        Config.RATE_LIMITS = {name: {"rate": 1000.0, "burst": 1000} for name in Config.RATE_LIMITS}
+
+    async def run():
+        driver = LoadDriver(args)
+        try:
+            await driver.run()
+        finally:
+            await driver.close()
+
+    try:
+        asyncio.run(run())
+        print_service_stats(upstream)
+    finally:
+        upstream.stop_thread()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ class Config:
     
     # Telegram Bot Token
     BOT_TOKEN = "Your_bot_token_here"
+    TELEGRAM_API_URL = None            # None - api.telegram.org; иначе адрес локального Bot API сервера
     
     # OpenAI API Key (рабочий ключ проекта)
     OPENAI_API_KEY = "sk-proj***************************************************************rAA"
@@ -16,10 +17,77 @@ class Config:
     # GPT модель
     GPT_MODEL = "gpt-3.5-turbo"
     
+    # Общий асинхронный клиент OpenAI (GPT, Whisper, TTS)
+    OPENAI_BASE_URL = None             # None - официальный API
+    OPENAI_MAX_CONCURRENCY = 10        # Одновременных вызовов к OpenAI
+    OPENAI_MAX_CONNECTIONS = 20        # Размер пула соединений
+    OPENAI_MAX_KEEPALIVE = 10          # Соединения, удерживаемые открытыми
+    OPENAI_MAX_RETRIES = 0             # Повторы внутри SDK (429/5xx и сетевые ошибки повторяет OpenAIGateway)
+    OPENAI_CONNECT_TIMEOUT = 5.0       # Установка соединения, секунды
+    OPENAI_CHAT_TIMEOUT = 60.0         # Таймаут одного вызова GPT
+    OPENAI_WHISPER_TIMEOUT = 60.0      # Таймаут распознавания речи
+    OPENAI_TTS_TIMEOUT = 60.0          # Таймаут синтеза речи
+    
+    # Ограничение частоты запросов к внешним API (token bucket на провайдера)
+    RATE_LIMITS = {                    # rate - запросов в секунду, burst - размер «пачки»
+        "perplexity": {"rate": 0.8, "burst": 5},
+        "openai_chat": {"rate": 3.0, "burst": 10},
+        "openai_whisper": {"rate": 0.8, "burst": 3},
+        "openai_tts": {"rate": 0.8, "burst": 3}
+    }
+    RATE_LIMIT_MAX_WAIT = 20.0         # Максимальное ожидание в очереди, секунды
+    RATE_LIMIT_MAX_ATTEMPTS = 3        # Попыток при ответе 429/5xx (OpenAI - и при сетевой ошибке)
+    RATE_LIMIT_BACKOFF_BASE = 1.0      # База экспоненциальной паузы, секунды
+    RATE_LIMIT_BACKOFF_MAX = 30.0      # Максимальная пауза, секунды (не больше RATE_LIMIT_MAX_WAIT)
+    RATE_LIMIT_MIN_FACTOR = 0.25       # Нижняя граница адаптивной скорости (доля от базовой)
+
+    # Маршрутизация запросов к провайдерам (хеджирование, circuit breaker)
+    ROUTER_WINDOW = 200                # Размер скользящего окна статистики, запросов
+    ROUTER_MIN_SAMPLES = 20            # Минимум успешных ответов для расчета p50/p95
+    ROUTER_HEDGING = True              # Дублировать запрос, если ответ дольше p95
+    ROUTER_HEDGE_MIN_DELAY = 2.0       # Не дублировать раньше, секунды
+    ROUTER_DEADLINE = 40.0             # Общий дедлайн вызова провайдера, секунды
+    ROUTER_FAILURE_THRESHOLD = 5       # Ошибок подряд до размыкания circuit breaker
+    ROUTER_BREAKER_COOLDOWN = 30.0     # Пауза до пробного запроса, секунды
+    
+    # База данных CRM: фоновая запись пачками
+    ADMIN_DB_BATCH_SIZE = 200          # Максимум операций в одной транзакции
+    ADMIN_DB_FLUSH_INTERVAL = 0.5      # Сколько ждать пополнения пачки, секунды
+    ADMIN_DB_QUEUE_SIZE = 10000        # Предел очереди (при переполнении записи пропускаются)
+    ADMIN_SNAPSHOT_INTERVAL = 120      # Период обновления снимка базы для админ-панели, секунды
+    ADMIN_USERS_PAGE_SIZE = 10         # Пользователей на странице админ-панели
+    ADMIN_PAGE_CACHE_TTL = 30          # Время жизни кэша страниц списка пользователей, секунды
+    ADMIN_USERS_FLUSH_INTERVAL = 10    # Период записи активности пользователей из памяти, секунды
+    ADMIN_SEARCH_PAGE_SIZE = 5         # Результатов поиска по запросам на странице
+    ADMIN_SEARCH_RANK_WINDOW = 2000    # Ранжировать не больше стольких последних совпадений
+    ADMIN_SEARCH_SNIPPET_TOKENS = 16   # Длина фрагмента с совпадением, слов
+    # Хранение истории запросов (retention.py)
+    RETENTION_COMPRESS_AFTER_DAYS = 30     # Тексты запросов старше - сжимаются zlib
+    RETENTION_COMPRESS_MIN_LENGTH = 200    # Более короткие тексты не сжимаются
+    RETENTION_HOT_MONTHS = 6               # Месяцев в основной базе; старые уходят в архивы
+    RETENTION_ARCHIVE_DIR = "archive"      # Каталог архивов по месяцам (только чтение)
+    RETENTION_BATCH_SIZE = 5000            # Строк за одну транзакцию обслуживания
+    RETENTION_INTERVAL = 6 * 3600          # Период запуска обслуживания, секунды
+    RETENTION_VACUUM_INTERVAL = 7 * 86400  # Период VACUUM основной базы, секунды
+    RETENTION_TIMINGS_DAYS = 90            # Сколько дней хранить время обработки по этапам
+    EXPORT_FETCH_SIZE = 5000           # Строк за одно чтение из курсора при экспорте
+    EXPORT_PART_SIZE = 45 * 1024 * 1024  # Размер части экспорта (лимит загрузки Bot API - 50 МБ)
+    EXPORT_REQUESTS_DAYS = 30          # Период экспорта запросов, дней
+    TIMING_WINDOW_DAYS = 7             # Окно перцентилей времени обработки в админ-панели, дней
+    # Когортная аналитика (analytics.py)
+    ANALYTICS_COHORT_WEEKS = 8         # Недельных когорт в таблице удержания
+    ANALYTICS_SERIES_DAYS = 30         # Дней в ряду DAU/WAU/MAU (CSV)
+    ANALYTICS_FETCH_SIZE = 50000       # Строк агрегатов за одно чтение
+    
     # Настройки файлов
     UPLOAD_DIR = "temp_uploads"
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 МБ
     ALLOWED_EXTENSIONS = {'.pdf', '.docx', '.txt', '.doc'}
+    PDF_WORKERS = min(4, os.cpu_count() or 1)  # Процессов для разбора больших PDF (1 - без пула)
+    PDF_PARALLEL_MIN_PAGES = 60        # С какого числа страниц PDF разбирается в пуле процессов
+    DOCUMENT_MAX_CHARS = 20000         # Символов документа в запросе к GPT (дальше документ не читается)
+    EXTRACTION_CACHE_DB = "extraction_cache.db"        # Кэш извлеченного текста документов
+    EXTRACTION_CACHE_MAX_BYTES = 200 * 1024 * 1024     # Объем сжатого текста в кэше, байт
     
     # Настройки логирования
     LOG_LEVEL = logging.INFO
@@ -27,7 +95,30 @@ class Config:
     
     # Настройки Perplexity API
     PERPLEXITY_MODEL = "sonar"  # Актуальная модель с января 2025
-    
+    PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+    # HTTP-клиент Perplexity (долгоживущий пул соединений)
+    PERPLEXITY_CONNECT_TIMEOUT = 5.0   # Установка соединения, секунды
+    PERPLEXITY_READ_TIMEOUT = 45.0     # Ожидание ответа (интернет-поиск медленный)
+    PERPLEXITY_MAX_CONNECTIONS = 20    # Максимум одновременных соединений
+    PERPLEXITY_MAX_KEEPALIVE = 10      # Соединения, удерживаемые открытыми
+    PERPLEXITY_KEEPALIVE_EXPIRY = 30.0 # Время жизни простаивающего соединения
+
+    # Потоковая выдача ответа Perplexity в сообщение «Обрабатываю»
+    PERPLEXITY_STREAMING = True
+    PERPLEXITY_STREAM_NOTIFY_INTERVAL = 0.25  # Как часто передавать накопленный текст, секунды
+    STREAM_EDIT_INTERVAL = 1.5                # Минимальный интервал между edit_text, секунды
+
+    # Кэш ответов Perplexity (память + SQLite)
+    ANSWER_CACHE_DB = "answer_cache.db"
+    ANSWER_CACHE_MEMORY_SIZE = 500     # Записей в LRU в памяти
+    ANSWER_CACHE_TTL = {               # Время жизни ответа по типу контекста, секунды
+        "bankruptcy": 12 * 3600,
+        "labor": 24 * 3600,
+        "civil": 24 * 3600,
+        "general": 6 * 3600
+    }
+
     # Тексты приветствия и меню
     WELCOME_TEXT = """🏛️ Добро пожаловать в «Виртуальный юрист»!
 
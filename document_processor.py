@@ -1,13 +1,28 @@
+import codecs
+import io
 import os
 import logging
-from typing import Optional
+import zipfile
+from typing import Iterator, Optional, Union
 import docx
 import PyPDF2
-import fitz  # PyMuPDF
 from pathlib import Path
 
+from docx_extractor import iter_docx_blocks
+from pdf_extractor import pdf_extractor
+
 logger = logging.getLogger(__name__)
 
+# Сигнатуры форматов (первые байты файла)
+PDF_MAGIC = b'%PDF-'
+ZIP_MAGIC = b'PK\x03\x04'
+# Сколько байт проверять на двоичные данные при определении TXT
+TEXT_SNIFF_BYTES = 8192
+# Блок декодирования TXT (по первому блоку выбирается кодировка)
+TEXT_BLOCK_BYTES = 65536
+# Пометка в конце текста, сокращенного до max_chars
+TRUNCATED_NOTE = "\n\n[Документ длиннее {max_chars} символов, текст сокращен]"
+
 class DocumentProcessor:
     def __init__(self):
         self.supported_formats = ['pdf', 'docx', 'txt']
@@ -15,91 +30,245 @@ class DocumentProcessor:
     def extract_text(self, file_path: str) -> Optional[str]:
         """Извлечение текста из файла"""
         try:
-            file_extension = Path(file_path).suffix.lower()
-            
-            if file_extension == '.pdf':
-                return self._extract_from_pdf(file_path)
-            elif file_extension == '.docx':
-                return self._extract_from_docx(file_path)
-            elif file_extension == '.txt':
-                return self._extract_from_txt(file_path)
-            else:
-                logger.error(f"Unsupported file format: {file_extension}")
-                return None
+            with open(file_path, 'rb') as file:
+                data = file.read()
+            return self.extract_text_from_bytes(data, Path(file_path).suffix)
                 
         except Exception as e:
             logger.error(f"Error extracting text from {file_path}: {e}")
             return None
     
-    def _extract_from_pdf(self, file_path: str) -> Optional[str]:
-        """Извлечение текста из PDF"""
+    def extract_text_from_bytes(self, data: bytes, ext: Optional[str] = None) -> Optional[str]:
+        """
+        Извлечение текста из содержимого файла в памяти (без временных файлов)
+        
+        Args:
+            data: Содержимое файла
+            ext: Расширение из имени файла ('.pdf', 'docx', ...) - только подсказка,
+                 формат определяется по сигнатуре содержимого
+        """
         try:
-            # Пробуем с PyMuPDF (более надежный)
-            doc = fitz.open(file_path)
-            text = ""
+            file_format = self._resolve_format(data, ext)
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text += page.get_text()
-            
-            doc.close()
+            if file_format == 'pdf':
+                return self._extract_from_pdf(data)
+            elif file_format == 'docx':
+                return self._extract_from_docx(data)
+            elif file_format == 'txt':
+                return self._extract_from_txt(data)
+            return None
+                
+        except Exception as e:
+            logger.error(f"Error extracting text from {ext or 'bytes'}: {e}")
+            return None
+    
+    def iter_text_chunks(self, source: Union[str, os.PathLike, bytes], max_chars: Optional[int] = None,
+                         ext: Optional[str] = None) -> Iterator[str]:
+        """
+        Текст документа частями: страницы PDF, абзацы и строки таблиц DOCX, строки TXT
+        
+        Части разбираются по мере чтения: если вызывающий остановился (или исчерпан
+        max_chars - последняя часть обрезается), остаток документа не разбирается.
+        
+        Args:
+            source: Путь к файлу или его содержимое
+            max_chars: Сколько символов выдать не более (None - весь документ)
+            ext: Расширение-подсказка для содержимого в памяти
+        """
+        if isinstance(source, (str, os.PathLike)):
+            ext = ext or Path(source).suffix
+            with open(source, 'rb') as file:
+                source = file.read()
+        
+        file_format = self._resolve_format(source, ext)
+        if file_format is None:
+            return
+        
+        readers = {'pdf': self._iter_pdf, 'docx': self._iter_docx, 'txt': self._iter_txt}
+        chunks = readers[file_format](source)
+        remaining = max_chars
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if remaining is not None and len(chunk) >= remaining:
+                    if remaining > 0:
+                        yield chunk[:remaining]
+                    return
+                yield chunk
+                if remaining is not None:
+                    remaining -= len(chunk)
+        finally:
+            chunks.close()
+    
+    def read_text(self, source: Union[str, os.PathLike, bytes], max_chars: Optional[int] = None,
+                  ext: Optional[str] = None) -> Optional[str]:
+        """
+        Текст документа не длиннее max_chars символов (с пометкой о сокращении)
+        
+        Читается только нужное начало документа - см. iter_text_chunks
+        """
+        try:
+            # Лишний символ показывает, что документ длиннее бюджета
+            limit = None if max_chars is None else max_chars + 1
+            text = "".join(self.iter_text_chunks(source, limit, ext))
+            if not text.strip():
+                return None
             
-            if text.strip():
-                return text
+            if max_chars is not None and len(text) > max_chars:
+                logger.info(f"Document text truncated to {max_chars} characters")
+                text = text[:max_chars] + TRUNCATED_NOTE.format(max_chars=max_chars)
+            return text
             
-            # Если PyMuPDF не дал результата, пробуем PyPDF2
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-                
-                return text if text.strip() else None
+        except Exception as e:
+            logger.error(f"Error reading text from {ext or 'document'}: {e}")
+            return None
+    
+    def _resolve_format(self, data: bytes, ext: Optional[str]) -> Optional[str]:
+        """Формат по содержимому; расхождение с расширением - в лог"""
+        file_format = self.detect_format(data)
+        claimed = (ext or '').lower().lstrip('.')
+        
+        if file_format is None:
+            logger.error(f"Unsupported file format: {claimed or 'unknown'}")
+        elif claimed and claimed != file_format:
+            logger.warning(f"File extension .{claimed} does not match content, reading as {file_format}")
+        return file_format
+    
+    @staticmethod
+    def detect_format(data: bytes) -> Optional[str]:
+        """Определение формата по сигнатуре: 'pdf', 'docx', 'txt' или None"""
+        if not data:
+            return None
+        
+        # Некоторые генераторы пишут мусор перед заголовком PDF
+        if PDF_MAGIC in data[:1024]:
+            return 'pdf'
+        
+        if data.startswith(ZIP_MAGIC):
+            # DOCX - zip-архив с word/document.xml (xlsx, odt и т.п. не подходят)
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    archive.getinfo('word/document.xml')
+                return 'docx'
+            except (KeyError, zipfile.BadZipFile):
+                return None
+        
+        # Текст не содержит нулевых байт (UTF-16 с BOM - исключение)
+        head = data[:TEXT_SNIFF_BYTES]
+        if head.startswith((b'\xff\xfe', b'\xfe\xff')) or b'\x00' not in head:
+            return 'txt'
+        
+        return None
+    
+    def _extract_from_pdf(self, data: bytes) -> Optional[str]:
+        """Извлечение текста из PDF"""
+        try:
+            result = pdf_extractor.extract(data)
+        except Exception as e:
+            # PyMuPDF не открыл файл (поврежденный PDF) - пробуем PyPDF2
+            logger.warning(f"PyMuPDF failed, trying PyPDF2: {e}")
+            return self._extract_from_pdf_fallback(data)
+        
+        if result['image_pages']:
+            logger.info(f"PDF has {len(result['image_pages'])} of {result['pages']} pages without text layer (scanned)")
+        
+        text = result['text']
+        return text if text.strip() else None
+    
+    def _extract_from_pdf_fallback(self, data: bytes) -> Optional[str]:
+        """Извлечение текста из PDF через PyPDF2"""
+        try:
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+            text = "".join(page.extract_text() or "" for page in pdf_reader.pages)
+            return text if text.strip() else None
                 
         except Exception as e:
             logger.error(f"Error extracting PDF text: {e}")
             return None
     
-    def _extract_from_docx(self, file_path: str) -> Optional[str]:
+    def _iter_pdf(self, data: bytes) -> Iterator[str]:
+        """Страницы PDF по одной"""
+        try:
+            pages = pdf_extractor.iter_pages(data)
+        except Exception as e:
+            # PyMuPDF не открыл файл (поврежденный PDF) - пробуем PyPDF2
+            logger.warning(f"PyMuPDF failed, trying PyPDF2: {e}")
+            pages = (page.extract_text() or "" for page in PyPDF2.PdfReader(io.BytesIO(data)).pages)
+        yield from pages
+    
+    def _iter_docx(self, data: bytes) -> Iterator[str]:
+        """Абзацы и строки таблиц DOCX в порядке документа (потоковый разбор)"""
+        produced = False
+        try:
+            for block in iter_docx_blocks(data):
+                produced = True
+                yield block
+            return
+        except Exception as e:
+            if produced:
+                raise
+            # Нестандартный документ - пробуем объектную модель python-docx
+            logger.warning(f"Streaming DOCX parser failed, trying python-docx: {e}")
+        yield from self._iter_docx_model(data)
+    
+    def _iter_docx_model(self, data: bytes) -> Iterator[str]:
+        """Абзацы DOCX, затем строки таблиц (python-docx)"""
+        doc = docx.Document(io.BytesIO(data))
+        
+        # Извлекаем текст из параграфов
+        for paragraph in doc.paragraphs:
+            yield paragraph.text + "\n"
+        
+        # Извлекаем текст из таблиц
+        for table in doc.tables:
+            for row in table.rows:
+                yield "".join(cell.text + " " for cell in row.cells) + "\n"
+    
+    def _iter_txt(self, data: bytes) -> Iterator[str]:
+        """Строки TXT; кодировка определяется по первому блоку"""
+        # Пробуем разные кодировки (utf-16 - только с BOM)
+        encodings = ['utf-8-sig', 'cp1251', 'cp866', 'latin-1']
+        if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+            encodings.insert(0, 'utf-16')
+        
+        head = data[:TEXT_BLOCK_BYTES]
+        for encoding in encodings:
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(head, final=len(data) <= TEXT_BLOCK_BYTES)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            logger.error(f"Could not decode text file with any encoding")
+            return
+        
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        tail = ""
+        for offset in range(0, len(data), TEXT_BLOCK_BYTES):
+            block = data[offset:offset + TEXT_BLOCK_BYTES]
+            lines = (tail + decoder.decode(block, final=offset + TEXT_BLOCK_BYTES >= len(data))).splitlines(True)
+            # Последняя строка блока может продолжаться в следующем
+            tail = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+            yield from lines
+        if tail:
+            yield tail
+    
+    def _extract_from_docx(self, data: bytes) -> Optional[str]:
         """Извлечение текста из DOCX"""
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            
-            # Извлекаем текст из параграфов
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            # Извлекаем текст из таблиц
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + " "
-                    text += "\n"
-            
+            text = "".join(self._iter_docx(data))
             return text.strip() if text.strip() else None
             
         except Exception as e:
             logger.error(f"Error extracting DOCX text: {e}")
             return None
     
-    def _extract_from_txt(self, file_path: str) -> Optional[str]:
+    def _extract_from_txt(self, data: bytes) -> Optional[str]:
         """Извлечение текста из TXT"""
         try:
-            # Пробуем разные кодировки
-            encodings = ['utf-8', 'cp1251', 'cp866', 'latin-1']
-            
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as file:
-                        text = file.read()
-                        return text.strip() if text.strip() else None
-                except UnicodeDecodeError:
-                    continue
-            
-            logger.error(f"Could not decode text file with any encoding")
-            return None
+            text = "".join(self._iter_txt(data))
+            return text.strip() if text.strip() else None
             
         except Exception as e:
             logger.error(f"Error extracting TXT text: {e}")
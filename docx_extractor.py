@@ -0,0 +1,112 @@
+"""
+Потоковое извлечение текста из DOCX
+
+word/document.xml читается из zip-архива потоком и разбирается инкрементально
+(lxml.iterparse) без объектной модели python-docx. Абзацы и строки таблиц
+выдаются в порядке документа, разобранные элементы сразу удаляются из дерева,
+поэтому память не растет с размером документа.
+
+Объединенные ячейки таблицы (gridSpan, продолжение vMerge) выдаются один раз.
+Строка таблицы - текст ячеек через пробел, абзацы ячейки - через перевод строки,
+как в cell.text python-docx. Вложенная таблица попадает в текст своей ячейки.
+"""
+
+import io
+import zipfile
+from typing import Iterator, List
+
+from lxml import etree
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+PARAGRAPH = W + "p"
+TABLE_ROW = W + "tr"
+TABLE_CELL = W + "tc"
+VERTICAL_MERGE = W + "vMerge"
+
+# Элементы текста абзаца и их текстовое представление (w:t - свой текст)
+TEXT = W + "t"
+RUN_SYMBOLS = {
+    W + "tab": "\t",
+    W + "cr": "\n",
+    W + "noBreakHyphen": "-",
+}
+BREAK = W + "br"
+BREAK_TYPE = W + "type"
+MERGE_VALUE = W + "val"
+
+DOCUMENT_PART = "word/document.xml"
+
+
+def paragraph_text(paragraph: etree._Element) -> str:
+    """Текст абзаца: w:t, табуляции и переносы строк (разрывы страниц не учитываются)"""
+    parts = []
+    for element in paragraph.iter(TEXT, BREAK, *RUN_SYMBOLS):
+        if element.tag == TEXT:
+            parts.append(element.text or "")
+        elif element.tag == BREAK:
+            if element.get(BREAK_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        else:
+            parts.append(RUN_SYMBOLS[element.tag])
+    return "".join(parts)
+
+
+def _release(element: etree._Element):
+    """Удаляет разобранный элемент и предыдущих соседей из дерева"""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_docx_blocks(data: bytes) -> Iterator[str]:
+    """
+    Абзацы и строки таблиц DOCX в порядке документа (каждый блок заканчивается "\\n")
+
+    Raises:
+        KeyError: в архиве нет word/document.xml
+        zipfile.BadZipFile, etree.XMLSyntaxError: поврежденный файл
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive, archive.open(DOCUMENT_PART) as stream:
+        rows: List[List[str]] = []          # Ячейки открытых строк таблиц
+        cells: List[List[str]] = []         # Абзацы открытых ячеек
+        continued: List[bool] = []          # Ячейка - продолжение вертикального объединения
+
+        events = etree.iterparse(stream, events=("start", "end"),
+                                 tag=(PARAGRAPH, TABLE_ROW, TABLE_CELL, VERTICAL_MERGE),
+                                 resolve_entities=False, huge_tree=True)
+        for event, element in events:
+            tag = element.tag
+            if event == "start":
+                if tag == TABLE_ROW:
+                    rows.append([])
+                elif tag == TABLE_CELL:
+                    cells.append([])
+                    continued.append(False)
+                continue
+
+            if tag == PARAGRAPH:
+                text = paragraph_text(element)
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    yield text + "\n"
+            elif tag == VERTICAL_MERGE:
+                # <w:vMerge/> без val - продолжение ячейки сверху, ее текст уже выдан
+                if continued and element.get(MERGE_VALUE, "continue") == "continue":
+                    continued[-1] = True
+                continue
+            elif tag == TABLE_CELL:
+                text = "\n".join(cells.pop())
+                if not continued.pop():
+                    rows[-1].append(text)
+            else:
+                row = "".join(cell + " " for cell in rows.pop())
+                if cells:
+                    # Вложенная таблица - часть текста ячейки внешней таблицы
+                    cells[-1].append(row)
+                else:
+                    yield row + "\n"
+
+            _release(element)
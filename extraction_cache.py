@@ -0,0 +1,223 @@
+"""
+Кэш извлеченного текста документов
+Повторная загрузка того же файла (file_unique_id Telegram) не скачивается и не разбирается,
+одинаковое содержимое от разных пользователей (SHA-256) не разбирается.
+Текст хранится сжатым zlib в SQLite на диске, объем ограничен (LRU по времени использования).
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """Дисковый LRU-кэш текста документов по file_unique_id и SHA-256 содержимого"""
+
+    def __init__(self, db_path: str = None, max_bytes: int = None):
+        self.db_path = db_path or Config.EXTRACTION_CACHE_DB
+        self.max_bytes = max_bytes or Config.EXTRACTION_CACHE_MAX_BYTES
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._total_bytes = 0
+
+        self.stats = {
+            'file_hits': 0,         # По file_unique_id - без скачивания и разбора
+            'content_hits': 0,      # По SHA-256 - без разбора
+            'misses': 0,
+            'stores': 0,
+            'evicted': 0,
+            'bytes_saved': 0,       # Байт документов, которые не пришлось разбирать
+            'seconds_saved': 0.0    # Время разбора этих документов при первой загрузке
+        }
+
+        self._init_database()
+
+    def _init_database(self):
+        """Создает таблицы дискового кэша"""
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extraction_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    content_hash TEXT,
+                    text BLOB,
+                    size INTEGER,
+                    source_bytes INTEGER,
+                    parse_seconds REAL,
+                    last_used REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache(last_used)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extraction_files (
+                    file_unique_id TEXT PRIMARY KEY,
+                    content_hash TEXT
+                )
+            """)
+            self._conn.commit()
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extraction_cache").fetchone()[0]
+            logger.info(f"✅ Кэш текста документов инициализирован: {self.db_path} "
+                        f"({self._total_bytes / 1024 / 1024:.1f} МБ)")
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации кэша текста документов, работаем без него: {e}")
+            self._conn = None
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        """SHA-256 содержимого файла"""
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, max_chars: Optional[int]) -> str:
+        """Ключ кэша: содержимое и объем извлеченного текста (бюджет символов)"""
+        return f"{content_hash}:{max_chars or 'full'}"
+
+    async def get_by_file(self, file_unique_id: str, max_chars: Optional[int]) -> Optional[str]:
+        """Текст ранее загруженного файла - до скачивания"""
+        text = await asyncio.to_thread(self._disk_get_by_file, file_unique_id, max_chars)
+        if text is not None:
+            self.stats['file_hits'] += 1
+        return text
+
+    async def get_by_content(self, content_hash: str, max_chars: Optional[int],
+                             file_unique_id: str = None) -> Optional[str]:
+        """Текст файла с тем же содержимым; file_unique_id запоминается для следующих загрузок"""
+        text = await asyncio.to_thread(self._disk_get_by_content, content_hash, max_chars, file_unique_id)
+        if text is not None:
+            self.stats['content_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+        return text
+
+    async def set(self, content_hash: str, max_chars: Optional[int], text: str, source_bytes: int,
+                  parse_seconds: float, file_unique_id: str = None):
+        """Сохраняет сжатый текст и вытесняет давно не использованные записи сверх лимита"""
+        self.stats['stores'] += 1
+        await asyncio.to_thread(self._disk_set, content_hash, max_chars, text, source_bytes,
+                                parse_seconds, file_unique_id)
+
+    def _read_entry(self, key: str) -> Optional[str]:
+        """Запись по ключу (под self._db_lock); обновляет время использования"""
+        row = self._conn.execute(
+            "SELECT text, source_bytes, parse_seconds FROM extraction_cache WHERE cache_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE extraction_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+        self._conn.commit()
+        self.stats['bytes_saved'] += row[1]
+        self.stats['seconds_saved'] += row[2]
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def _disk_get_by_file(self, file_unique_id: str, max_chars: Optional[int]) -> Optional[str]:
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT content_hash FROM extraction_files WHERE file_unique_id = ?", (file_unique_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                return self._read_entry(self.make_key(row[0], max_chars))
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша текста документов: {e}")
+            return None
+
+    def _disk_get_by_content(self, content_hash: str, max_chars: Optional[int],
+                             file_unique_id: Optional[str]) -> Optional[str]:
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                text = self._read_entry(self.make_key(content_hash, max_chars))
+                if text is not None and file_unique_id:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO extraction_files (file_unique_id, content_hash) VALUES (?, ?)",
+                        (file_unique_id, content_hash)
+                    )
+                    self._conn.commit()
+                return text
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша текста документов: {e}")
+            return None
+
+    def _disk_set(self, content_hash: str, max_chars: Optional[int], text: str, source_bytes: int,
+                  parse_seconds: float, file_unique_id: Optional[str]):
+        if self._conn is None:
+            return
+        try:
+            packed = zlib.compress(text.encode('utf-8'), 6)
+            key = self.make_key(content_hash, max_chars)
+            with self._db_lock:
+                previous = self._conn.execute(
+                    "SELECT size FROM extraction_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO extraction_cache
+                        (cache_key, content_hash, text, size, source_bytes, parse_seconds, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (key, content_hash, packed, len(packed), source_bytes, parse_seconds, time.time()))
+                if file_unique_id:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO extraction_files (file_unique_id, content_hash) VALUES (?, ?)",
+                        (file_unique_id, content_hash)
+                    )
+                self._total_bytes += len(packed) - (previous[0] if previous else 0)
+                self._evict()
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кэша текста документов: {e}")
+
+    def _evict(self):
+        """Удаляет давно не использованные записи, пока объем больше лимита (под self._db_lock)"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for key, content_hash, size in self._conn.execute(
+            "SELECT cache_key, content_hash, size FROM extraction_cache ORDER BY last_used"
+        ):
+            if self._total_bytes <= self.max_bytes:
+                break
+            evicted.append((key, content_hash))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", [(key,) for key, _ in evicted])
+        # Ссылки file_unique_id на содержимое, от которого не осталось ни одной записи
+        self._conn.executemany("""
+            DELETE FROM extraction_files WHERE content_hash = ?
+                AND NOT EXISTS (SELECT 1 FROM extraction_cache WHERE content_hash = ?)
+        """, [(content_hash, content_hash) for _, content_hash in evicted])
+        self.stats['evicted'] += len(evicted)
+
+    def get_stats(self) -> Dict:
+        """Счетчики попаданий/промахов и объем для админ-панели"""
+        hits = self.stats['file_hits'] + self.stats['content_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hits': hits,
+            'hit_rate': (hits / total * 100) if total else 0.0,
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.close()
+            self._conn = None
+
+
+# Глобальный экземпляр
+extraction_cache = ExtractionCache()
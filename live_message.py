@@ -0,0 +1,85 @@
+"""
+Живое обновление сообщения «Обрабатываю» по мере поступления ответа
+Правки через edit_text ограничены по частоте, чтобы не упираться в лимиты Telegram
+"""
+
+import asyncio
+import logging
+import re
+from typing import Optional
+
+from aiogram import types
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMessageUpdater:
+    """Потоковое обновление текста сообщения с троттлингом edit_text"""
+
+    MAX_LENGTH = 4000
+
+    def __init__(self, message: types.Message, header: str = "", min_interval: float = None):
+        self.message = message
+        self.header = header
+        self.min_interval = min_interval if min_interval is not None else Config.STREAM_EDIT_INTERVAL
+
+        self._pending: Optional[str] = None
+        self._last_rendered: Optional[str] = None
+        self._next_edit_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.edits = 0
+
+    async def update(self, text: str):
+        """Запоминает новый текст; правка сообщения выполняется в фоне"""
+        if self._closed:
+            return
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            delay = self._next_edit_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            rendered = self._render(self._pending or "")
+            if rendered == self._last_rendered:
+                return
+
+            try:
+                await self.message.edit_text(rendered)
+                self._last_rendered = rendered
+                self.edits += 1
+                self._next_edit_at = loop.time() + self.min_interval
+            except TelegramRetryAfter as e:
+                logger.warning(f"⚠️ Telegram просит подождать {e.retry_after} с перед правкой сообщения")
+                self._next_edit_at = loop.time() + e.retry_after
+            except Exception as e:
+                # Сообщение могло быть удалено или не изменилось - прекращаем обновления
+                logger.warning(f"⚠️ Не удалось обновить сообщение с прогрессом: {e}")
+                return
+
+    def _render(self, text: str) -> str:
+        """Готовит промежуточный текст: без разметки, в пределах лимита длины"""
+        # Незавершенная Markdown/HTML разметка ломает parse_mode, поэтому показываем простой текст
+        text = re.sub(r'\*\*|__', '', text)
+        budget = self.MAX_LENGTH - len(self.header) - 10
+        if len(text) > budget:
+            text = text[:budget] + "\n…"
+        return f"{self.header}{text}\n\n⏳"
+
+    async def close(self):
+        """Останавливает фоновые правки (перед отправкой финального ответа)"""
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -2,18 +2,34 @@ import asyncio
 import logging
 import os
 import io
+import hashlib
+import html
+import time
+from collections import OrderedDict
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 # OpenAI импорт убран - используется через AIService
 from ai_service import AIService
 from document_processor import DocumentProcessor
+from extraction_cache import extraction_cache
+from pdf_extractor import pdf_extractor
 from legal_knowledge import LegalKnowledge
 from tts_service import TTSService
-from admin_panel import AdminPanel
+from admin_panel import admin_panel
+from openai_gateway import close_openai_gateways
+from live_message import LiveMessageUpdater
+from rate_limiter import rate_limiter
+from provider_router import provider_router
+from retention import retention_manager
+from analytics import cohort_analytics
+from request_timing import RequestTimingMiddleware, TelegramSendTiming, STAGE_TITLES, set_request_type, stage
 
 # Настройка логирования
 logging.basicConfig(
@@ -29,15 +45,22 @@ from config import Config
 Config.validate()
 
 # Инициализация бота и диспетчера
-bot = Bot(token=Config.BOT_TOKEN)
+session = None
+if Config.TELEGRAM_API_URL:
+    # Собственный Bot API сервер (или локальная заглушка для нагрузочных тестов)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_URL))
+bot = Bot(token=Config.BOT_TOKEN, session=session)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+# Время обработки по этапам: таймер на каждое обновление, вызовы Bot API - этап «send»
+dp.update.outer_middleware(RequestTimingMiddleware(admin_panel.log_request_timing))
+bot.session.middleware(TelegramSendTiming())
+
 # Инициализация сервисов
 ai_service = AIService(Config.OPENAI_API_KEY)
 doc_processor = DocumentProcessor()
 tts_service = TTSService(Config.OPENAI_API_KEY)
-admin_panel = AdminPanel()
 
 # Состояния для FSM
 class BotStates(StatesGroup):
@@ -68,6 +91,19 @@ def get_share_keyboard():
     ])
     return keyboard
 
+def get_admin_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")],
+        [InlineKeyboardButton(text="📊 Аналитика", callback_data="admin_analytics")],
+        [InlineKeyboardButton(text="📈 Когорты и удержание", callback_data="admin_cohorts")],
+        [InlineKeyboardButton(text="📝 Запросы", callback_data="admin_requests")],
+        [InlineKeyboardButton(text="⏱ Время обработки", callback_data="admin_timings")],
+        [InlineKeyboardButton(text="💾 Экспорт данных", callback_data="admin_export")],
+        [InlineKeyboardButton(text="🧩 Сервисы и кэш", callback_data="admin_services")],
+        [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
+    ])
+    return keyboard
+
 # Функция для отправки рекламного сообщения БЕЗ голосового дублирования
 async def send_promo_message_with_voice(message: types.Message):
     """Отправляет рекламное сообщение о приложении 'Календарь Юриста' только текстом"""
@@ -116,8 +152,7 @@ async def send_response_with_voice(message: types.Message, text_response: str, r
             user_id=message.from_user.id,
             request_type="bot_response",
             request_text=text_response[:500] + "..." if len(text_response) > 500 else text_response,
-            response_text="Response sent with voice",
-            processing_time=0.0
+            response_text="Response sent with voice"
         )
         
         # Отправляем текстовый ответ
@@ -239,8 +274,9 @@ async def process_case_description(message: types.Message, state: FSMContext):
             
             # Получаем голосовой файл
             voice = message.voice
-            file_info = await bot.get_file(voice.file_id)
-            voice_file_io = await bot.download_file(file_info.file_path)
+            with stage("download"):
+                file_info = await bot.get_file(voice.file_id)
+                voice_file_io = await bot.download_file(file_info.file_path)
             voice_file_bytes = voice_file_io.read()
             
             # Определяем формат файла
@@ -271,12 +307,15 @@ async def process_case_description(message: types.Message, state: FSMContext):
                 user_id=message.from_user.id,
                 request_type="voice_legal_practice_search",
                 request_text=transcribed_text,
-                response_text="",
-                processing_time=0.0
+                response_text=""
             )
             
-            # Получаем анализ от ИИ на основе транскрибированного текста
-            analysis = await ai_service.find_legal_practice(transcribed_text)
+            # Получаем анализ от ИИ на основе транскрибированного текста (с показом ответа по мере генерации)
+            live_message = LiveMessageUpdater(processing_message, header="🔍 Ищу актуальную информацию...\n\n")
+            try:
+                analysis = await ai_service.find_legal_practice(transcribed_text, on_partial=live_message.update)
+            finally:
+                await live_message.close()
             
             # Добавляем информацию о том, что это было голосовое сообщение
             voice_header = f"""🎤 <b>Распознанный текст:</b> "{transcribed_text}"
@@ -295,12 +334,15 @@ async def process_case_description(message: types.Message, state: FSMContext):
                 user_id=message.from_user.id,
                 request_type="legal_practice_search", 
                 request_text=message.text,
-                response_text="",
-                processing_time=0.0
+                response_text=""
             )
             
-            # Получаем анализ от ИИ
-            analysis = await ai_service.find_legal_practice(message.text)
+            # Получаем анализ от ИИ (с показом ответа по мере генерации)
+            live_message = LiveMessageUpdater(processing_message, header="🔍 Ищу актуальную информацию...\n\n")
+            try:
+                analysis = await ai_service.find_legal_practice(message.text, on_partial=live_message.update)
+            finally:
+                await live_message.close()
         
         else:
             # Неподдерживаемый тип сообщения
@@ -370,6 +412,38 @@ async def process_case_description(message: types.Message, state: FSMContext):
         )
         logger.error(f"Error in case analysis: {e}")
 
+# Текст загруженного документа: кэш по file_unique_id и содержимому, иначе разбор файла
+async def read_uploaded_document(document: types.Document, file_extension: str):
+    max_chars = Config.DOCUMENT_MAX_CHARS
+    
+    # Тот же файл уже загружали - не скачиваем и не разбираем
+    with stage("extract"):
+        document_text = await extraction_cache.get_by_file(document.file_unique_id, max_chars)
+    if document_text is not None:
+        return document_text
+    
+    # Скачиваем файл в память
+    with stage("download"):
+        file = await bot.get_file(document.file_id)
+        file_data = io.BytesIO()
+        await bot.download_file(file.file_path, file_data)
+    data = file_data.getvalue()
+    
+    # Извлекаем начало документа, которое поместится в запрос
+    # (формат определяется по содержимому, расширение - подсказка)
+    with stage("extract"):
+        content_hash = await asyncio.to_thread(extraction_cache.content_hash, data)
+        document_text = await extraction_cache.get_by_content(content_hash, max_chars, document.file_unique_id)
+        if document_text is not None:
+            return document_text
+        
+        started = time.monotonic()
+        document_text = await asyncio.to_thread(doc_processor.read_text, data, max_chars, file_extension)
+        if document_text:
+            await extraction_cache.set(content_hash, max_chars, document_text, len(data),
+                                       time.monotonic() - started, document.file_unique_id)
+    return document_text
+
 # Обработчик подготовки жалобы
 @dp.callback_query(F.data == "prepare_complaint")
 async def process_prepare_complaint(callback_query: types.CallbackQuery, state: FSMContext):
@@ -409,21 +483,13 @@ async def process_document_for_complaint(message: types.Message, state: FSMConte
         )
         return
     
+    set_request_type("complaint_generation")
     processing_message = await message.answer(
         Config.TEXTS["processing"]
     )
     
     try:
-        # Скачиваем файл
-        file = await bot.get_file(message.document.file_id)
-        file_path = f"{Config.UPLOAD_DIR}/temp_{message.document.file_id}{file_extension}"
-        await bot.download_file(file.file_path, file_path)
-        
-        # Извлекаем текст
-        document_text = doc_processor.extract_text(file_path)
-        
-        # Удаляем временный файл
-        os.remove(file_path)
+        document_text = await read_uploaded_document(message.document, file_extension)
         
         if not document_text:
             try:
@@ -510,21 +576,13 @@ async def process_document_for_check(message: types.Message, state: FSMContext):
         )
         return
     
+    set_request_type("document_analysis")
     processing_message = await message.answer(
         Config.TEXTS["analyzing"]
     )
     
     try:
-        # Скачиваем файл
-        file = await bot.get_file(message.document.file_id)
-        file_path = f"{Config.UPLOAD_DIR}/temp_{message.document.file_id}{file_extension}"
-        await bot.download_file(file.file_path, file_path)
-        
-        # Извлекаем текст
-        document_text = doc_processor.extract_text(file_path)
-        
-        # Удаляем временный файл
-        os.remove(file_path)
+        document_text = await read_uploaded_document(message.document, file_extension)
         
         if not document_text:
             try:
@@ -593,6 +651,7 @@ async def process_voice_message(message: types.Message, state: FSMContext):
         logger.info(f"🎤 Голосовое сообщение пропущено - пользователь в состоянии {current_state}")
         return  # Пропускаем, пусть обрабатывает FSM обработчик
     
+    set_request_type("voice_message")
     # Показываем сообщение о начале обработки
     processing_message = await message.answer(
         "🎤 <b>Обрабатываю голосовое сообщение...</b>\n\n"
@@ -627,8 +686,9 @@ async def process_voice_message(message: types.Message, state: FSMContext):
         )
         
         # Получаем файл с серверов Telegram
-        file_info = await bot.get_file(voice.file_id)
-        voice_file_io = await bot.download_file(file_info.file_path)
+        with stage("download"):
+            file_info = await bot.get_file(voice.file_id)
+            voice_file_io = await bot.download_file(file_info.file_path)
         
         # Извлекаем байты из BytesIO объекта
         voice_file_bytes = voice_file_io.read()
@@ -737,14 +797,6 @@ async def cmd_admin(message: types.Message):
     # Получаем статистику
     stats = await get_admin_statistics()
     
-    admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")],
-        [InlineKeyboardButton(text="📊 Аналитика", callback_data="admin_analytics")],
-        [InlineKeyboardButton(text="📝 Запросы", callback_data="admin_requests")],
-        [InlineKeyboardButton(text="💾 Экспорт данных", callback_data="admin_export")],
-        [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
-    ])
-    
     await message.answer(
         f"""🛠️ <b>АДМИН-ПАНЕЛЬ "Виртуальный юрист"</b>
 
@@ -753,90 +805,109 @@ async def cmd_admin(message: types.Message):
 🔥 Активных за день: {stats['active_today']}
 📝 Запросов сегодня: {stats['requests_today']}
 ⭐ Топ пользователь: {stats['top_user']}
+🕐 Данные на: {admin_panel.data_as_of()}
 
 🎯 <b>ДЕЙСТВИЯ:</b>
 Выберите нужную функцию ниже""",
-        reply_markup=admin_keyboard,
+        reply_markup=get_admin_keyboard(),
         parse_mode='HTML'
     )
 
-# Функция получения статистики для админов
-async def get_admin_statistics():
-    """Получает статистику для админ-панели"""
+# Поисковые запросы администраторов для кнопок страниц: ключ в callback_data -> текст
+# (текст запроса не помещается в 64 байта callback_data)
+search_queries: "OrderedDict[str, str]" = OrderedDict()
+SEARCH_QUERIES_LIMIT = 256
+
+def remember_search(query: str) -> str:
+    key = hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]
+    search_queries[key] = query
+    search_queries.move_to_end(key)
+    while len(search_queries) > SEARCH_QUERIES_LIMIT:
+        search_queries.popitem(last=False)
+    return key
+
+# Обработчик команды поиска по запросам
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject):
+    """Полнотекстовый поиск по истории запросов: /search текст"""
+    if not admin_panel.is_admin(message.from_user.id):
+        await message.answer(
+            "❌ У вас нет прав доступа к админ-панели.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔎 <b>ПОИСК ПО ЗАПРОСАМ</b>\n\n"
+            "Использование: <code>/search текст</code>\n"
+            "Например: <code>/search задержка зарплаты</code>",
+            parse_mode='HTML'
+        )
+        return
+    
+    text, keyboard = await render_search_results(query, 1)
+    await message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
+async def render_search_results(query: str, page: int):
+    """Текст и кнопки страницы результатов поиска"""
+    found = await asyncio.to_thread(admin_panel.search_requests, query, page)
+    
+    text = (f"🔎 <b>ПОИСК:</b> {html.escape(query)}\n"
+            f"🕐 Данные на: {admin_panel.data_as_of()}\n")
+    if not found['results']:
+        text += "\n📭 Ничего не найдено" if page == 1 else "\n📭 Больше результатов нет"
+    else:
+        scope = (f"лучшие среди последних {found['matches']}" if found['window_full']
+                 else f"совпадений: {found['matches']}")
+        text += f"📄 Страница {page} ({scope})\n\n"
+        for result in found['results']:
+            text += f"🕐 {result['timestamp'][:16]} 👤 <b>{html.escape(result['name'])}</b>\n"
+            text += f"📋 {html.escape(result['request_type'] or 'Неизвестный')}\n"
+            text += f"💬 {result['snippet']}\n\n"
+    
+    key = remember_search(query)
+    nav_row = []
+    if page > 1:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"srch|{key}|{page - 1}"))
+    if found['has_next']:
+        nav_row.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"srch|{key}|{page + 1}"))
+    keyboard_rows = [nav_row] if nav_row else []
+    keyboard_rows.append([InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+
+@dp.callback_query(F.data.startswith("srch|"))
+async def process_search_page(callback_query: types.CallbackQuery):
+    """Переход по страницам результатов поиска"""
+    if not admin_panel.is_admin(callback_query.from_user.id):
+        await callback_query.answer("❌ Доступ запрещен", show_alert=True)
+        return
+    
     try:
-        import sqlite3
-        from datetime import datetime, timedelta
-        
-        logger.info("🗄️ Подключение к базе данных...")
-        conn = sqlite3.connect(admin_panel.db_path, timeout=5.0)  # Добавляем таймаут
-        cursor = conn.cursor()
-        
-        # Общее количество пользователей
-        logger.info("👥 Получение количества пользователей...")
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-        logger.info(f"✅ Пользователей: {total_users}")
-        
-        # Активные за день
-        logger.info("🔥 Получение активных пользователей...")
-        yesterday = datetime.now() - timedelta(days=1)
-        cursor.execute("SELECT COUNT(*) FROM users WHERE last_activity > ?", (yesterday.isoformat(),))
-        active_today = cursor.fetchone()[0] or 0
-        logger.info(f"✅ Активных: {active_today}")
-        
-        # Запросы сегодня
-        logger.info("📝 Получение запросов за сегодня...")
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) FROM user_requests WHERE DATE(timestamp) = ?", (today,))
-        requests_today = cursor.fetchone()[0] or 0
-        logger.info(f"✅ Запросов: {requests_today}")
-        
-        # Топ пользователь
-        logger.info("⭐ Получение топ пользователя...")
-        cursor.execute("""
-            SELECT first_name, username, total_requests 
-            FROM users 
-            WHERE total_requests IS NOT NULL AND total_requests > 0
-            ORDER BY total_requests DESC 
-            LIMIT 1
-        """)
-        top_user_data = cursor.fetchone()
-        if top_user_data:
-            first_name = top_user_data[0] or ""
-            username = top_user_data[1] or ""
-            total_requests = top_user_data[2] or 0
-            name = first_name or username or "Неизвестный"
-            top_user = f"{name} ({total_requests} запросов)"
-        else:
-            top_user = "Нет данных"
-        logger.info(f"✅ Топ пользователь: {top_user}")
-        
-        conn.close()
-        logger.info("✅ Статистика успешно получена")
-        
-        return {
-            'total_users': total_users,
-            'active_today': active_today, 
-            'requests_today': requests_today,
-            'top_user': top_user
-        }
-        
-    except sqlite3.OperationalError as e:
-        logger.error(f"❌ Ошибка базы данных: {e}")
-        return {
-            'total_users': 0,
-            'active_today': 0,
-            'requests_today': 0,
-            'top_user': "БД недоступна"
-        }
+        _, key, page = callback_query.data.split("|", 2)
+        page = max(1, int(page))
+    except ValueError:
+        await callback_query.answer("❌ Неизвестное действие", show_alert=True)
+        return
+    
+    query = search_queries.get(key)
+    if query is None:
+        # Бот перезапускался или запрос вытеснен более новыми
+        await callback_query.answer("⌛ Поиск устарел, повторите /search", show_alert=True)
+        return
+    
+    await callback_query.answer()
+    try:
+        text, keyboard = await render_search_results(query, page)
+        await callback_query.message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
     except Exception as e:
-        logger.error(f"❌ Общая ошибка получения статистики: {e}")
-        return {
-            'total_users': 0,
-            'active_today': 0,
-            'requests_today': 0,
-            'top_user': "Ошибка загрузки"
-        }
+        logger.error(f"❌ Ошибка поиска по запросам: {e}")
+
+# Функция получения статистики для админов
+async def get_admin_statistics():
+    """Получает статистику для админ-панели (запросы к БД - в отдельном потоке)"""
+    return await asyncio.to_thread(admin_panel.get_dashboard_stats)
 
 # Обработчики админ кнопок
 @dp.callback_query(F.data.startswith("admin_"))
@@ -854,8 +925,16 @@ async def process_admin_actions(callback_query: types.CallbackQuery):
         await show_analytics(callback_query)
     elif action == "requests":
         await show_requests_list(callback_query)
+    elif action == "timings":
+        await show_timings(callback_query)
+    elif action == "cohorts":
+        await show_cohorts(callback_query)
+    elif action == "cohortcsv":
+        await export_cohorts_csv(callback_query)
     elif action == "export":
         await show_export_options(callback_query)
+    elif action == "services":
+        await show_services_status(callback_query)
     elif action == "back":
         # Перенаправляем на admin_back
         await admin_back(callback_query)
@@ -863,47 +942,75 @@ async def process_admin_actions(callback_query: types.CallbackQuery):
         logger.warning(f"⚠️ Неизвестное действие админ-панели: {action}")
         await callback_query.answer("❌ Неизвестное действие", show_alert=True)
 
-async def show_users_list(callback_query: types.CallbackQuery):
-    """Показывает список пользователей"""
+def users_page_callback(order: str, backward: bool, page: int, user: dict = None) -> str:
+    """callback_data кнопки списка пользователей: upage|порядок|направление|страница|user_id|значение
+    
+    Курсор (значение колонки сортировки и user_id) передается в самой кнопке,
+    поэтому страницы не хранятся на сервере. Telegram ограничивает callback_data 64 байтами.
+    """
+    if user is None:
+        return f"upage|{order}|n|{page}||"
+    value = user['last_activity'] if order == 'a' else user['total_requests']
+    data = f"upage|{order}|{'p' if backward else 'n'}|{page}|{user['user_id']}|{value}"
+    if len(data.encode('utf-8')) > 64:
+        # Нестандартно длинное значение - начинаем сначала
+        return f"upage|{order}|n|1||"
+    return data
+
+async def show_users_list(callback_query: types.CallbackQuery, order: str = 'r', cursor: tuple = None,
+                          backward: bool = False, page: int = 1):
+    """Показывает страницу списка пользователей"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(admin_panel.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT user_id, first_name, username, total_requests, last_activity
-            FROM users 
-            ORDER BY total_requests DESC 
-            LIMIT 20
-        """)
-        users = cursor.fetchall()
-        conn.close()
+        limit = Config.ADMIN_USERS_PAGE_SIZE
+        users_page = await asyncio.to_thread(admin_panel.get_users_list, order, cursor, backward, limit)
+        users = users_page['users']
+        
+        back_button = [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
         
         if not users:
             await callback_query.message.edit_text(
                 "👥 <b>ПОЛЬЗОВАТЕЛИ</b>\n\nПользователи не найдены.",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[back_button]),
                 parse_mode='HTML'
             )
             return
         
-        users_text = "👥 <b>ТОП-20 АКТИВНЫХ ПОЛЬЗОВАТЕЛЕЙ:</b>\n\n"
-        
-        for i, (user_id, first_name, username, requests, last_activity) in enumerate(users, 1):
-            name = first_name or username or f"ID{user_id}"
-            requests_count = requests or 0
-            activity_text = last_activity[:16] if last_activity else "Неизвестно"
+        order_title = "по последней активности" if order == 'a' else "по количеству запросов"
+        pages_total = max(1, -(-users_page['total'] // limit))
+        users_text = (f"👥 <b>ПОЛЬЗОВАТЕЛИ</b> ({order_title})\n"
+                      f"Страница {page} из {pages_total} · всего {users_page['total']}\n"
+                      f"🕐 Данные на: {admin_panel.data_as_of()}\n\n")
+        
+        for i, user in enumerate(users, (page - 1) * limit + 1):
+            name = user['first_name'] or user['username'] or f"ID{user['user_id']}"
+            requests_count = user['total_requests'] or 0
+            last_activity = user['last_activity']
+            activity_text = str(last_activity)[:16] if last_activity else "Неизвестно"
             users_text += f"{i}. <b>{name}</b>\n"
             users_text += f"   📝 Запросов: {requests_count}\n"
             users_text += f"   🕐 Последняя активность: {activity_text}\n\n"
         
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
-        ])
+        navigation = []
+        if users_page['has_prev']:
+            navigation.append(InlineKeyboardButton(
+                text="⬅️ Назад", callback_data=users_page_callback(order, True, page - 1, users[0])
+            ))
+        if users_page['has_next']:
+            navigation.append(InlineKeyboardButton(
+                text="Вперед ➡️", callback_data=users_page_callback(order, False, page + 1, users[-1])
+            ))
+        
+        other_order = 'a' if order == 'r' else 'r'
+        other_title = "🕐 По активности" if other_order == 'a' else "📝 По запросам"
+        keyboard_rows = [navigation] if navigation else []
+        keyboard_rows.append([InlineKeyboardButton(text=other_title,
+                                                   callback_data=users_page_callback(other_order, False, 1))])
+        keyboard_rows.append(back_button)
         
         # Используем edit_text для корректной работы кнопок
         await callback_query.message.edit_text(
             users_text,
-            reply_markup=back_keyboard,
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_rows),
             parse_mode='HTML'
         )
         
@@ -911,33 +1018,35 @@ async def show_users_list(callback_query: types.CallbackQuery):
         logger.error(f"❌ Ошибка показа пользователей: {e}")
         await callback_query.answer("❌ Ошибка загрузки данных", show_alert=True)
 
+@dp.callback_query(F.data.startswith("upage|"))
+async def process_users_page(callback_query: types.CallbackQuery):
+    """Переход по страницам списка пользователей"""
+    if not admin_panel.is_admin(callback_query.from_user.id):
+        await callback_query.answer("❌ Доступ запрещен", show_alert=True)
+        return
+    
+    try:
+        _, order, direction, page, user_id, value = callback_query.data.split("|", 5)
+        if order not in admin_panel.USER_ORDERS:
+            raise ValueError(f"неизвестный порядок {order}")
+        cursor = None
+        if user_id:
+            cursor = (int(value) if order == 'r' else value, int(user_id))
+    except ValueError as e:
+        logger.warning(f"⚠️ Некорректная кнопка списка пользователей: {e}")
+        await callback_query.answer("❌ Неизвестное действие", show_alert=True)
+        return
+    
+    await callback_query.answer()
+    await show_users_list(callback_query, order, cursor, direction == 'p', max(1, int(page)))
+
 async def show_analytics(callback_query: types.CallbackQuery):
     """Показывает аналитику"""
     try:
-        import sqlite3
-        from datetime import datetime, timedelta
-        
-        conn = sqlite3.connect(admin_panel.db_path)
-        cursor = conn.cursor()
-        
-        # Статистика за последние 7 дней
-        week_ago = datetime.now() - timedelta(days=7)
-        cursor.execute("SELECT COUNT(*) FROM user_requests WHERE timestamp > ?", (week_ago,))
-        requests_week = cursor.fetchone()[0]
-        
-        # Популярные типы запросов
-        cursor.execute("""
-            SELECT request_type, COUNT(*) as count 
-            FROM user_requests 
-            GROUP BY request_type 
-            ORDER BY count DESC 
-            LIMIT 5
-        """)
-        popular_types = cursor.fetchall()
-        
-        conn.close()
+        requests_week, popular_types = await asyncio.to_thread(admin_panel.get_weekly_summary)
         
         analytics_text = f"""📊 <b>АНАЛИТИКА СИСТЕМЫ</b>
+🕐 Данные на: {admin_panel.data_as_of()}
 
 📈 <b>АКТИВНОСТЬ:</b>
 • Запросов за неделю: {requests_week}
@@ -964,22 +1073,89 @@ async def show_analytics(callback_query: types.CallbackQuery):
         logger.error(f"❌ Ошибка показа аналитики: {e}")
         await callback_query.answer("❌ Ошибка загрузки аналитики", show_alert=True)
 
+async def show_cohorts(callback_query: types.CallbackQuery):
+    """Показывает когорты, DAU/WAU/MAU и воронки по типам запросов"""
+    try:
+        await callback_query.answer("⏳ Считаю когорты...")
+        report = await asyncio.to_thread(cohort_analytics.report)
+        cohorts_text = cohort_analytics.format_message(report) + f"\n🕐 Данные на: {admin_panel.data_as_of()}"
+        
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="💾 Скачать CSV", callback_data="admin_cohortcsv")],
+            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
+        ])
+        
+        await callback_query.message.edit_text(
+            cohorts_text,
+            reply_markup=keyboard,
+            parse_mode='HTML'
+        )
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка показа когорт: {e}")
+        await callback_query.answer("❌ Ошибка расчета когорт", show_alert=True)
+
+async def export_cohorts_csv(callback_query: types.CallbackQuery):
+    """Отправляет показатели когортной аналитики файлами CSV"""
+    try:
+        await callback_query.answer("⏳ Готовлю CSV...")
+        report = await asyncio.to_thread(cohort_analytics.report)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M')
+        for filename, content in cohort_analytics.csv_files(report):
+            name, extension = os.path.splitext(filename)
+            await callback_query.message.answer_document(
+                BufferedInputFile(content, filename=f"{name}_{stamp}{extension}"),
+                caption=f"📈 {name} (данные на {admin_panel.data_as_of()})"
+            )
+    except Exception as e:
+        logger.error(f"❌ Ошибка экспорта когорт: {e}")
+        await callback_query.message.answer("❌ Ошибка экспорта когортной аналитики")
+
+async def show_timings(callback_query: types.CallbackQuery):
+    """Показывает перцентили времени обработки по этапам и типам запросов"""
+    try:
+        timings = await asyncio.to_thread(admin_panel.get_timing_percentiles)
+        
+        timings_text = f"""⏱ <b>ВРЕМЯ ОБРАБОТКИ ЗАПРОСОВ</b>
+🕐 Данные на: {admin_panel.data_as_of()}
+📅 За {Config.TIMING_WINDOW_DAYS} дн., p50 / p90 / p99, секунды
+"""
+        if not timings:
+            timings_text += "\n📭 Замеров пока нет"
+        
+        # Сначала все запросы вместе, затем типы по убыванию количества
+        order = sorted(timings, key=lambda name: (name != "all", -timings[name]['count']))
+        for name in order:
+            group = timings[name]
+            title = "Все запросы" if name == "all" else name
+            timings_text += f"\n📌 <b>{title}</b> ({group['count']}):\n"
+            for stage_name, (p50, p90, p99, measured) in group['stages'].items():
+                timings_text += (f"• {STAGE_TITLES[stage_name]}: "
+                                 f"{p50 / 1000:.1f} / {p90 / 1000:.1f} / {p99 / 1000:.1f}"
+                                 f"{f' ({measured})' if measured != group['count'] else ''}\n")
+        
+        if len(timings_text) > 4000:
+            # Обрезаем по границе строки: разрезанный тег <b> Telegram не примет (parse_mode='HTML')
+            timings_text = timings_text[:timings_text.rfind("\n", 0, 4000)] + "\n..."
+        
+        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
+        ])
+        
+        await callback_query.message.edit_text(
+            timings_text,
+            reply_markup=back_keyboard,
+            parse_mode='HTML'
+        )
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка показа времени обработки: {e}")
+        await callback_query.answer("❌ Ошибка загрузки времени обработки", show_alert=True)
+
 async def show_requests_list(callback_query: types.CallbackQuery):
     """Показывает последние запросы"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(admin_panel.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT ur.timestamp, u.first_name, u.username, ur.request_type, ur.request_text
-            FROM user_requests ur
-            JOIN users u ON ur.user_id = u.user_id
-            ORDER BY ur.timestamp DESC
-            LIMIT 10
-        """)
-        requests = cursor.fetchall()
-        conn.close()
+        requests = await asyncio.to_thread(admin_panel.get_recent_requests, 10)
         
         if not requests:
             await callback_query.message.edit_text(
@@ -988,7 +1164,7 @@ async def show_requests_list(callback_query: types.CallbackQuery):
             )
             return
         
-        requests_text = "📝 <b>ПОСЛЕДНИЕ 10 ЗАПРОСОВ:</b>\n\n"
+        requests_text = f"📝 <b>ПОСЛЕДНИЕ 10 ЗАПРОСОВ:</b>\n🕐 Данные на: {admin_panel.data_as_of()}\n\n"
         
         for timestamp, first_name, username, req_type, req_text in requests:
             name = first_name or username or "Неизвестный"
@@ -1004,6 +1180,8 @@ async def show_requests_list(callback_query: types.CallbackQuery):
             requests_text += f"📋 Тип: {req_type or 'Неизвестный'}\n"
             requests_text += f"💬 {short_text}\n\n"
         
+        requests_text += "🔎 Поиск по истории: <code>/search текст</code>"
+        
         back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
         ])
@@ -1019,6 +1197,114 @@ async def show_requests_list(callback_query: types.CallbackQuery):
         logger.error(f"❌ Ошибка показа запросов: {e}")
         await callback_query.answer("❌ Ошибка загрузки запросов", show_alert=True)
 
+async def show_services_status(callback_query: types.CallbackQuery):
+    """Показывает состояние кэшей и внешних сервисов"""
+    try:
+        cache_stats = ai_service.perplexity.cache.get_stats()
+        flight_stats = ai_service.search_flight.get_stats()
+        limiter_stats = rate_limiter.get_stats()
+        
+        services_text = f"""🧩 <b>СЕРВИСЫ И КЭШ</b>
+
+⚡ <b>КЭШ ОТВЕТОВ PERPLEXITY:</b>
+• Попаданий: {cache_stats['hits']} (память: {cache_stats['memory_hits']}, диск: {cache_stats['disk_hits']})
+• Промахов: {cache_stats['misses']}
+• Доля попаданий: {cache_stats['hit_rate']:.1f}%
+• Записей в памяти: {cache_stats['memory_entries']}
+• Сохранено ответов: {cache_stats['stores']}
+
+🔗 <b>ОБЪЕДИНЕНИЕ ОДИНАКОВЫХ ЗАПРОСОВ:</b>
+• Запросов к Perplexity: {flight_stats['leaders']}
+• Сэкономлено запросов: {flight_stats['shared']}
+• Выполняется сейчас: {flight_stats['in_flight']}
+
+⏳ <b>ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ:</b>
+"""
+        for provider, stats in limiter_stats.items():
+            services_text += (
+                f"• <b>{provider}</b>: {stats['rate']:.2f}/{stats['base_rate']:.2f} запр/с, "
+                f"очередь {stats['queue_depth']} (макс. {stats['max_queue_depth']}), "
+                f"ждали {stats['throttled']} раз / {stats['throttled_seconds']:.1f} с, "
+                f"429/5xx: {stats['upstream_throttled']}, отклонено: {stats['rejected']}\n"
+            )
+        
+        write_stats = admin_panel.get_write_stats()
+        services_text += (
+            f"\n🗄 <b>ЗАПИСЬ АНАЛИТИКИ В БАЗУ:</b>\n"
+            f"• Записано: {write_stats['written']} ({write_stats['batches']} транзакций, "
+            f"макс. пачка {write_stats['max_batch']})\n"
+            f"• В очереди: {write_stats['queue_depth']}\n"
+            f"• Активность пользователей: {write_stats['activity_calls']} обращений -> "
+            f"{write_stats['flushed_users']} строк за {write_stats['flushes']} записей, "
+            f"ждут записи: {write_stats['pending_users']}\n"
+            f"• Ошибок: {write_stats['failed']}, пропущено: {write_stats['dropped']}\n"
+        )
+        
+        snapshot_stats = admin_panel.get_snapshot_stats()
+        services_text += (
+            f"• Снимок для админ-панели: данные на {snapshot_stats['data_as_of']}, "
+            f"{snapshot_stats['bytes'] / 1024 / 1024:.1f} МБ за {snapshot_stats['last_duration']:.1f} с "
+            f"(обновлений {snapshot_stats['refreshes']}, ошибок {snapshot_stats['failed']})\n"
+        )
+        
+        extraction_stats = extraction_cache.get_stats()
+        pdf_stats = pdf_extractor.get_stats()
+        services_text += (
+            f"\n📄 <b>ИЗВЛЕЧЕНИЕ ТЕКСТА ДОКУМЕНТОВ:</b>\n"
+            f"• Кэш: попаданий {extraction_stats['hits']} (тот же файл: {extraction_stats['file_hits']}, "
+            f"то же содержимое: {extraction_stats['content_hits']}), промахов {extraction_stats['misses']}, "
+            f"доля попаданий {extraction_stats['hit_rate']:.1f}%\n"
+            f"• Не разбирали: {extraction_stats['bytes_saved'] / 1024 / 1024:.1f} МБ документов, "
+            f"сэкономлено {extraction_stats['seconds_saved']:.1f} с\n"
+            f"• Объем кэша: {extraction_stats['bytes'] / 1024 / 1024:.1f} из "
+            f"{extraction_stats['max_bytes'] / 1024 / 1024:.0f} МБ, вытеснено: {extraction_stats['evicted']}\n"
+            f"• PDF: документов {pdf_stats['documents']}, страниц: {pdf_stats['pages']} "
+            f"(сканов без текста: {pdf_stats['image_pages']}) за {pdf_stats['seconds']:.1f} с\n"
+            f"• В пуле процессов ({pdf_stats['workers']}): {pdf_stats['parallel']}, "
+            f"сбоев пула: {pdf_stats['pool_failures']}\n"
+        )
+        
+        retention_stats = retention_manager.get_stats()
+        last_run = retention_stats['last_run'].strftime('%d.%m %H:%M') if retention_stats['last_run'] else "еще не было"
+        services_text += (
+            f"\n🧹 <b>ХРАНЕНИЕ ИСТОРИИ:</b>\n"
+            f"• Основная база: {retention_stats['db_bytes'] / 1024 / 1024:.1f} МБ, "
+            f"архивов: {retention_stats['archives']} ({retention_stats['archive_bytes'] / 1024 / 1024:.1f} МБ)\n"
+            f"• Сжато запросов: {retention_stats['compressed_rows']} "
+            f"(-{retention_stats['saved_bytes'] / 1024 / 1024:.1f} МБ), "
+            f"в архив: {retention_stats['archived_rows']}, "
+            f"удалено замеров времени: {retention_stats['pruned_timings']}\n"
+            f"• Последнее обслуживание: {last_run}, VACUUM: {retention_stats['vacuums']}\n"
+        )
+        
+        router_stats = provider_router.get_stats()
+        if router_stats:
+            services_text += "\n🔀 <b>МАРШРУТИЗАЦИЯ ПРОВАЙДЕРОВ:</b>\n"
+        for provider, stats in router_stats.items():
+            p50 = f"{stats['p50']:.1f} с" if stats['p50'] is not None else "—"
+            p95 = f"{stats['p95']:.1f} с" if stats['p95'] is not None else "—"
+            services_text += (
+                f"• <b>{provider}</b>: {stats['state']}, p50 {p50}, p95 {p95}, "
+                f"ошибок {stats['error_rate'] * 100:.0f}%, "
+                f"дублей {stats['hedged']} (выиграли {stats['hedge_wins']}), "
+                f"без запроса {stats['short_circuited']}, отклонено лимитом {stats['rejected_locally']}, "
+                f"таймаутов {stats['timeouts']}, через GPT {stats['failovers']}\n"
+            )
+        
+        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
+        ])
+        
+        await callback_query.message.edit_text(
+            services_text,
+            reply_markup=back_keyboard,
+            parse_mode='HTML'
+        )
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка показа состояния сервисов: {e}")
+        await callback_query.answer("❌ Ошибка загрузки данных", show_alert=True)
+
 async def show_export_options(callback_query: types.CallbackQuery):
     """Показывает опции экспорта"""
     export_keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -1055,74 +1341,60 @@ async def process_export(callback_query: types.CallbackQuery):
         logger.error(f"❌ Ошибка экспорта: {e}")
         await callback_query.answer("❌ Ошибка экспорта данных", show_alert=True)
 
-async def export_users_data(callback_query: types.CallbackQuery):
-    """Экспорт данных пользователей в CSV"""
-    try:
-        import sqlite3
-        import csv
-        from datetime import datetime
-        
-        conn = sqlite3.connect(admin_panel.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT user_id, username, first_name, last_name, 
-                   registration_date, last_activity, total_requests
-            FROM users 
-            ORDER BY total_requests DESC
-        """)
-        users = cursor.fetchall()
-        conn.close()
-        
-        if not users:
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
-            ])
-            await callback_query.message.edit_text(
-                "❌ Нет данных для экспорта",
-                reply_markup=back_keyboard,
-                parse_mode='HTML'
-            )
-            return
-        
-        # Создаем CSV файл
-        filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['ID пользователя', 'Username', 'Имя', 'Фамилия', 
-                           'Дата регистрации', 'Последняя активность', 'Всего запросов'])
-            
-            for user in users:
-                writer.writerow(user)
-        
-        # Отправляем файл
-        await callback_query.message.answer_document(
-            FSInputFile(filename),
-            caption=f"📊 <b>Экспорт пользователей</b>\n\n"
-                   f"📈 Всего записей: {len(users)}\n"
-                   f"📅 Создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-            parse_mode='HTML'
-        )
-        
-        # Удаляем временный файл
-        try:
-            os.remove(filename)
-        except Exception:
-            pass
-            
-        # Возвращаемся к админ-панели через кнопку назад
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
-        ])
-        
-        # Редактируем сообщение с результатом экспорта
+async def send_export_parts(callback_query: types.CallbackQuery, parts, title: str, basename: str):
+    """Отправляет потоковый экспорт частями .csv.gz, не собирая его целиком в памяти
+    
+    Части формируются в отдельном потоке; следующая готовится заранее, чтобы
+    понять, нужна ли нумерация в имени файла.
+    """
+    back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
+    ])
+    
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    current = await asyncio.to_thread(next, parts, None)
+    if current is None or current[1] == 0:
         await callback_query.message.edit_text(
-            "✅ Экспорт пользователей выполнен успешно!",
+            "❌ Нет данных для экспорта",
             reply_markup=back_keyboard,
             parse_mode='HTML'
         )
+        return
+    
+    number = 0
+    total_rows = 0
+    while current is not None:
+        upcoming = await asyncio.to_thread(next, parts, None)
+        data, rows = current
+        number += 1
+        total_rows += rows
+        
+        multipart = number > 1 or upcoming is not None
+        filename = f"{basename}_{stamp}_part{number}.csv.gz" if multipart else f"{basename}_{stamp}.csv.gz"
+        part_text = f" (часть {number})" if multipart else ""
         
+        await callback_query.message.answer_document(
+            BufferedInputFile(data, filename=filename),
+            caption=f"📊 <b>{title}{part_text}</b>\n\n"
+                   f"📈 Записей: {rows}\n"
+                   f"📅 Создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+                   f"🕐 Данные на: {admin_panel.data_as_of()}",
+            parse_mode='HTML'
+        )
+        current = upcoming
+    
+    files_text = f", файлов: {number}" if number > 1 else ""
+    await callback_query.message.edit_text(
+        f"✅ {title} выполнен успешно!\n📈 Всего записей: {total_rows}{files_text}",
+        reply_markup=back_keyboard,
+        parse_mode='HTML'
+    )
+
+async def export_users_data(callback_query: types.CallbackQuery):
+    """Экспорт данных пользователей в CSV"""
+    try:
+        await send_export_parts(callback_query, admin_panel.export_users_csv(),
+                                "Экспорт пользователей", "users_export")
     except Exception as e:
         logger.error(f"❌ Ошибка экспорта пользователей: {e}")
         await callback_query.answer("❌ Ошибка создания экспорта", show_alert=True)
@@ -1130,73 +1402,8 @@ async def export_users_data(callback_query: types.CallbackQuery):
 async def export_requests_data(callback_query: types.CallbackQuery):
     """Экспорт данных запросов в CSV"""
     try:
-        import sqlite3
-        import csv
-        from datetime import datetime
-        
-        conn = sqlite3.connect(admin_panel.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT ur.timestamp, u.first_name, u.username, ur.request_type, 
-                   ur.request_text, ur.processing_time, ur.status
-            FROM user_requests ur
-            JOIN users u ON ur.user_id = u.user_id
-            ORDER BY ur.timestamp DESC
-            LIMIT 1000
-        """)
-        requests = cursor.fetchall()
-        conn.close()
-        
-        if not requests:
-            back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
-            ])
-            await callback_query.message.edit_text(
-                "❌ Нет данных для экспорта",
-                reply_markup=back_keyboard,
-                parse_mode='HTML'  
-            )
-            return
-        
-        # Создаем CSV файл
-        filename = f"requests_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Дата и время', 'Имя пользователя', 'Username', 
-                           'Тип запроса', 'Текст запроса', 'Время обработки', 'Статус'])
-            
-            for request in requests:
-                writer.writerow(request)
-        
-        # Отправляем файл
-        await callback_query.message.answer_document(
-            FSInputFile(filename),
-            caption=f"📊 <b>Экспорт запросов</b>\n\n"
-                   f"📈 Всего записей: {len(requests)}\n"
-                   f"📅 Создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-            parse_mode='HTML'
-        )
-        
-        # Удаляем временный файл
-        try:
-            os.remove(filename)
-        except Exception:
-            pass
-            
-        # Возвращаемся к админ-панели через кнопку назад
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="admin_back")]
-        ])
-        
-        # Редактируем сообщение с результатом экспорта
-        await callback_query.message.edit_text(
-            "✅ Экспорт запросов выполнен успешно!",
-            reply_markup=back_keyboard,
-            parse_mode='HTML'
-        )
-        
+        await send_export_parts(callback_query, admin_panel.export_requests_csv(),
+                                "Экспорт запросов", "requests_export")
     except Exception as e:
         logger.error(f"❌ Ошибка экспорта запросов: {e}")
         await callback_query.answer("❌ Ошибка создания экспорта", show_alert=True)
@@ -1223,14 +1430,6 @@ async def admin_back(callback_query: types.CallbackQuery):
                 'top_user': "Ошибка загрузки"
             }
         
-        admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="👥 Пользователи", callback_data="admin_users")],
-            [InlineKeyboardButton(text="📊 Аналитика", callback_data="admin_analytics")],
-            [InlineKeyboardButton(text="📝 Запросы", callback_data="admin_requests")],
-            [InlineKeyboardButton(text="💾 Экспорт данных", callback_data="admin_export")],
-            [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
-        ])
-        
         logger.info("📝 Обновление сообщения...")
         await callback_query.message.edit_text(
             f"""🛠️ <b>АДМИН-ПАНЕЛЬ "Виртуальный юрист"</b>
@@ -1240,10 +1439,11 @@ async def admin_back(callback_query: types.CallbackQuery):
 🔥 Активных за день: {stats['active_today']}
 📝 Запросов сегодня: {stats['requests_today']}
 ⭐ Топ пользователь: {stats['top_user']}
+🕐 Данные на: {admin_panel.data_as_of()}
 
 🎯 <b>ДЕЙСТВИЯ:</b>
 Выберите нужную функцию ниже""",
-            reply_markup=admin_keyboard,
+            reply_markup=get_admin_keyboard(),
             parse_mode='HTML'
         )
         logger.info("✅ Админ-панель обновлена")
@@ -1277,12 +1477,27 @@ async def main():
             types.BotCommand(command="admin", description="Админ-панель (только для администраторов)")
         ])
         
+        # Снимок базы для админ-панели: тяжелые чтения и экспорт не мешают записи
+        admin_panel.start_snapshots()
+        
+        # Фоновое обслуживание истории запросов (сжатие, архивы, VACUUM)
+        retention_task = asyncio.create_task(retention_manager.run_periodic())
+        
         # Запускаем бота
-        await dp.start_polling(bot)
+        try:
+            await dp.start_polling(bot)
+        finally:
+            retention_task.cancel()
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        await ai_service.perplexity.close()
+        await close_openai_gateways()
+        await asyncio.to_thread(pdf_extractor.close)
+        extraction_cache.close()
+        # Дописываем очередь аналитики в базу
+        await asyncio.to_thread(admin_panel.close)
         await bot.session.close()
 
 if __name__ == '__main__':
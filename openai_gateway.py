@@ -0,0 +1,125 @@
+"""
+Общий асинхронный клиент OpenAI для всех сервисов бота
+Все вызовы GPT, Whisper и TTS идут через один пул соединений
+с ограничением параллельности и таймаутами на каждый вызов
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, DefaultAsyncHttpxClient, InternalServerError, RateLimitError
+
+from config import Config
+from request_timing import stage
+from rate_limiter import rate_limiter, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIGateway:
+    """Асинхронный шлюз к OpenAI API с общим пулом соединений"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client: Optional[AsyncOpenAI] = None
+        # Ограничение одновременных вызовов к OpenAI
+        self._semaphore = asyncio.Semaphore(Config.OPENAI_MAX_CONCURRENCY)
+
+        logger.info(f"✅ OpenAI шлюз инициализирован (параллельность: {Config.OPENAI_MAX_CONCURRENCY})")
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Возвращает общий AsyncOpenAI клиент (создается лениво)"""
+        if self._client is None:
+            http_client = DefaultAsyncHttpxClient(
+                timeout=httpx.Timeout(
+                    Config.OPENAI_CHAT_TIMEOUT,
+                    connect=Config.OPENAI_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE
+                )
+            )
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=Config.OPENAI_BASE_URL,
+                max_retries=Config.OPENAI_MAX_RETRIES,
+                http_client=http_client
+            )
+        return self._client
+
+    async def _call(self, provider: str, factory: Callable[[], Awaitable]):
+        """Вызов с учетом лимитов провайдера и повтором после 429/5xx, сетевых ошибок и таймаутов"""
+        for attempt in range(Config.RATE_LIMIT_MAX_ATTEMPTS):
+            await rate_limiter.acquire(provider)
+            try:
+                async with self._semaphore:
+                    result = await factory()
+                rate_limiter.register_success(provider)
+                return result
+            except (RateLimitError, InternalServerError) as e:
+                # Исчерпанную квоту повторять бессмысленно
+                if getattr(e, 'code', None) == 'insufficient_quota':
+                    raise
+                retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                rate_limiter.register_throttle(provider, attempt, retry_after)
+                if attempt + 1 >= Config.RATE_LIMIT_MAX_ATTEMPTS:
+                    raise
+            except APIConnectionError as e:
+                # Обрыв соединения или таймаут (APITimeoutError) - повтор с той же паузой,
+                # скорость провайдера не снижаем
+                if attempt + 1 >= Config.RATE_LIMIT_MAX_ATTEMPTS:
+                    raise
+                delay = rate_limiter.backoff_delay(attempt)
+                logger.warning(f"⚠️ [{provider}] {type(e).__name__}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    async def chat_completion(self, timeout: float = None, **kwargs):
+        """Запрос к Chat Completions API"""
+        with stage("gpt"):
+            return await self._call("openai_chat", lambda: self.client.chat.completions.create(
+                timeout=timeout or Config.OPENAI_CHAT_TIMEOUT,
+                **kwargs
+            ))
+
+    async def transcription(self, timeout: float = None, **kwargs):
+        """Распознавание речи через Whisper API"""
+        with stage("whisper"):
+            return await self._call("openai_whisper", lambda: self.client.audio.transcriptions.create(
+                timeout=timeout or Config.OPENAI_WHISPER_TIMEOUT,
+                **kwargs
+            ))
+
+    async def speech(self, timeout: float = None, **kwargs) -> bytes:
+        """Синтез речи через TTS API, возвращает аудио в байтах"""
+        response = await self._call("openai_tts", lambda: self.client.audio.speech.create(
+            timeout=timeout or Config.OPENAI_TTS_TIMEOUT,
+            **kwargs
+        ))
+        return response.content
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            logger.info("🔌 OpenAI шлюз закрыт")
+
+
+_gateways: Dict[str, OpenAIGateway] = {}
+
+
+def get_openai_gateway(api_key: str) -> OpenAIGateway:
+    """Возвращает общий шлюз для указанного ключа API"""
+    if api_key not in _gateways:
+        _gateways[api_key] = OpenAIGateway(api_key)
+    return _gateways[api_key]
+
+
+async def close_openai_gateways():
+    """Закрывает все открытые шлюзы (при остановке бота)"""
+    for gateway in _gateways.values():
+        await gateway.close()
@@ -0,0 +1,200 @@
+"""
+Извлечение текста из PDF (PyMuPDF)
+
+Текст страниц собирается в список и склеивается один раз. Большие документы
+(судебные дела на сотни страниц) делятся на непрерывные диапазоны страниц,
+которые разбираются параллельно в пуле процессов - по одному диапазону на процесс,
+чтобы содержимое файла передавалось каждому процессу один раз.
+
+Страницы без текстового слоя, но с изображениями (сканы) определяются по ресурсам
+страницы - повторный разбор всего файла другой библиотекой не нужен.
+
+iter_pages() читает страницы по одной для извлечения с ограничением объема (бот);
+пул процессов нужен только extract() - полному разбору документа (document_manager.py).
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _extract_pages(doc: "fitz.Document", start: int, stop: int) -> Tuple[List[str], List[int]]:
+    """Текст страниц [start, stop) и номера страниц-сканов (без текста, с изображениями)"""
+    parts = []
+    image_pages = []
+    for number in range(start, stop):
+        page = doc[number]
+        text = page.get_text()
+        if not text.strip() and page.get_images():
+            image_pages.append(number)
+        parts.append(text)
+    return parts, image_pages
+
+
+def _extract_range(data: bytes, start: int, stop: int) -> Tuple[List[str], List[int]]:
+    """Задача пула процессов: открывает документ из байтов и разбирает свой диапазон"""
+    doc = fitz.open(stream=data, filetype="pdf")
+    try:
+        return _extract_pages(doc, start, stop)
+    finally:
+        doc.close()
+
+
+def split_pages(page_count: int, parts: int) -> List[Tuple[int, int]]:
+    """Делит страницы на parts непрерывных диапазонов почти равной длины"""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for index in range(parts):
+        stop = start + size + (1 if index < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+class PdfExtractor:
+    """Извлечение текста PDF с пулом процессов для больших документов"""
+
+    def __init__(self, workers: int = Config.PDF_WORKERS, parallel_min_pages: int = Config.PDF_PARALLEL_MIN_PAGES):
+        self.workers = workers
+        self.parallel_min_pages = parallel_min_pages
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_disabled = False     # Пул нельзя запустить (нет fork, потоки, падение процесса)
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'documents': 0,
+            'pages': 0,
+            'image_pages': 0,       # Страниц-сканов без текстового слоя
+            'parallel': 0,          # Документов, разобранных в пуле процессов
+            'pool_failures': 0,
+            'seconds': 0.0
+        }
+
+    def start(self) -> bool:
+        """
+        Запускает пул процессов (при первом большом документе в extract)
+
+        Процессы создаются через fork: при spawn/forkserver каждый процесс пула заново
+        выполнял бы главный модуль (main.py - бот, база, потоки записи). Fork процесса
+        с работающими потоками может унаследовать чужую захваченную блокировку, поэтому
+        пул создается, только пока в процессе один поток (document_manager.py), и после
+        отказа или падения процесса пула больше не пересоздается. Бот читает документы
+        постранично с бюджетом символов (iter_pages) и пул не использует.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return True
+            if self.workers <= 1 or self._pool_disabled:
+                return False
+            self._pool_disabled = True
+            if "fork" not in multiprocessing.get_all_start_methods():
+                logger.info("📄 Пул разбора PDF недоступен (нет fork), разбор в основном процессе")
+                return False
+            if threading.active_count() > 1:
+                logger.info("📄 Пул разбора PDF не запущен: в процессе работают потоки, разбор в основном процессе")
+                return False
+
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+            # Первая задача создает все процессы пула (для fork - сразу и до служебного потока пула)
+            pool.submit(split_pages, 0, 1).result()
+            self._pool = pool
+            self._pool_disabled = False
+            logger.info(f"📄 Пул разбора PDF запущен: {self.workers} процессов")
+            return True
+
+    def extract(self, data: bytes) -> Dict:
+        """
+        Извлекает текст PDF из памяти
+
+        Returns:
+            {'text': текст всех страниц, 'pages': страниц, 'image_pages': номера страниц-сканов}
+        """
+        started = time.monotonic()
+        doc = fitz.open(stream=data, filetype="pdf")
+        try:
+            page_count = doc.page_count
+            if page_count >= self.parallel_min_pages and self.start():
+                doc.close()
+                parts, image_pages = self._extract_parallel(data, page_count)
+            else:
+                parts, image_pages = _extract_pages(doc, 0, page_count)
+        finally:
+            if not doc.is_closed:
+                doc.close()
+
+        self.stats['documents'] += 1
+        self.stats['pages'] += page_count
+        self.stats['image_pages'] += len(image_pages)
+        self.stats['seconds'] += time.monotonic() - started
+        return {'text': "".join(parts), 'pages': page_count, 'image_pages': image_pages}
+
+    def iter_pages(self, data: bytes) -> Iterator[str]:
+        """
+        Текст страниц по одной, по мере чтения: вызывающий может остановиться
+        на любой странице, остальные страницы не разбираются.
+        Документ открывается сразу - ошибка открытия возникает при вызове.
+        """
+        doc = fitz.open(stream=data, filetype="pdf")
+        self.stats['documents'] += 1
+        return self._iter_open_pages(doc)
+
+    def _iter_open_pages(self, doc: "fitz.Document") -> Iterator[str]:
+        try:
+            for page in doc:
+                started = time.monotonic()
+                text = page.get_text()
+                self.stats['pages'] += 1
+                if not text.strip() and page.get_images():
+                    self.stats['image_pages'] += 1
+                self.stats['seconds'] += time.monotonic() - started
+                yield text
+        finally:
+            doc.close()
+
+    def _extract_parallel(self, data: bytes, page_count: int) -> Tuple[List[str], List[int]]:
+        ranges = split_pages(page_count, self.workers)
+        try:
+            futures = [self._pool.submit(_extract_range, data, start, stop) for start, stop in ranges]
+            results = [future.result() for future in futures]
+            self.stats['parallel'] += 1
+        except (BrokenProcessPool, RuntimeError) as e:
+            # Процесс пула упал (например, нехватка памяти) или пул закрыт - разбираем
+            # документ здесь; новый пул не создаем (fork при работающих потоках)
+            logger.error(f"❌ Пул разбора PDF недоступен, разбор в основном процессе: {e}")
+            self.stats['pool_failures'] += 1
+            self.close(wait=False)
+            self._pool_disabled = True
+            return _extract_range(data, 0, page_count)
+
+        parts: List[str] = []
+        image_pages: List[int] = []
+        for range_parts, range_images in results:
+            parts.extend(range_parts)
+            image_pages.extend(range_images)
+        return parts, image_pages
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats, workers=self.workers if self._pool is not None else 1)
+
+    def close(self, wait: bool = True):
+        """Останавливает пул процессов (при завершении бота)"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+# Глобальный экземпляр
+pdf_extractor = PdfExtractor()
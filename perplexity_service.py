@@ -3,11 +3,16 @@
 Заменяет embeddings и веб-поиск точным поиском через интернет
 """
 
-import requests
+import httpx
+import asyncio
 import logging
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Awaitable
 from config import Config
+from answer_cache import AnswerCache
+from provider_router import provider_router
+from request_timing import stage
+from rate_limiter import rate_limiter, RateLimitExceeded, parse_retry_after
 
 logger = logging.getLogger(__name__)
 
@@ -16,47 +21,105 @@ class PerplexityService:
     
     def __init__(self):
         self.api_key = Config.PERPLEXITY_API_KEY
-        self.base_url = "https://api.perplexity.ai/chat/completions"
+        self.base_url = f"{Config.PERPLEXITY_BASE_URL.rstrip('/')}/chat/completions"
         
         # Модели Perplexity (актуальные с января 2025)
-        self.model = "sonar"  # Быстрая модель с доступом в интернет
+        self.model = Config.PERPLEXITY_MODEL  # Быстрая модель с доступом в интернет
         
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         
+        # Долгоживущий асинхронный клиент создается лениво внутри event loop
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Кэш готовых ответов для повторяющихся вопросов
+        self.cache = AnswerCache()
+        
         logger.info("✅ Perplexity API сервис инициализирован")
     
-    async def search_legal_info(self, query: str, context_type: str = "general") -> str:
+    def _get_client(self) -> httpx.AsyncClient:
+        """Возвращает общий HTTP-клиент с keep-alive пулом соединений"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(
+                    Config.PERPLEXITY_READ_TIMEOUT,
+                    connect=Config.PERPLEXITY_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=Config.PERPLEXITY_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.PERPLEXITY_MAX_KEEPALIVE,
+                    keepalive_expiry=Config.PERPLEXITY_KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+    
+    async def close(self):
+        """Закрывает пул соединений (вызывается при остановке бота)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("🔌 HTTP-клиент Perplexity закрыт")
+        self._client = None
+        self.cache.close()
+    
+    async def search_legal_info(self, query: str, context_type: str = "general",
+                                on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                                fallback: bool = True) -> Optional[str]:
         """
         Поиск юридической информации через Perplexity API
         
         Args:
             query: Поисковый запрос
             context_type: Тип контекста ("bankruptcy", "labor", "civil", "general")
+            on_partial: Колбэк для потоковых обновлений (получает накопленный текст)
+            fallback: Вернуть резервный текст при недоступности API (иначе None)
             
         Returns:
             Актуальная информация из интернета
         """
         try:
+            # Проверяем кэш ответов
+            cached = await self.cache.get(query, context_type)
+            if cached:
+                logger.info("⚡ Ответ Perplexity найден в кэше")
+                return cached
+            
             # Формируем системный промпт для юридического поиска
             system_prompt = self._get_legal_system_prompt(context_type)
             
             # Улучшаем запрос для юридического поиска
             enhanced_query = self._enhance_legal_query(query, context_type)
             
-            # Отправляем запрос к Perplexity API
-            response = await self._make_request(system_prompt, enhanced_query)
+            # Отправляем запрос к Perplexity API через маршрутизатор (circuit breaker, дедлайн).
+            # Потоковый запрос не дублируется: частичные ответы двух запросов смешались бы
+            with stage("perplexity"):
+                if on_partial is not None and Config.PERPLEXITY_STREAMING:
+                    response = await provider_router.call(
+                        "perplexity",
+                        lambda: self._make_streaming_request(system_prompt, enhanced_query, on_partial),
+                        hedge=False
+                    )
+                else:
+                    response = await provider_router.call(
+                        "perplexity",
+                        lambda: self._make_request(system_prompt, enhanced_query)
+                    )
             
             if response:
-                return self._format_legal_response(response, context_type)
-            else:
+                formatted = self._format_legal_response(response, context_type)
+                # Кэшируем только успешные ответы, резервные тексты не сохраняем
+                await self.cache.set(query, context_type, formatted)
+                return formatted
+            elif fallback:
                 return self._get_fallback_response(query, context_type)
+            else:
+                return None
                 
         except Exception as e:
             logger.error(f"❌ Ошибка Perplexity API: {e}")
-            return self._get_error_response(query, context_type)
+            return self._get_error_response(query, context_type) if fallback else None
     
     def _get_legal_system_prompt(self, context_type: str) -> str:
         """Системный промпт для юридических запросов"""
@@ -158,30 +221,91 @@ class PerplexityService:
         
         return enhanced_query
     
+    def _build_payload(self, system_prompt: str, query: str, stream: bool) -> dict:
+        """Тело запроса к Chat Completions API"""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": query}
+            ],
+            "temperature": 0.1,  # Низкая температура для точности
+            "max_tokens": 4000,
+            "stream": stream
+        }
+    
+    def _log_error_status(self, status_code: int, text: str):
+        """Логирует ошибочный HTTP статус Perplexity API"""
+        if status_code == 400:
+            logger.error(f"❌ Неправильный запрос к Perplexity API: {text}")
+        elif status_code == 401:
+            logger.error("❌ Неверный API ключ Perplexity")
+        elif status_code == 429:
+            logger.error("❌ Превышен лимит запросов Perplexity API")
+        else:
+            logger.error(f"❌ Ошибка Perplexity API: {status_code} - {text}")
+    
+    def _should_retry(self, response: httpx.Response, attempt: int) -> bool:
+        """Для 429/503 ставит очередь на паузу и решает, нужен ли повтор"""
+        if response.status_code not in (429, 503):
+            return False
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        rate_limiter.register_throttle("perplexity", attempt, retry_after)
+        return attempt + 1 < Config.RATE_LIMIT_MAX_ATTEMPTS
+    
+    async def _read_sse_stream(self, response: httpx.Response,
+                               on_partial: Callable[[str], Awaitable[None]]) -> str:
+        """Читает SSE поток токенов и передает накопленный текст в on_partial"""
+        chunks: List[str] = []
+        loop = asyncio.get_running_loop()
+        last_notify = 0.0
+        
+        async for line in response.aiter_lines():
+            # Формат SSE: строки "data: {...}", поток завершается "data: [DONE]"
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            
+            try:
+                event = json.loads(payload)
+            except json.JSONDecodeError:
+                logger.warning("⚠️ Пропущен некорректный фрагмент потока Perplexity")
+                continue
+            
+            choices = event.get('choices') or []
+            if not choices:
+                continue
+            delta = (choices[0].get('delta') or {}).get('content')
+            if delta:
+                chunks.append(delta)
+                # Склеиваем накопленный текст не чаще интервала, а не на каждый токен
+                if loop.time() - last_notify >= Config.PERPLEXITY_STREAM_NOTIFY_INTERVAL:
+                    last_notify = loop.time()
+                    await on_partial(''.join(chunks))
+        
+        content = ''.join(chunks)
+        if content:
+            await on_partial(content)
+        return content
+    
     async def _make_request(self, system_prompt: str, query: str) -> Optional[str]:
         """Отправляет запрос к Perplexity API"""
         try:
-            data = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query}
-                ],
-                "temperature": 0.1,  # Низкая температура для точности
-                "max_tokens": 4000,
-                "stream": False
-            }
+            data = self._build_payload(system_prompt, query, stream=False)
             
             logger.info(f"🌐 Отправляю запрос к Perplexity API: {query[:50]}...")
             
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json=data,
-                timeout=45  # Увеличен таймаут для интернет-поиска
-            )
+            # Неблокирующий запрос через общий пул соединений с учетом лимитов провайдера
+            for attempt in range(Config.RATE_LIMIT_MAX_ATTEMPTS):
+                await rate_limiter.acquire("perplexity")
+                response = await self._get_client().post(self.base_url, json=data)
+                if not self._should_retry(response, attempt):
+                    break
             
             if response.status_code == 200:
+                rate_limiter.register_success("perplexity")
                 result = response.json()
                 
                 # Проверяем структуру ответа
@@ -197,30 +321,74 @@ class PerplexityService:
                 else:
                     logger.error("❌ Неожиданная структура ответа от Perplexity API")
                     return None
-                    
-            elif response.status_code == 400:
-                logger.error(f"❌ Неправильный запрос к Perplexity API: {response.text}")
-                return None
-            elif response.status_code == 401:
-                logger.error("❌ Неверный API ключ Perplexity")
-                return None
-            elif response.status_code == 429:
-                logger.error("❌ Превышен лимит запросов Perplexity API")
-                return None
             else:
-                logger.error(f"❌ Ошибка Perplexity API: {response.status_code} - {response.text}")
+                self._log_error_status(response.status_code, response.text)
                 return None
                 
-        except requests.exceptions.Timeout:
+        except RateLimitExceeded:
+            # Отказ своего ограничителя, а не ошибка провайдера - решает маршрутизатор
+            logger.error("❌ Очередь к Perplexity API переполнена, запрос отклонен")
+            raise
+        except httpx.PoolTimeout:
+            logger.error("❌ Нет свободных соединений в пуле Perplexity API")
+            return None
+        except httpx.TimeoutException:
             logger.error("❌ Таймаут запроса к Perplexity API")
             return None
-        except requests.exceptions.ConnectionError:
+        except httpx.TransportError:
             logger.error("❌ Ошибка соединения с Perplexity API")
             return None
         except Exception as e:
             logger.error(f"❌ Неожиданная ошибка запроса к Perplexity: {e}")
             return None
     
+    async def _make_streaming_request(self, system_prompt: str, query: str,
+                                      on_partial: Callable[[str], Awaitable[None]]) -> Optional[str]:
+        """Отправляет потоковый запрос к Perplexity API и читает SSE поток токенов"""
+        try:
+            data = self._build_payload(system_prompt, query, stream=True)
+            
+            logger.info(f"🌐 Отправляю потоковый запрос к Perplexity API: {query[:50]}...")
+            
+            content = None
+            for attempt in range(Config.RATE_LIMIT_MAX_ATTEMPTS):
+                await rate_limiter.acquire("perplexity")
+                async with self._get_client().stream("POST", self.base_url, json=data) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        if self._should_retry(response, attempt):
+                            continue
+                        self._log_error_status(response.status_code, body.decode('utf-8', errors='replace'))
+                        return None
+                    
+                    rate_limiter.register_success("perplexity")
+                    content = await self._read_sse_stream(response, on_partial)
+                    break
+            
+            if not content:
+                logger.error("❌ Пустой потоковый ответ от Perplexity API")
+                return None
+            
+            logger.info("✅ Получен потоковый ответ от Perplexity API")
+            return content
+            
+        except RateLimitExceeded:
+            # Отказ своего ограничителя, а не ошибка провайдера - решает маршрутизатор
+            logger.error("❌ Очередь к Perplexity API переполнена, запрос отклонен")
+            raise
+        except httpx.PoolTimeout:
+            logger.error("❌ Нет свободных соединений в пуле Perplexity API")
+            return None
+        except httpx.TimeoutException:
+            logger.error("❌ Таймаут потокового запроса к Perplexity API")
+            return None
+        except httpx.TransportError:
+            logger.error("❌ Ошибка соединения с Perplexity API")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Неожиданная ошибка потокового запроса к Perplexity: {e}")
+            return None
+    
     def _format_legal_response(self, response: str, context_type: str) -> str:
         """Форматирует ответ для юридического контекста"""
         # Конвертируем Markdown жирный текст в HTML
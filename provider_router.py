@@ -0,0 +1,245 @@
+"""
+Маршрутизатор запросов к внешним провайдерам
+Скользящая статистика задержек (p50/p95) и ошибок, circuit breaker,
+«хеджированные» дубли медленных запросов и общий дедлайн на вызов
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from config import Config
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderHealth:
+    """Скользящее окно задержек и исходов запросов к провайдеру"""
+
+    def __init__(self, window: int):
+        # (задержка в секундах, успех)
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль задержки успешных запросов (None, если данных мало)"""
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if len(latencies) < Config.ROUTER_MIN_SAMPLES:
+            return None
+        # Метод ближайшего ранга
+        index = max(0, math.ceil(q / 100 * len(latencies)) - 1)
+        return latencies[index]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class CircuitBreaker:
+    """Размыкается после серии ошибок, через паузу пропускает пробный запрос"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ Circuit breaker замкнут: провайдер снова отвечает")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Пробный запрос отменен или не отправлен - следующий запрос снова может стать пробным"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"🔌 Circuit breaker разомкнут после {self.consecutive_failures} ошибок подряд")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProviderRouter:
+    """Вызовы провайдеров с хеджированием и защитой от деградации"""
+
+    def __init__(self):
+        self.health: Dict[str, ProviderHealth] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _ensure(self, provider: str):
+        if provider not in self.health:
+            self.health[provider] = ProviderHealth(Config.ROUTER_WINDOW)
+            self.breakers[provider] = CircuitBreaker(
+                Config.ROUTER_FAILURE_THRESHOLD,
+                Config.ROUTER_BREAKER_COOLDOWN
+            )
+            self.stats[provider] = {
+                'calls': 0,
+                'failures': 0,
+                'hedged': 0,        # Отправлено дублей
+                'hedge_wins': 0,    # Дубль ответил первым
+                'short_circuited': 0,
+                'rejected_locally': 0,  # Отклонены своим ограничителем частоты, провайдер не вызывался
+                'timeouts': 0,
+                'failovers': 0      # Ответ собран без провайдера
+            }
+
+    def is_available(self, provider: str) -> bool:
+        """Можно ли сейчас обращаться к провайдеру (circuit breaker не разомкнут)"""
+        self._ensure(provider)
+        return self.breakers[provider].state != CircuitBreaker.OPEN
+
+    def record_failover(self, provider: str):
+        self._ensure(provider)
+        self.stats[provider]['failovers'] += 1
+
+    async def call(self, provider: str, factory: Callable[[], Awaitable], hedge: bool = True):
+        """
+        Выполняет factory() с учетом состояния провайдера.
+        Результат None считается ошибкой. Возвращает None, если ответа нет.
+        RateLimitExceeded из factory() - отказ своего ограничителя частоты:
+        ошибкой провайдера не считается и в статистику задержек не попадает.
+        """
+        self._ensure(provider)
+        health = self.health[provider]
+        breaker = self.breakers[provider]
+        stats = self.stats[provider]
+
+        if not breaker.allow_request():
+            stats['short_circuited'] += 1
+            logger.warning(f"🔌 [{provider}] Circuit breaker разомкнут, запрос не отправлен")
+            return None
+
+        stats['calls'] += 1
+        started = time.monotonic()
+        deadline = started + Config.ROUTER_DEADLINE
+
+        primary = asyncio.ensure_future(factory())
+        tasks = [primary]
+        hedge_delay = self._hedge_delay(provider) if hedge and Config.ROUTER_HEDGING else None
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        result = None
+        rejected_locally = 0        # Запросов, отклоненных ограничителем частоты
+        upstream_failed = False     # Провайдер ответил ошибкой или не уложился в дедлайн
+
+        try:
+            while tasks and result is None:
+                now = time.monotonic()
+                timeout = deadline - now
+                if timeout <= 0:
+                    stats['timeouts'] += 1
+                    upstream_failed = True
+                    logger.warning(f"⏱ [{provider}] Превышен дедлайн {Config.ROUTER_DEADLINE:.0f} с")
+                    break
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        # Первый запрос медленнее p95 - отправляем дубль
+                        logger.info(f"🪃 [{provider}] Ответ дольше p95 ({hedge_delay:.1f} с), отправляю дубль")
+                        stats['hedged'] += 1
+                        tasks.append(asyncio.ensure_future(factory()))
+                        hedge_at = None
+                    continue
+
+                for task in done:
+                    tasks.remove(task)
+                    if not task.cancelled() and isinstance(task.exception(), RateLimitExceeded):
+                        rejected_locally += 1
+                    elif result is None and self._result_of(task) is not None:
+                        result = task.result()
+                        if task is not primary:
+                            stats['hedge_wins'] += 1
+                    else:
+                        upstream_failed = True
+        except asyncio.CancelledError:
+            # Отмена - не ошибка провайдера, но пробный запрос HALF_OPEN нужно освободить,
+            # иначе breaker не пропустит больше ни одного запроса
+            breaker.release_probe()
+            raise
+        finally:
+            # Проигравший или не успевший запрос больше не нужен
+            for task in tasks:
+                task.cancel()
+
+        latency = time.monotonic() - started
+        if result is not None:
+            health.record(latency, True)
+            breaker.record_success()
+        elif rejected_locally and not upstream_failed:
+            # Провайдер не вызывался - breaker и задержки не трогаем, пробный запрос освобождаем
+            stats['rejected_locally'] += 1
+            breaker.release_probe()
+        else:
+            stats['failures'] += 1
+            health.record(latency, False)
+            breaker.record_failure()
+        return result
+
+    @staticmethod
+    def _result_of(task: asyncio.Task):
+        if task.cancelled():
+            return None
+        error = task.exception()
+        if error is not None:
+            logger.error(f"❌ Ошибка запроса к провайдеру: {error}")
+            return None
+        return task.result()
+
+    def _hedge_delay(self, provider: str) -> Optional[float]:
+        p95 = self.health[provider].percentile(95)
+        if p95 is None:
+            return None
+        return max(Config.ROUTER_HEDGE_MIN_DELAY, p95)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Состояние провайдеров для админ-панели"""
+        return {
+            provider: {
+                **self.stats[provider],
+                'state': self.breakers[provider].state,
+                'p50': self.health[provider].percentile(50),
+                'p95': self.health[provider].percentile(95),
+                'error_rate': self.health[provider].error_rate
+            }
+            for provider in self.health
+        }
+
+
+# Глобальный маршрутизатор для всех сервисов
+provider_router = ProviderRouter()
@@ -0,0 +1,181 @@
+"""
+Адаптивный ограничитель частоты запросов к внешним API
+Token bucket на каждого провайдера (Perplexity, OpenAI), очередь с ограничением
+времени ожидания, экспоненциальная пауза с джиттером с учетом Retry-After
+"""
+
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Запрос не дождался своей очереди за отведенное время"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderBucket:
+    """Token bucket одного провайдера с адаптивной скоростью"""
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+        self.waiting = 0
+        self.stats = {
+            'granted': 0,
+            'throttled': 0,         # Запросов, которым пришлось ждать
+            'throttled_seconds': 0.0,
+            'rejected': 0,          # Не дождались очереди
+            'upstream_throttled': 0,  # Ответов 429/5xx от провайдера
+            'max_queue_depth': 0
+        }
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до следующего токена (с учетом паузы после 429)"""
+        self._refill(now)
+        pause = max(0.0, self.paused_until - now)
+        if self.tokens >= 1:
+            return pause
+        return max(pause, (1 - self.tokens) / self.rate)
+
+
+class AdaptiveRateLimiter:
+    """Общий ограничитель частоты для PerplexityService, AIService и TTSService"""
+
+    def __init__(self, budgets: Dict[str, Dict]):
+        self.buckets: Dict[str, ProviderBucket] = {
+            name: ProviderBucket(name, budget['rate'], budget['burst'])
+            for name, budget in budgets.items()
+        }
+
+    def _bucket(self, provider: str) -> ProviderBucket:
+        if provider not in self.buckets:
+            budget = Config.RATE_LIMITS.get(provider, {'rate': 1.0, 'burst': 1})
+            self.buckets[provider] = ProviderBucket(provider, budget['rate'], budget['burst'])
+        return self.buckets[provider]
+
+    async def acquire(self, provider: str, max_wait: float = None):
+        """Ждет разрешения на запрос; RateLimitExceeded если очередь слишком длинная"""
+        bucket = self._bucket(provider)
+        max_wait = Config.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+
+        started = time.monotonic()
+        bucket.waiting += 1
+        bucket.stats['max_queue_depth'] = max(bucket.stats['max_queue_depth'], bucket.waiting)
+        try:
+            await asyncio.wait_for(self._take_token(bucket), timeout=max_wait)
+        except asyncio.TimeoutError:
+            bucket.stats['rejected'] += 1
+            logger.warning(f"⚠️ [{provider}] Запрос не дождался очереди за {max_wait:.0f} с")
+            raise RateLimitExceeded(f"{provider}: превышено время ожидания очереди")
+        finally:
+            bucket.waiting -= 1
+
+        waited = time.monotonic() - started
+        bucket.stats['granted'] += 1
+        if waited > 0.01:
+            bucket.stats['throttled'] += 1
+            bucket.stats['throttled_seconds'] += waited
+
+    async def _take_token(self, bucket: ProviderBucket):
+        # Блокировка сохраняет порядок очереди (FIFO)
+        async with bucket.lock:
+            while True:
+                delay = bucket.wait_time(time.monotonic())
+                if delay <= 0:
+                    bucket.tokens -= 1
+                    return
+                await asyncio.sleep(delay)
+
+    def register_throttle(self, provider: str, attempt: int, retry_after: float = None) -> float:
+        """
+        Учитывает ответ 429/5xx от провайдера: ставит очередь на паузу
+        и снижает скорость. Возвращает паузу перед повтором, секунды.
+        """
+        bucket = self._bucket(provider)
+        bucket.stats['upstream_throttled'] += 1
+
+        if retry_after is not None:
+            # Retry-After ограничиваем, чтобы один ответ не остановил провайдера надолго,
+            # а повтор дождался конца паузы в очереди (acquire ждет не дольше RATE_LIMIT_MAX_WAIT)
+            delay = min(retry_after + random.uniform(0, Config.RATE_LIMIT_BACKOFF_BASE), self.max_pause())
+        else:
+            delay = self.backoff_delay(attempt)
+
+        now = time.monotonic()
+        # Мультипликативное снижение скорости, восстанавливается по успешным ответам.
+        # Не чаще раза за паузу: одновременные 429 одной волны снижают скорость один раз
+        if now >= bucket.paused_until:
+            bucket.rate = max(bucket.base_rate * Config.RATE_LIMIT_MIN_FACTOR, bucket.rate / 2)
+        bucket.paused_until = max(bucket.paused_until, now + delay)
+
+        logger.warning(f"⏳ [{provider}] Лимит провайдера, пауза {delay:.1f} с, скорость {bucket.rate:.2f} запр/с")
+        return delay
+
+    @staticmethod
+    def max_pause() -> float:
+        """Наибольшая пауза перед повтором: короче ожидания в очереди (с запасом
+        RATE_LIMIT_BACKOFF_BASE на токен после паузы), иначе повтор получит отказ"""
+        return min(Config.RATE_LIMIT_BACKOFF_MAX,
+                   max(0.0, Config.RATE_LIMIT_MAX_WAIT - Config.RATE_LIMIT_BACKOFF_BASE))
+
+    @classmethod
+    def backoff_delay(cls, attempt: int) -> float:
+        """Экспоненциальная пауза перед повтором с «равным» джиттером (от cap/2 до cap)"""
+        cap = min(cls.max_pause(), Config.RATE_LIMIT_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    def register_success(self, provider: str):
+        """Аддитивно восстанавливает скорость после успешного ответа"""
+        bucket = self._bucket(provider)
+        if bucket.rate < bucket.base_rate:
+            bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate * 0.1)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Метрики очередей для админ-панели"""
+        return {
+            name: {
+                **bucket.stats,
+                'queue_depth': bucket.waiting,
+                'rate': bucket.rate,
+                'base_rate': bucket.base_rate,
+                'paused_for': max(0.0, bucket.paused_until - time.monotonic())
+            }
+            for name, bucket in self.buckets.items()
+        }
+
+
+# Глобальный ограничитель для всех сервисов
+rate_limiter = AdaptiveRateLimiter(Config.RATE_LIMITS)
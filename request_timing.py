@@ -0,0 +1,169 @@
+"""
+Замер времени обработки запросов по этапам
+
+Каждое обновление Telegram обрабатывается с таймером запроса (RequestTimingMiddleware),
+который хранится в ContextVar и доступен сервисам без передачи параметров.
+Сервисы оборачивают свои вызовы в stage("..."), время этапов суммируется.
+Вложенный этап не считается второй раз: например, get_file внутри «download»
+не попадает в «send».
+
+По завершении обработчика таймер с заданным типом запроса передается записи
+(AdminPanel.log_request_timing) и выполняет отложенные действия - запись
+user_requests с реальным processing_time.
+
+Перцентили по этапам считаются векторно (NumPy) по строкам за последнее окно.
+"""
+
+import logging
+import time
+import warnings
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки запроса - порядок колонок таблицы request_timings
+STAGES = ("download", "extract", "whisper", "perplexity", "gpt", "tts", "send")
+
+# Подписи этапов в админ-панели
+STAGE_TITLES = {
+    "total": "Всего",
+    "download": "Загрузка файла",
+    "extract": "Извлечение текста",
+    "whisper": "Whisper",
+    "perplexity": "Perplexity",
+    "gpt": "GPT",
+    "tts": "TTS",
+    "send": "Отправка в Telegram",
+}
+
+# Перцентили админ-панели
+PERCENTILES = (50, 90, 99)
+
+
+class RequestTimer:
+    """Таймер одного обновления: суммарное время этапов и отложенные действия"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages: Dict[str, float] = {}
+        self.request_type: Optional[str] = None
+        self.total = 0.0
+        self._on_finish: List[Callable[["RequestTimer"], None]] = []
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def on_finish(self, callback: Callable[["RequestTimer"], None]):
+        """Выполнить callback(timer) после обработчика (total уже известен)"""
+        self._on_finish.append(callback)
+
+    def finish(self):
+        self.total = time.monotonic() - self.started
+        for callback in self._on_finish:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи времени запроса: {e}")
+
+
+_current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+_current_stage: ContextVar[Optional[str]] = ContextVar("request_stage", default=None)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    """Таймер обрабатываемого обновления (None вне обработчика)"""
+    return _current_timer.get()
+
+
+def set_request_type(request_type: str):
+    """Тип запроса для таблицы времени (по умолчанию - первый записанный запрос)"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.request_type = request_type
+
+
+@contextmanager
+def stage(name: str):
+    """Засекает этап запроса; работает и в async-коде (with stage("gpt"): await ...)"""
+    timer = _current_timer.get()
+    if timer is None or _current_stage.get() is not None:
+        yield
+        return
+    token = _current_stage.set(name)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timer.add(name, time.monotonic() - started)
+        _current_stage.reset(token)
+
+
+class RequestTimingMiddleware(BaseMiddleware):
+    """Outer-middleware диспетчера: таймер на время обработки обновления"""
+
+    def __init__(self, recorder: Callable[[RequestTimer], None]):
+        self.recorder = recorder
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_timer.reset(token)
+            timer.finish()
+            # Служебные обновления (меню, админ-панель) без типа запроса не записываем
+            if timer.request_type:
+                try:
+                    self.recorder(timer)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка записи времени запроса: {e}")
+
+
+class TelegramSendTiming(BaseRequestMiddleware):
+    """Middleware сессии бота: вызовы Bot API внутри обработчика - этап «send»"""
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        with stage("send"):
+            return await make_request(bot, method)
+
+
+def percentiles_by_type(request_types: Sequence[str], values: np.ndarray) -> Dict[str, Dict]:
+    """
+    Перцентили PERCENTILES по колонкам values (total + STAGES, мс; NaN - этапа не было)
+    для каждого типа запроса и для всех запросов вместе.
+
+    Returns:
+        {тип: {'count': запросов, 'stages': {этап: (p50, p90, p99, замеров)}}}
+    """
+    columns = ("total",) + STAGES
+    if len(request_types) == 0:
+        return {}
+
+    names, groups = np.unique(np.asarray(request_types), return_inverse=True)
+    result = {}
+    with warnings.catch_warnings():
+        # Этап, которого не было ни в одном запросе группы, - столбец из NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for index, name in enumerate(list(names) + [None]):
+            block = values if name is None else values[groups == index]
+            measured = np.count_nonzero(~np.isnan(block), axis=0)
+            marks = np.nanpercentile(block, PERCENTILES, axis=0)
+            result["all" if name is None else str(name)] = {
+                'count': len(block),
+                'stages': {
+                    column: tuple(float(mark) for mark in marks[:, i]) + (int(measured[i]),)
+                    for i, column in enumerate(columns) if measured[i]
+                }
+            }
+    return result
@@ -0,0 +1,362 @@
+"""
+Хранение истории запросов: сжатие старых текстов, архивы по месяцам, VACUUM/ANALYZE
+
+Основная база bot_database.db держит только «горячие» месяцы:
+- тексты запросов и ответов старше RETENTION_COMPRESS_AFTER_DAYS сжимаются
+  zlib прямо в user_requests (BLOB вместо TEXT, читаются через unz() в SQL);
+- месяцы старше RETENTION_HOT_MONTHS переносятся в отдельные файлы
+  archive/requests_YYYY_MM.db (тексты сжаты), после переноса файл
+  уплотняется и становится доступен только для чтения (полнотекстовый
+  поиск админ-панели, requests_fts, архивы не охватывает);
+- замеры времени по этапам (request_timings) старше RETENTION_TIMINGS_DAYS удаляются;
+- ANALYZE (PRAGMA optimize) - при каждом запуске, VACUUM - раз в неделю.
+
+Суточные агрегаты аналитики остаются в основной базе, поэтому статистика
+по всей истории не требует архивов. Экспорт запросов подключает архивы
+сам (AdminPanel.attach_archives).
+
+Все изменения основной базы выполняются в потоке записи AdminPanel
+(run_maintenance) небольшими транзакциями, между пачками аналитики.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import stat
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from admin_panel import AdminPanel, admin_panel, compress_text
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """Периодическое обслуживание истории запросов"""
+
+    def __init__(self, panel: AdminPanel):
+        self.panel = panel
+        self.stats = {
+            'runs': 0,
+            'compressed_rows': 0,
+            'saved_bytes': 0,
+            'archived_rows': 0,
+            'pruned_timings': 0,
+            'vacuums': 0,
+            'last_run': None,
+            'last_duration': 0.0
+        }
+
+    # ---------- Планировщик ----------
+
+    async def run_periodic(self, first_delay: float = 60.0):
+        """Фоновая задача бота: обслуживание раз в RETENTION_INTERVAL"""
+        delay = first_delay
+        while True:
+            await asyncio.sleep(delay)
+            delay = Config.RETENTION_INTERVAL
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обслуживания истории запросов: {e}")
+
+    def run_once(self):
+        started = time.monotonic()
+        # Сначала архивы: холодные месяцы все равно сжимаются при переносе
+        self.archive_cold_months()
+        self.compress_old_texts()
+        self.prune_timings()
+        self.optimize()
+        self.stats['runs'] += 1
+        self.stats['last_run'] = datetime.now()
+        self.stats['last_duration'] = time.monotonic() - started
+        logger.info(f"🧹 Обслуживание истории запросов завершено за {self.stats['last_duration']:.1f} с")
+
+    def _maintenance(self, operation):
+        """Выполняет операцию в потоке записи и ждет результата"""
+        return self.panel.run_maintenance(operation).result()
+
+    @staticmethod
+    def _counter(conn: sqlite3.Connection, name: str) -> int:
+        row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_counter(conn: sqlite3.Connection, name: str, value: int):
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value))
+
+    # ---------- Сжатие старых текстов ----------
+
+    def compress_old_texts(self) -> int:
+        """Сжимает тексты запросов старше RETENTION_COMPRESS_AFTER_DAYS"""
+        cutoff = datetime.utcnow() - timedelta(days=Config.RETENTION_COMPRESS_AFTER_DAYS)
+        cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+        compressed_before = self.stats['compressed_rows']
+        while True:
+            processed = self._maintenance(lambda conn: self._compress_chunk(conn, cutoff))
+            if processed < Config.RETENTION_BATCH_SIZE:
+                break
+        compressed = self.stats['compressed_rows'] - compressed_before
+        if compressed:
+            logger.info(f"🗜 Сжато старых запросов: {compressed}")
+        return compressed
+
+    def _compress_chunk(self, conn: sqlite3.Connection, cutoff: str) -> int:
+        # Отметка: запросы с id не больше нее уже обработаны (id растут вместе со временем)
+        watermark = self._counter(conn, 'retention_compressed_id')
+        rows = conn.execute("""
+            SELECT id, request_text, response_text, timestamp
+            FROM user_requests
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (watermark, Config.RETENTION_BATCH_SIZE)).fetchall()
+
+        updates = []
+        processed = 0
+        saved = 0
+        for row_id, request_text, response_text, timestamp in rows:
+            if timestamp is None or str(timestamp) >= cutoff:
+                break
+            processed += 1
+            watermark = row_id
+            packed_request, packed_response = compress_text(request_text), compress_text(response_text)
+            if packed_request is not request_text or packed_response is not response_text:
+                saved += self._size(request_text) + self._size(response_text)
+                saved -= self._size(packed_request) + self._size(packed_response)
+                updates.append((packed_request, packed_response, row_id))
+
+        if processed:
+            with conn:
+                conn.executemany("UPDATE user_requests SET request_text = ?, response_text = ? WHERE id = ?",
+                                 updates)
+                self._set_counter(conn, 'retention_compressed_id', watermark)
+            self.stats['compressed_rows'] += len(updates)
+            self.stats['saved_bytes'] += saved
+        return processed
+
+    @staticmethod
+    def _size(value) -> int:
+        if isinstance(value, str):
+            return len(value.encode('utf-8'))
+        return len(value) if value else 0
+
+    # ---------- Архивы по месяцам ----------
+
+    @staticmethod
+    def archive_path(month: str) -> str:
+        """Файл архива месяца YYYY-MM"""
+        return os.path.join(Config.RETENTION_ARCHIVE_DIR, f"requests_{month.replace('-', '_')}.db")
+
+    @staticmethod
+    def _month_bounds(first: str, boundary: str) -> List[Tuple[str, str]]:
+        """Месяцы [начало, конец) от месяца first до boundary (не включая)"""
+        months = []
+        year, month = int(first[:4]), int(first[5:7])
+        while f"{year:04d}-{month:02d}-01" < boundary:
+            start = f"{year:04d}-{month:02d}-01"
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            months.append((start, f"{year:04d}-{month:02d}-01"))
+        return months
+
+    def cold_boundary(self) -> str:
+        """Начало самого старого «горячего» месяца (UTC)"""
+        now = datetime.utcnow()
+        index = now.year * 12 + (now.month - 1) - Config.RETENTION_HOT_MONTHS
+        return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+    def archive_cold_months(self) -> int:
+        """Переносит месяцы старше RETENTION_HOT_MONTHS в архивы"""
+        self.remove_empty_archives()
+        boundary = self.cold_boundary()
+        # Рабочая база, а не снимок админ-панели: переносим то, что есть сейчас
+        oldest = self._maintenance(lambda conn: conn.execute("SELECT MIN(timestamp) FROM user_requests").fetchone()[0])
+        if oldest is None or str(oldest) >= boundary:
+            return 0
+
+        os.makedirs(Config.RETENTION_ARCHIVE_DIR, exist_ok=True)
+        total = 0
+        for start, end in self._month_bounds(str(oldest), boundary):
+            # Месяц без запросов (перерыв в работе) - архив не создаем: пустые файлы
+            # занимали бы места ARCHIVE_ATTACH_LIMIT при экспорте
+            has_rows = self._maintenance(lambda conn: conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM user_requests WHERE timestamp >= ? AND timestamp < ?)",
+                (start, end)
+            ).fetchone()[0])
+            if not has_rows:
+                continue
+
+            path = self.archive_path(start[:7])
+            if os.path.exists(path):
+                # Поздние записи за уже заархивированный месяц - дописываем
+                os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            moved = 0
+            while True:
+                chunk = self._maintenance(lambda conn: self._archive_chunk(conn, path, start, end))
+                moved += chunk
+                if chunk < Config.RETENTION_BATCH_SIZE:
+                    break
+
+            if os.path.exists(path):
+                if moved:
+                    self._finalize_archive(path)
+                    logger.info(f"📦 Месяц {start[:7]} перенесен в архив: {moved} запросов")
+                os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            total += moved
+
+        self.stats['archived_rows'] += total
+        if total and self.panel.snapshot_time is not None:
+            # Иначе экспорт увидит перенесенные строки и в снимке, и в архиве
+            self.panel.refresh_snapshot()
+        return total
+
+    @staticmethod
+    def remove_empty_archives() -> int:
+        """Удаляет архивы без запросов (создавались для месяцев без данных)"""
+        if not os.path.isdir(Config.RETENTION_ARCHIVE_DIR):
+            return 0
+        removed = 0
+        for name in sorted(os.listdir(Config.RETENTION_ARCHIVE_DIR)):
+            if not (name.startswith("requests_") and name.endswith(".db")):
+                continue
+            path = os.path.join(Config.RETENTION_ARCHIVE_DIR, name)
+            conn = sqlite3.connect(path)
+            try:
+                empty = not AdminPanel.archive_has_rows(conn, "main")
+            finally:
+                conn.close()
+            if empty:
+                try:
+                    os.remove(path)
+                    removed += 1
+                    logger.info(f"🗑 Удален пустой архив {name}")
+                except OSError as e:
+                    logger.warning(f"⚠️ Не удалось удалить пустой архив {name}: {e}")
+        return removed
+
+    @staticmethod
+    def _archive_chunk(conn: sqlite3.Connection, path: str, start: str, end: str) -> int:
+        conn.execute("ATTACH DATABASE ? AS cold", (path,))
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cold.user_requests (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    request_type TEXT,
+                    request_text TEXT,
+                    response_text TEXT,
+                    timestamp TIMESTAMP,
+                    processing_time REAL,
+                    status TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS cold.idx_user_requests_timestamp ON user_requests(timestamp)")
+
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM main.user_requests WHERE timestamp >= ? AND timestamp < ? LIMIT ?",
+                (start, end, Config.RETENTION_BATCH_SIZE)
+            )]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                with conn:
+                    # Повторный перенос после сбоя безопасен: уже перенесенные строки пропускаются
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO cold.user_requests
+                        SELECT id, user_id, request_type, zip_text(request_text), zip_text(response_text),
+                               timestamp, processing_time, status
+                        FROM main.user_requests WHERE id IN ({marks})
+                    """, ids)
+                    # Архивы в полнотекстовый поиск не входят; FTS5 удаляет по исходному тексту
+                    conn.execute(f"""
+                        INSERT INTO main.requests_fts (requests_fts, rowid, request_text)
+                        SELECT 'delete', id, unz(request_text) FROM main.user_requests WHERE id IN ({marks})
+                    """, ids)
+                    conn.execute(f"DELETE FROM main.user_requests WHERE id IN ({marks})", ids)
+            return len(ids)
+        finally:
+            conn.execute("DETACH DATABASE cold")
+
+    @staticmethod
+    def _finalize_archive(path: str):
+        """Уплотняет архив и обновляет статистику планировщика"""
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("ANALYZE")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    # ---------- Время обработки по этапам ----------
+
+    def prune_timings(self) -> int:
+        """Удаляет замеры времени старше RETENTION_TIMINGS_DAYS (нужны только свежие перцентили)"""
+        cutoff = int(time.time()) - Config.RETENTION_TIMINGS_DAYS * 86400
+
+        def prune(conn: sqlite3.Connection) -> int:
+            with conn:
+                return conn.execute("""
+                    DELETE FROM request_timings WHERE id IN (
+                        SELECT id FROM request_timings WHERE ts < ? LIMIT ?
+                    )
+                """, (cutoff, Config.RETENTION_BATCH_SIZE)).rowcount
+
+        pruned = 0
+        while True:
+            chunk = self._maintenance(prune)
+            pruned += chunk
+            if chunk < Config.RETENTION_BATCH_SIZE:
+                break
+        self.stats['pruned_timings'] += pruned
+        return pruned
+
+    # ---------- VACUUM / ANALYZE ----------
+
+    def optimize(self):
+        """PRAGMA optimize при каждом запуске, VACUUM - раз в RETENTION_VACUUM_INTERVAL"""
+        def run(conn: sqlite3.Connection) -> bool:
+            conn.execute("PRAGMA optimize")
+            last_vacuum = self._counter(conn, 'retention_last_vacuum')
+            if time.time() - last_vacuum < Config.RETENTION_VACUUM_INTERVAL:
+                return False
+            with conn:
+                # Слияние сегментов индекса поиска после удалений перед VACUUM
+                conn.execute("INSERT INTO requests_fts (requests_fts) VALUES ('optimize')")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            with conn:
+                self._set_counter(conn, 'retention_last_vacuum', int(time.time()))
+            return True
+
+        if self._maintenance(run):
+            self.stats['vacuums'] += 1
+            logger.info(f"🧹 VACUUM основной базы: {self._file_size(self.panel.db_path) / 1024 / 1024:.1f} МБ")
+
+    # ---------- Статистика ----------
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def get_stats(self) -> Dict:
+        archives = sorted(
+            name for name in os.listdir(Config.RETENTION_ARCHIVE_DIR)
+            if name.startswith("requests_") and name.endswith(".db")
+        ) if os.path.isdir(Config.RETENTION_ARCHIVE_DIR) else []
+        return {
+            **self.stats,
+            'db_bytes': self._file_size(self.panel.db_path),
+            'archives': len(archives),
+            'archive_bytes': sum(self._file_size(os.path.join(Config.RETENTION_ARCHIVE_DIR, name))
+                                 for name in archives)
+        }
+
+
+# Глобальный экземпляр обслуживания истории
+retention_manager = RetentionManager(admin_panel)
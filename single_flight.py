@@ -0,0 +1,85 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+Параллельные вызовы с одним ключом ждут один общий результат
+вместо того, чтобы каждый раз обращаться к внешнему API.
+Частичные результаты (потоковый ответ) получают все ожидающие с on_partial.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PartialCallback = Callable[[Any], Awaitable[None]]
+
+
+class _Flight:
+    """Выполняющийся вызов: задача и подписчики на частичные результаты"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: List[PartialCallback] = []
+        self.partial = None     # Последний частичный результат - для присоединившихся позже
+
+    async def publish(self, partial):
+        """Передает частичный результат всем подписчикам; ошибка одного не мешает остальным"""
+        self.partial = partial
+        for callback in list(self.subscribers):
+            try:
+                await callback(partial)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка передачи частичного результата: {e}")
+
+
+class SingleFlight:
+    """Дедупликация одновременных вызовов по ключу"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, _Flight] = {}
+        self.stats = {
+            'leaders': 0,   # Реальных вызовов к источнику
+            'shared': 0     # Вызовов, получивших чужой результат (сэкономлено)
+        }
+
+    async def do(self, key: str, factory: Callable[[PartialCallback], Awaitable],
+                 on_partial: Optional[PartialCallback] = None):
+        """
+        Выполняет factory(publish) один раз для всех одновременных вызовов с ключом key.
+        publish(partial) передает частичный результат в on_partial каждого ожидающего.
+        """
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.stats['shared'] += 1
+            logger.info(f"🔗 [{self.name}] Присоединяюсь к уже выполняющемуся запросу")
+            if on_partial is not None and flight.partial is not None:
+                await on_partial(flight.partial)
+        else:
+            flight = _Flight()
+            # Запускаем отдельной задачей: отмена одного ожидающего не прерывает остальных
+            flight.task = asyncio.ensure_future(factory(flight.publish))
+            self._inflight[key] = flight
+            self.stats['leaders'] += 1
+            flight.task.add_done_callback(lambda finished: self._forget(key, flight))
+
+        if on_partial is not None:
+            flight.subscribers.append(on_partial)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            if on_partial is not None:
+                flight.subscribers.remove(on_partial)
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        # Помечаем исключение как обработанное, даже если все ожидающие отменены
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'in_flight': len(self._inflight)
+        }
@@ -5,10 +5,12 @@ TTS (Text-to-Speech) сервис для генерации голосовых 
 
 import os
 import io
+import asyncio
 import tempfile
 import logging
 from typing import Optional, BinaryIO
-from openai import OpenAI
+from openai_gateway import get_openai_gateway
+from request_timing import stage
 
 # Безопасный импорт pydub с обработкой ошибок
 try:
@@ -26,7 +28,7 @@ class TTSService:
     """Сервис для генерации голосовых ответов через OpenAI TTS API"""
     
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        self.openai = get_openai_gateway(api_key)
         self.model = "tts-1-hd"  # Высококачественная модель TTS
         self.voice = "alloy"     # Голос по умолчанию (можно изменить на nova, echo, fable, onyx, shimmer)
         
@@ -56,20 +58,19 @@ class TTSService:
                 
             logger.info(f"🎤 Генерирую голосовое сообщение (длина: {len(clean_text)} символов)")
             
-            # Генерируем речь через OpenAI TTS API
-            response = self.client.audio.speech.create(
-                model=self.model,
-                voice=self.voice,
-                input=clean_text,
-                speed=1.0  # Нормальная скорость речи
-            )
-            
-            # Получаем MP3 данные
-            mp3_data = response.content
-            logger.info(f"✅ TTS API ответил, размер MP3: {len(mp3_data)} байт")
-            
-            # Конвертируем MP3 в OGG для Telegram
-            ogg_data = self._convert_mp3_to_ogg(mp3_data)
+            # Этап «tts» - синтез и конвертация вместе
+            with stage("tts"):
+                # Генерируем речь через общий асинхронный клиент OpenAI
+                mp3_data = await self.openai.speech(
+                    model=self.model,
+                    voice=self.voice,
+                    input=clean_text,
+                    speed=1.0  # Нормальная скорость речи
+                )
+                logger.info(f"✅ TTS API ответил, размер MP3: {len(mp3_data)} байт")
+                
+                # Конвертируем MP3 в OGG для Telegram (ffmpeg в отдельном потоке, чтобы не блокировать бота)
+                ogg_data = await asyncio.to_thread(self._convert_mp3_to_ogg, mp3_data)
             
             if ogg_data:
                 logger.info(f"✅ Конвертация в OGG завершена, размер: {len(ogg_data)} байт")